@@ -0,0 +1,53 @@
+# bench_batching.py
+# Measures what batching short invoices into one Gemini request saves: requests (the quota that
+# is rate limited), bytes sent (the schema prompt is sent once per request instead of once per
+# invoice) and wall time, against a mock endpoint whose latency grows with the response size.
+#
+#   python benchmarks/bench_batching.py --files 40 --batch-sizes 1 2 4 8
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import make_corpus
+from mock_gemini import MockGeminiServer
+from gemini_client import GeminiClient
+from pipeline import process_invoice_batch
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--items", type=int, default=2, help="Line items per (short, one-page) invoice")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.4, help="Mock round trip in seconds")
+    parser.add_argument("--latency-per-kb", type=float, default=0.05, help="Mock generation time per KB of response")
+    parser.add_argument("--io-workers", type=int, default=4)
+    args = parser.parse_args()
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_corpus(tmp, args.files, n_items=args.items)
+        baseline = None
+        for batch_size in args.batch_sizes:
+            with MockGeminiServer(latency=args.latency, echo=True, latency_per_kb=args.latency_per_kb) as server:
+                client = GeminiClient("bench-key", api_url=server.url, requests_per_minute=None, pool_size=args.io_workers)
+                start = time.perf_counter()
+                rows = process_invoice_batch(paths, "bench-key", io_workers=args.io_workers, client=client,
+                                             batch_size=batch_size)
+                elapsed = time.perf_counter() - start
+                client.close()
+                baseline = baseline or rows
+                report.append((batch_size, server.requests_seen, server.httpd.bytes_received, elapsed, rows == baseline))
+
+    print(f"\n{args.files} one-page invoices, {args.items} items each; mock latency {args.latency:.2f}s "
+          f"+ {args.latency_per_kb:.2f}s/KB of response, {args.io_workers} I/O workers")
+    print(f"{'batch':>5} {'requests':>9} {'KB sent':>9} {'time':>8} {'files/s':>8}  same rows")
+    for batch_size, requests, sent, elapsed, same in report:
+        print(f"{batch_size:>5} {requests:>9} {sent / 1024:>9.1f} {elapsed:>7.2f}s {args.files / elapsed:>8.2f}  {same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# bench_client.py
+# Load-tests GeminiClient against the local mock server: throughput, retries and failures
+# under a configurable error rate, concurrency and rate limit.
+#
+#   python benchmarks/bench_client.py --requests 200 --concurrency 16 --error-rate 0.1
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gemini_client import GeminiClient
+from mock_gemini import MockGeminiServer
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock API latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="Fraction of mock responses that are 429/503")
+    parser.add_argument("--rpm", type=int, default=0, help="Client requests-per-minute limit (0 = unlimited)")
+    args = parser.parse_args()
+
+    with MockGeminiServer(latency=args.latency, error_rate=args.error_rate) as server:
+        client = GeminiClient("bench-key", api_url=server.url, requests_per_minute=args.rpm or None,
+                              pool_size=args.concurrency, backoff_base=0.05, backoff_max=1.0)
+        prompt = "Extract the invoice.\n" + "x" * 4000
+        failures = 0
+        start = time.perf_counter()
+        with client, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for future in [pool.submit(client.generate, prompt) for _ in range(args.requests)]:
+                try:
+                    future.result()
+                except ConnectionError:
+                    failures += 1
+        elapsed = time.perf_counter() - start
+
+    print(f"{args.requests} calls in {elapsed:.2f}s ({args.requests / elapsed:.1f} calls/s) "
+          f"at concurrency {args.concurrency}, mock error rate {args.error_rate:.0%}")
+    print(f"HTTP requests: {client.stats['requests']}  retries: {client.stats['retries']}  "
+          f"calls failed after retries: {failures}")
+
+if __name__ == "__main__":
+    main()
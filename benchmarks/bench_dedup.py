@@ -0,0 +1,72 @@
+# bench_dedup.py
+# Checks that the duplicate-invoice index stays fast as it grows to hundreds of thousands of
+# invoices: fills an index with synthetic invoices and times the file hash, invoice key and
+# near-duplicate text lookups, plus opening the index, against the sizes given.
+#
+#   python benchmarks/bench_dedup.py --invoices 10000 100000 300000
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extractor
+from corpus import make_corpus
+from dedup import DuplicateIndex, text_fingerprint
+from local_extractor import GSTIN_CHARS
+
+def synthetic_invoices(count, start=0, seed=0):
+    """(rows, pdf_path, pdf_hash, fingerprint) for random suppliers, numbers, dates and totals."""
+    for i in range(start, start + count):
+        rng = random.Random(seed * 1000003 + i)
+        gstin = f"{rng.randint(1, 37):02d}" + "".join(rng.choice(GSTIN_CHARS) for _ in range(13))
+        row = {"GSTIN/UIN": gstin, "Invoice No": f"INV-{i}", "Invoice Date": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2026",
+               "Total Amount": round(rng.uniform(100, 100000), 2)}
+        yield [row], f"invoice_{i}.pdf", f"{rng.getrandbits(256):064x}", rng.getrandbits(64)
+
+def time_per_call(func, keys):
+    start = time.perf_counter()
+    for key in keys:
+        func(key)
+    return (time.perf_counter() - start) / len(keys)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, nargs="+", default=[10000, 100000, 300000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        texts = [extractor.extract_text_from_pdf(path) for path in make_corpus(os.path.join(tmp, "pdfs"), 20)]
+        db_path = os.path.join(tmp, "invoices.sqlite3")
+        print(f"{'invoices':>9} {'open':>9} {'file hash':>10} {'key':>10} {'text':>10} {'found':>6}")
+        indexed = 0
+        for count in sorted(args.invoices):
+            index = DuplicateIndex(db_path)
+            for start in range(indexed, count, 10000):
+                index.add_many(list(synthetic_invoices(min(10000, count - start), start)))
+            indexed = count
+            index.close()
+
+            start = time.perf_counter()
+            index = DuplicateIndex(db_path)
+            load = time.perf_counter() - start
+
+            # Half of the lookups are for invoices in the index, half for new ones.
+            known = random.Random(1).sample(range(count), args.lookups // 2)
+            samples = [next(synthetic_invoices(1, i)) for i in known] + list(synthetic_invoices(args.lookups // 2, count))
+            found = sum(1 for rows, _, pdf_hash, _ in samples if index.match_file(pdf_hash))
+            file_lookup = time_per_call(index.match_file, [pdf_hash for _, _, pdf_hash, _ in samples])
+            key_lookup = time_per_call(index.match_rows, [rows for rows, *_ in samples])
+            fingerprints = [text_fingerprint(text) for text in texts]
+            text_lookup = time_per_call(lambda i: index.match_text(texts[i], fingerprints[i]), range(len(texts)))
+            index.close()
+            print(f"{count:>9} {load * 1000:>7.1f}ms {file_lookup * 1e6:>8.1f}us {key_lookup * 1e6:>8.1f}us "
+                  f"{text_lookup * 1e6:>8.1f}us {found:>6}")
+
+if __name__ == "__main__":
+    main()
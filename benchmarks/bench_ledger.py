@@ -0,0 +1,75 @@
+# bench_ledger.py
+# Appends one batch of rows to a large existing ledger, comparing the original openpyxl
+# append-mode ExcelWriter against the streaming ledger writer (time and peak Python memory).
+#
+#   python benchmarks/bench_ledger.py --existing-rows 20000 --new-rows 500
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+import pandas as pd
+from ledger_writer import LEDGER_COLUMNS, StreamingLedgerWriter
+
+def sample_row(i):
+    row = {col: f"{col} {i}" for col in LEDGER_COLUMNS}
+    row.update({'QTY': i % 50, 'Rate': 12.5, 'Amount': 12.5 * (i % 50)})
+    return row
+
+def make_ledger(path, rows):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    sheet.append(LEDGER_COLUMNS)
+    for i in range(rows):
+        row = sample_row(i)
+        sheet.append([row[col] for col in LEDGER_COLUMNS])
+    workbook.save(path)
+
+def legacy_append(path, rows):
+    """The original save_to_excel append path."""
+    final_df = pd.DataFrame(rows).reindex(columns=LEDGER_COLUMNS).fillna("NA")
+    with pd.ExcelWriter(path, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
+        startrow = writer.book['Sheet1'].max_row
+        final_df.to_excel(writer, sheet_name='Sheet1', index=False, header=False, startrow=startrow)
+
+def streaming_append(path, rows):
+    writer = StreamingLedgerWriter(path, chunk_rows=len(rows) + 1)
+    for row in rows:
+        writer.append_rows([row])
+    writer.close()
+
+def measure(label, func, path, rows):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(path, rows)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<10} {elapsed:8.2f}s  peak {peak / (1024 * 1024):8.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--existing-rows", type=int, default=20000)
+    parser.add_argument("--new-rows", type=int, default=500)
+    args = parser.parse_args()
+
+    new_rows = [sample_row(i) for i in range(args.new_rows)]
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, "base.xlsx")
+        make_ledger(base, args.existing_rows)
+        print(f"Appending {args.new_rows} rows to a {args.existing_rows}-row ledger "
+              f"({os.path.getsize(base) / (1024 * 1024):.1f} MB)")
+        for label, func in (("openpyxl", legacy_append), ("streaming", streaming_append)):
+            path = os.path.join(tmp, f"{label}.xlsx")
+            with open(base, "rb") as src, open(path, "wb") as dst:
+                dst.write(src.read())
+            measure(label, func, path, new_rows)
+
+if __name__ == "__main__":
+    main()
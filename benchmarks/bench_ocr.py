@@ -0,0 +1,63 @@
+# bench_ocr.py
+# Compares OCR throughput (pages/sec) of the original one-page-at-a-time PNG round trip
+# against extractor.extract_text_with_ocr on synthetic scanned PDFs. Requires Tesseract.
+#
+#   python benchmarks/bench_ocr.py --files 3 --pages 8
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+import pytesseract
+from PIL import Image
+from corpus import make_corpus
+from extractor import extract_text_with_ocr
+
+def legacy_ocr(pdf_path):
+    """The original implementation: serial pages, PNG encode and PIL decode for every page."""
+    doc = fitz.open(pdf_path)
+    full_text = ""
+    for page in doc:
+        pix = page.get_pixmap(dpi=300)
+        image = Image.open(io.BytesIO(pix.tobytes("png")))
+        full_text += pytesseract.image_to_string(image, lang='eng') + "\n"
+    doc.close()
+    return full_text
+
+def timed(label, func, paths, pages):
+    start = time.perf_counter()
+    texts = [func(path) for path in paths]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed:7.2f}s  {pages / elapsed:6.2f} pages/s")
+    return texts, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=3)
+    parser.add_argument("--pages", type=int, default=8, help="Pages per scanned PDF")
+    parser.add_argument("--workers", type=int, default=None, help="OCR worker processes (default: cores - 1)")
+    args = parser.parse_args()
+
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        sys.exit(f"Tesseract is required for this benchmark: {e}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_corpus(tmp, args.files, pages=args.pages, scanned=True)
+        total_pages = args.files * args.pages
+        print(f"{args.files} scanned PDFs x {args.pages} pages = {total_pages} pages")
+        legacy_texts, legacy_time = timed("Serial PNG round trip", legacy_ocr, paths, total_pages)
+        pooled_texts, pooled_time = timed("Process pool, raw", lambda p: extract_text_with_ocr(p, args.workers), paths, total_pages)
+
+    matching = sum(a.split() == b.split() for a, b in zip(legacy_texts, pooled_texts))
+    print(f"Speed-up: {legacy_time / pooled_time:.2f}x  ({matching}/{len(paths)} files with identical text)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# bench_pages.py
+# Peak memory and pages/sec of reading long statements (a digital invoice page followed by
+# scanned annexures): the original PNG round trip (every page rendered in RGB and PNG-encoded)
+# against the page policies of extractor.iter_page_texts (RGB or grayscale, and stopping at
+# the page with the invoice total). Every configuration runs in a fresh process so its peak RSS
+# is its own. Without Tesseract the pages are only rendered, which is where the memory goes;
+# with it they are OCR'd as well.
+#
+#   python benchmarks/bench_pages.py --pages 10 50 200
+
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # PyMuPDF
+import pytesseract
+from PIL import Image
+import extractor
+from corpus import write_invoice
+from extractor import PagePolicy, iter_page_texts, render_page
+
+CONFIGS = {
+    "PNG round trip": None,
+    "policy, RGB": PagePolicy(grayscale=False),
+    "policy, grayscale": PagePolicy(),
+    "grayscale, stop at total": PagePolicy(stop_at_total=True),
+}
+
+def tesseract_available():
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def render_only(pdf_path, page_number, policy):
+    """Stands in for extractor.ocr_page when Tesseract is missing: renders the page and frees it."""
+    with fitz.open(pdf_path) as doc:
+        image, pix = render_page(doc[page_number], policy)
+        image.close()
+        del image, pix
+        fitz.TOOLS.store_shrink(100)
+    return ""
+
+def legacy_read(pdf_path, ocr):
+    """The original reader: RGB at 300 dpi, PNG encode and decode per page."""
+    pages = 0
+    doc = fitz.open(pdf_path)
+    for page in doc:
+        pix = page.get_pixmap(dpi=300)
+        image = Image.open(io.BytesIO(pix.tobytes("png")))
+        if ocr:
+            pytesseract.image_to_string(image, lang='eng')
+        else:
+            image.load()
+        pages += 1
+    doc.close()
+    return pages
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process and its OCR workers. On Linux ru_maxrss of a freshly started process
+    still counts its parent's memory at fork time, so the process's own VmHWM is used instead.
+    """
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/status") as f:
+            peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+    except (OSError, StopIteration):
+        pass
+    return max(peak_kb, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+def run_config(name, pdf_path, workers, ocr):
+    """Runs one configuration in this process and returns (pages read, seconds, peak RSS in MB)."""
+    if not ocr:
+        extractor.ocr_page = render_only
+    start = time.perf_counter()
+    if CONFIGS[name] is None:
+        pages = legacy_read(pdf_path, ocr)
+    else:
+        pages = sum(1 for _ in iter_page_texts(pdf_path, workers, CONFIGS[name]))
+    seconds = time.perf_counter() - start
+    return pages, seconds, peak_rss_mb()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200], help="Pages per statement")
+    parser.add_argument("--workers", type=int, default=1, help="OCR worker processes")
+    parser.add_argument("--child", nargs=2, metavar=("CONFIG", "PDF"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    ocr = tesseract_available()
+    if args.child:
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            result = run_config(args.child[0], args.child[1], args.workers, ocr)
+            sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    print("Tesseract found: rendering and OCR" if ocr else "Tesseract not found: measuring rendering only")
+    print(f"{'pages':>5}  {'configuration':<26} {'read':>5} {'seconds':>8} {'pages/s':>8} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for page_count in args.pages:
+            path = os.path.join(tmp, f"statement_{page_count}.pdf")
+            write_invoice(path, page_count, page_kinds=("digital",) + ("scanned",) * (page_count - 1))
+            for name in CONFIGS:
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), "--workers", str(args.workers),
+                                         "--child", name, path], capture_output=True, text=True, check=True).stdout
+                pages, seconds, peak = json.loads(output.strip().splitlines()[-1])
+                print(f"{page_count:>5}  {name:<26} {pages:>5} {seconds:>8.2f} {pages / seconds:>8.1f} {peak:>8.1f}")
+
+if __name__ == "__main__":
+    main()
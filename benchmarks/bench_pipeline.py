@@ -0,0 +1,47 @@
+# bench_pipeline.py
+# Compares the serial per-file loop against pipeline.process_invoice_batch using a local stub API.
+#
+#   python benchmarks/bench_pipeline.py --files 40 --latency 0.5 --io-workers 8
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import make_corpus
+from mock_gemini import MockGeminiServer
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub API latency in seconds")
+    parser.add_argument("--cpu-workers", type=int, default=None)
+    parser.add_argument("--io-workers", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, MockGeminiServer(latency=args.latency) as server:
+        os.environ["GEMINI_API_URL"] = server.url  # Picked up by GeminiClient
+        import extractor
+        from pipeline import process_invoice_batch
+
+        paths = make_corpus(tmp, args.files)
+
+        start = time.perf_counter()
+        serial_rows = [extractor.process_invoice_file(path, "bench-key") for path in paths]
+        serial_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch_rows = process_invoice_batch(paths, "bench-key", cpu_workers=args.cpu_workers, io_workers=args.io_workers)
+        batch_time = time.perf_counter() - start
+
+    assert serial_rows == batch_rows, "Concurrent results differ from the serial results"
+    print(f"\nFiles: {args.files}  stub latency: {args.latency:.2f}s  io workers: {args.io_workers}")
+    print(f"Serial:     {serial_time:7.2f}s  ({args.files / serial_time:6.2f} files/s)")
+    print(f"Concurrent: {batch_time:7.2f}s  ({args.files / batch_time:6.2f} files/s)")
+    print(f"Speed-up:   {serial_time / batch_time:7.2f}x")
+
+if __name__ == "__main__":
+    main()
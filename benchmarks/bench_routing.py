@@ -0,0 +1,84 @@
+# bench_routing.py
+# Compares the original whole-document OCR fallback (OCR everything when the PDF has < 150
+# characters of text) with per-page routing on a mixed synthetic corpus: OCR calls, total
+# latency, and how many scanned pages each approach left unread.
+#
+#   python benchmarks/bench_routing.py --files 40
+#   python benchmarks/bench_routing.py --files 40 --simulate-ocr 1.5   # without Tesseract
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extractor
+from corpus import make_mixed_corpus
+
+def legacy_extract(pdf_path):
+    """The original routing: direct text, or OCR of every page if the whole document is short."""
+    text = extractor.extract_text_from_pdf(pdf_path)
+    if len(text.strip()) < 150:
+        with extractor.fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        text = "".join(t + "\n" for t in extractor.ocr_pages(pdf_path, list(range(page_count)), max_workers=1))
+    return text
+
+def routed_extract(pdf_path):
+    return extractor.extract_text_routed(pdf_path, ocr_workers=1)[0]
+
+def scanned_pages(paths):
+    """Returns the (path, page_number) pairs whose content exists only as an image."""
+    pages = set()
+    for path in paths:
+        with extractor.fitz.open(path) as doc:
+            for page in doc:
+                if extractor.image_coverage(page) >= extractor.SCANNED_PAGE_COVERAGE and not page.get_text("text").strip():
+                    pages.add((path, page.number))
+    return pages
+
+def run(label, func, paths, scanned):
+    ocr_calls = set()
+    real_ocr_page = extractor.ocr_page
+
+    def counting_ocr_page(pdf_path, page_number, *args, **kwargs):
+        ocr_calls.add((pdf_path, page_number))
+        return real_ocr_page(pdf_path, page_number, *args, **kwargs)
+
+    extractor.ocr_page = counting_ocr_page
+    try:
+        start = time.perf_counter()
+        for path in paths:
+            func(path)
+        elapsed = time.perf_counter() - start
+    finally:
+        extractor.ocr_page = real_ocr_page
+    missed = len(scanned - ocr_calls)
+    print(f"{label:<10} OCR calls: {len(ocr_calls):4d}  total: {elapsed:7.2f}s  scanned pages left unread: {missed}")
+    return len(ocr_calls), elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--simulate-ocr", type=float, default=None, metavar="SECONDS",
+                        help="Replace Tesseract with a fixed per-page delay (when Tesseract is not installed)")
+    args = parser.parse_args()
+
+    if args.simulate_ocr is not None:
+        extractor.pytesseract.image_to_string = lambda image, lang=None: (time.sleep(args.simulate_ocr), "")[1]
+        print(f"Simulating OCR at {args.simulate_ocr:.2f}s per page (page text is not read).")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_mixed_corpus(tmp, args.files)
+        scanned = scanned_pages(paths)
+        print(f"{len(paths)} PDFs (short digital, long digital, digital with one scanned page, fully scanned), "
+              f"{len(scanned)} scanned pages")
+        legacy_calls, legacy_time = run("legacy", legacy_extract, paths, scanned)
+        routed_calls, routed_time = run("per-page", routed_extract, paths, scanned)
+
+    print(f"OCR calls saved: {legacy_calls - routed_calls}  latency: {legacy_time:.2f}s -> {routed_time:.2f}s")
+
+if __name__ == "__main__":
+    main()
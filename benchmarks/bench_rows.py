@@ -0,0 +1,74 @@
+# bench_rows.py
+# Compares the original per-item row dicts (the whole ~60-field header copied into every line
+# item, then a pandas DataFrame of object columns full of "NA") with the typed InvoiceRows
+# model (header stored once, item columns, flattened into an Arrow table only at export):
+# build time, export time and peak Python memory for large invoices.
+#
+#   python benchmarks/bench_rows.py --invoices 1000 --items 200
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from extractor import GEMINI_SCHEMA, build_invoice_rows
+from invoice_model import HEADER_FIELDS, ITEM_FIELDS, to_arrow
+from ledger_writer import LEDGER_COLUMNS
+
+def sample_invoice(i, n_items, rng):
+    data = copy.deepcopy(GEMINI_SCHEMA)
+    data["invoiceHeader"].update(invoiceNo=f"INV/{i:05d}", invoiceDate=f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2026")
+    data["supplierDetails"].update(name=f"Supplier {i % 50}", gstin="33AAJFL3326H1ZI")
+    data["lineItems"] = [dict(GEMINI_SCHEMA["lineItems"][0], itemName=f"Item {j}", hsnCode="30041030",
+                              qty=rng.randint(1, 50), rate=round(rng.uniform(10, 900), 2)) for j in range(n_items)]
+    for item in data["lineItems"]:
+        item["amount"] = round(item["qty"] * item["rate"], 2)
+    data["summary"]["totalAmount"] = round(sum(item["amount"] for item in data["lineItems"]), 2)
+    return data
+
+def legacy_rows(structured_data):
+    """The original build_invoice_rows: one dict with every header field per line item."""
+    base = {column: structured_data.get(section, {}).get(field) for column, section, field, _ in HEADER_FIELDS}
+    return [{**base, **{column: item.get(field) for column, field, _ in ITEM_FIELDS}}
+            for item in structured_data.get("lineItems") or [{}]]
+
+def legacy_export(invoices):
+    rows = [row for rows in invoices for row in rows]
+    return pd.DataFrame(rows).reindex(columns=LEDGER_COLUMNS).fillna("NA")
+
+def measure(build, export, data):
+    tracemalloc.start()
+    start = time.perf_counter()
+    invoices = [build(d) for d in data]
+    built = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    export(invoices)
+    exported = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return built, exported, held, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--invoices", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    data = [sample_invoice(i, args.items, rng) for i in range(args.invoices)]
+    print(f"{args.invoices} invoices x {args.items} line items ({args.invoices * args.items} rows)")
+    print(f"{'model':<14} {'build':>8} {'export':>8} {'held MB':>8} {'peak MB':>8}")
+    for label, build, export in (("row dicts", legacy_rows, legacy_export),
+                                 ("InvoiceRows", build_invoice_rows, lambda invoices: to_arrow(invoices, LEDGER_COLUMNS))):
+        built, exported, held, peak = measure(build, export, data)
+        print(f"{label:<14} {built:>7.2f}s {exported:>7.2f}s {held / 2**20:>8.1f} {peak / 2**20:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# bench_suite.py
+# End-to-end offline benchmark of the stages a ledger run goes through, on synthetic GST
+# invoices and the local Gemini stand-in (no network, API key or sample PDFs needed):
+#   text     extract_text_from_pdf on digital invoices
+#   ocr      extract_text_with_ocr on scanned invoices (skipped without Tesseract)
+#   process  process_invoice_file against the mock generateContent server
+#   export   the rows of every invoice appended to an Excel ledger
+# Every stage runs in a fresh process and reports throughput, p50/p95 latency per invoice and
+# its peak RSS. `--json` saves the results and `--compare` prints the change against saved
+# results, so a regression shows up as a slower or larger stage.
+#
+#   python benchmarks/bench_suite.py --files 50 --latency 0.2 --error-rate 0.05 --json bench.json
+#   python benchmarks/bench_suite.py --files 50 --latency 0.2 --error-rate 0.05 --compare bench.json
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pages import peak_rss_mb, tesseract_available
+from corpus import make_corpus
+
+STAGES = ("text", "ocr", "process", "export")
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def _timed(items, func):
+    """Calls func(item) for each item; returns (per-item seconds, number of items that raised)."""
+    latencies, errors = [], 0
+    for item in items:
+        start = time.perf_counter()
+        try:
+            func(item)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+def _paths(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".pdf"))
+
+def run_text(corpus, args):
+    from extractor import extract_text_from_pdf
+    return _timed(_paths(os.path.join(corpus, "digital")), extract_text_from_pdf)
+
+def run_ocr(corpus, args):
+    from extractor import extract_text_with_ocr
+    return _timed(_paths(os.path.join(corpus, "scanned")), lambda path: extract_text_with_ocr(path, args.ocr_workers))
+
+def run_process(corpus, args):
+    from mock_gemini import MockGeminiServer
+    with MockGeminiServer(latency=args.latency, error_rate=args.error_rate, echo=True) as server:
+        os.environ["GEMINI_API_URL"] = server.url  # Picked up by GeminiClient
+        from extractor import process_invoice_file
+        return _timed(_paths(os.path.join(corpus, "digital")), lambda path: process_invoice_file(path, "bench-key"))
+
+def run_export(corpus, args):
+    from extractor import extract_text_from_pdf, structure_invoice_offline, build_invoice_rows
+    from ledger_writer import open_ledger_writer
+    invoices = [build_invoice_rows(structure_invoice_offline(extract_text_from_pdf(path), "local-only")[0])
+                for path in _paths(os.path.join(corpus, "digital"))]
+    writer = open_ledger_writer(os.path.join(corpus, "ledger.xlsx"))
+    latencies, errors = _timed(invoices, writer.append_rows)
+    start = time.perf_counter()
+    writer.close()  # The workbook is written here; its time is spread over the invoices
+    flush = (time.perf_counter() - start) / max(1, len(latencies))
+    os.remove(os.path.join(corpus, "ledger.xlsx"))
+    return [latency + flush for latency in latencies], errors
+
+RUNNERS = {"text": run_text, "ocr": run_ocr, "process": run_process, "export": run_export}
+
+def run_stage(stage, corpus, args):
+    """Runs one stage in this process and returns its results as a dict."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        latencies, errors = RUNNERS[stage](corpus, args)
+        seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "items": len(latencies), "errors": errors, "seconds": round(seconds, 4),
+        "per_second": round(len(latencies) / seconds, 3) if seconds else 0.0,
+        "p50_ms": round(_percentile(latencies, 0.5) * 1000, 2) if latencies else 0.0,
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2) if latencies else 0.0,
+        "peak_mb": round(peak_rss_mb(), 1),
+    }
+
+def print_results(results, baseline=None):
+    print(f"{'stage':<8} {'items':>5} {'errors':>6} {'seconds':>8} {'items/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'peak MB':>8}"
+          + ("   vs baseline (items/s, p95, peak)" if baseline else ""))
+    for stage, r in results.items():
+        line = (f"{stage:<8} {r['items']:>5} {r['errors']:>6} {r['seconds']:>8.2f} {r['per_second']:>8.2f} "
+                f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['peak_mb']:>8.1f}")
+        old = (baseline or {}).get(stage)
+        if old:
+            line += "   " + "  ".join(f"{(r[key] / old[key] - 1) * 100:+6.1f}%" if old[key] else "     n/a"
+                                      for key in ("per_second", "p95_ms", "peak_mb"))
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=50, help="Invoices per corpus")
+    parser.add_argument("--items", type=int, default=8, help="Line items per invoice")
+    parser.add_argument("--scanned-files", type=int, default=5, help="Scanned invoices for the OCR stage")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock API latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock API requests failing with 429/503")
+    parser.add_argument("--ocr-workers", type=int, default=None)
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--json", help="Write the results to this file")
+    parser.add_argument("--compare", help="Results file of an earlier run to compare against")
+    parser.add_argument("--child", nargs=2, metavar=("STAGE", "CORPUS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_stage(args.child[0], args.child[1], args)))
+        return
+
+    stages = list(args.stages)
+    if "ocr" in stages and not tesseract_available():
+        print("Tesseract not found: skipping the ocr stage")
+        stages.remove("ocr")
+    results = {}
+    with tempfile.TemporaryDirectory() as corpus:
+        make_corpus(os.path.join(corpus, "digital"), args.files, n_items=args.items)
+        if "ocr" in stages:
+            make_corpus(os.path.join(corpus, "scanned"), args.scanned_files, n_items=args.items, scanned=True)
+        print(f"{args.files} digital invoices x {args.items} items, mock latency {args.latency:.2f}s, "
+              f"error rate {args.error_rate:.0%}")
+        for stage in stages:
+            command = [sys.executable, os.path.abspath(__file__), "--child", stage, corpus, "--latency", str(args.latency),
+                       "--error-rate", str(args.error_rate)]
+            if args.ocr_workers:
+                command += ["--ocr-workers", str(args.ocr_workers)]
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+            results[stage] = json.loads(output.strip().splitlines()[-1])
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["stages"]
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"files": args.files, "items": args.items, "latency": args.latency,
+                       "error_rate": args.error_rate, "stages": results}, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# bench_templates.py
+# Checks that supplier template lookup stays fast as the template store grows: learns real
+# templates from the synthetic corpus, pads the store with thousands of synthetic suppliers, and
+# times GSTIN and fingerprint lookups (against a linear scan), store load time, and reading an
+# invoice end to end with its template.
+#
+#   python benchmarks/bench_templates.py --templates 1000 5000 20000
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import extractor
+from corpus import make_corpus
+from local_extractor import GSTIN_CHARS, extract_invoice_fields
+from templates import TemplateStore
+
+def synthetic_templates(count, like, seed=0):
+    """Copies of a real template under random GSTINs and fingerprints."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        gstin = f"{rng.randint(1, 37):02d}" + "".join(rng.choice(GSTIN_CHARS) for _ in range(13))
+        yield dict(like, gstin=gstin, fingerprint=f"{rng.getrandbits(64):016x}")
+
+def time_per_call(func, keys, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for key in keys:
+            func(key)
+    return (time.perf_counter() - start) / (repeat * len(keys))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--templates", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--invoices", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_corpus(os.path.join(tmp, "pdfs"), args.invoices)
+        texts = [extractor.extract_text_from_pdf(path) for path in paths]
+        learned = TemplateStore(":memory:")
+        for path, text in zip(paths, texts):
+            if learned.parse_invoice(path, text) is None:
+                learned.learn(path, extract_invoice_fields(text)[0])
+        real = [learned.find([gstin]) for gstin in learned._by_gstin]
+        print(f"Learned {len(real)} supplier templates from {len(paths)} invoices")
+
+        print(f"{'templates':>9} {'load':>9} {'gstin':>10} {'fingerprint':>12} {'linear scan':>12} {'invoice read':>13}")
+        for count in args.templates:
+            db_path = os.path.join(tmp, f"templates_{count}.sqlite3")
+            store = TemplateStore(db_path)
+            store.add_many(list(synthetic_templates(count - len(real), real[0])) + real)
+            store.close()
+
+            start = time.perf_counter()
+            store = TemplateStore(db_path)
+            load = time.perf_counter() - start
+
+            gstins = random.Random(1).sample(list(store._by_gstin), min(1000, len(store._by_gstin)))
+            fingerprints = random.Random(2).sample(list(store._by_fingerprint), min(1000, len(store._by_fingerprint)))
+            # What a store without an index would do: decode and compare every template.
+            rows = [row[0] for row in store._conn.execute("SELECT template FROM templates")]
+            gstin_lookup = time_per_call(lambda g: store.find([g]), gstins)
+            fingerprint_lookup = time_per_call(lambda f: store.find(fingerprint=f), fingerprints)
+            linear = time_per_call(lambda g: next(t for t in map(json.loads, rows) if t["gstin"] == g), gstins[:20], repeat=1)
+
+            start = time.perf_counter()
+            for path, text in zip(paths, texts):
+                store.parse_invoice(path, text)
+            read = (time.perf_counter() - start) / len(paths)
+            store.close()
+            print(f"{count:>9} {load * 1000:>7.1f}ms {gstin_lookup * 1e6:>8.2f}us {fingerprint_lookup * 1e6:>10.2f}us "
+                  f"{linear * 1e6:>10.1f}us {read * 1000:>11.2f}ms")
+
+if __name__ == "__main__":
+    main()
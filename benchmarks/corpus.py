@@ -0,0 +1,125 @@
+# corpus.py
+# Generates synthetic Indian GST invoices with PyMuPDF for the offline benchmarks.
+
+import os
+import random
+import fitz  # PyMuPDF
+
+SUPPLIERS = [
+    ("Shree Ganesh Traders", "27AABCS1429B1ZU", "Maharashtra"),
+    ("Kaveri Pharma Distributors", "29AAGCK4521M1Z7", "Karnataka"),
+    ("Ambica Steel Industries", "24AADFA9087Q1ZT", "Gujarat"),
+    ("Lakshmi Agencies", "33AAJFL3326H1ZI", "Tamil Nadu"),
+]
+BUYER = ("Jain & Lunkad", "27AAAFJ1234K1ZK", "Maharashtra")
+PRODUCTS = [
+    ("Paracetamol 500mg Tab", "30049099", 12.0),
+    ("Amoxicillin 250mg Cap", "30041030", 12.0),
+    ("MS Round Bar 12mm", "72142090", 18.0),
+    ("Cotton Yarn 40s", "52052410", 5.0),
+    ("LED Panel Light 18W", "94051090", 18.0),
+]
+
+def invoice_lines(invoice_no, n_items=5, seed=None):
+    """Returns the text lines of one synthetic GST invoice."""
+    rng = random.Random(seed if seed is not None else invoice_no)
+    name, gstin, state = rng.choice(SUPPLIERS)
+    lines = [
+        "TAX INVOICE",
+        name,
+        f"Plot {rng.randint(1, 300)}, Industrial Area, {state}",
+        f"GSTIN: {gstin}    State: {state}",
+        f"Invoice No: INV/{invoice_no:05d}    Invoice Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2026",
+        f"Buyer: {BUYER[0]}    GSTIN: {BUYER[1]}",
+        "",
+        "Sr  Description                 HSN       Qty    Rate      Amount",
+    ]
+    taxable, tax = 0.0, 0.0
+    for i in range(n_items):
+        product, hsn, rate_pct = rng.choice(PRODUCTS)
+        qty = rng.randint(1, 50)
+        rate = round(rng.uniform(10, 900), 2)
+        amount = round(qty * rate, 2)
+        taxable += amount
+        tax += amount * rate_pct / 100
+        lines.append(f"{i + 1:<3} {product:<27} {hsn:<9} {qty:<6} {rate:<9.2f} {amount:.2f}")
+    lines += [
+        "",
+        f"Taxable Value: {taxable:.2f}",
+        f"CGST: {tax / 2:.2f}",
+        f"SGST: {tax / 2:.2f}",
+        f"Grand Total: {taxable + tax:.2f}",
+    ]
+    return lines
+
+def short_invoice_lines(invoice_no):
+    """Returns the lines of a tiny digital cash memo (well under the old 150-character OCR threshold)."""
+    name, gstin, _ = SUPPLIERS[invoice_no % len(SUPPLIERS)]
+    return [name, f"GSTIN {gstin}", f"Memo {invoice_no}", "Total Rs 450.00"]
+
+def _draw_lines(page, lines):
+    y = 60
+    for line in lines:
+        page.insert_text((40, y), line, fontsize=9, fontname="cour")
+        y += 14
+
+def write_invoice(path, invoice_no, n_items=5, page_kinds=("digital",), dpi=150):
+    """
+    Writes a PDF with one page per entry of page_kinds: "digital" pages carry machine-readable
+    text, "scanned" pages are only an image of the text (like a scanner produces), and "short"
+    pages are a tiny digital cash memo.
+    """
+    doc = fitz.open()
+    for page_no, kind in enumerate(page_kinds):
+        if kind == "short":
+            lines = short_invoice_lines(invoice_no)
+        else:
+            lines = invoice_lines(invoice_no, n_items, seed=invoice_no * 1000 + page_no)
+        page = doc.new_page()
+        if kind == "scanned":
+            scratch = fitz.open()
+            _draw_lines(scratch.new_page(), lines)
+            pix = scratch[0].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            page.insert_image(page.rect, stream=pix.tobytes("png"))
+            scratch.close()
+        else:
+            _draw_lines(page, lines)
+    doc.save(path)
+    doc.close()
+
+def write_digital_invoice(path, invoice_no, n_items=5, pages=1):
+    """Writes a PDF with machine-readable invoice text on every page."""
+    write_invoice(path, invoice_no, n_items, ("digital",) * pages)
+
+def write_scanned_invoice(path, invoice_no, n_items=5, pages=1, dpi=150):
+    """Writes a PDF whose pages are only images of the invoice text."""
+    write_invoice(path, invoice_no, n_items, ("scanned",) * pages, dpi)
+
+def make_corpus(directory, count, n_items=5, pages=1, scanned=False):
+    """Writes `count` digital (or scanned) invoices into `directory` and returns their paths."""
+    os.makedirs(directory, exist_ok=True)
+    kind = "scanned" if scanned else "digital"
+    writer = write_scanned_invoice if scanned else write_digital_invoice
+    paths = []
+    for invoice_no in range(count):
+        path = os.path.join(directory, f"{kind}_{invoice_no:05d}.pdf")
+        writer(path, invoice_no, n_items, pages)
+        paths.append(path)
+    return paths
+
+def make_mixed_corpus(directory, count, n_items=5):
+    """
+    Writes a mix of the layouts seen in practice, in rough proportion: short digital memos (3),
+    long digital invoices (2), digital invoices with one scanned page (1) and fully scanned ones (1).
+    """
+    os.makedirs(directory, exist_ok=True)
+    short, digital = ("short", ("short",)), ("digital", ("digital",) * 3)
+    mixed, scanned = ("mixed", ("digital", "digital", "scanned", "digital")), ("scanned", ("scanned",) * 2)
+    layouts = [short, digital, short, mixed, short, digital, scanned]
+    paths = []
+    for invoice_no in range(count):
+        name, page_kinds = layouts[invoice_no % len(layouts)]
+        path = os.path.join(directory, f"{name}_{invoice_no:05d}.pdf")
+        write_invoice(path, invoice_no, n_items, page_kinds)
+        paths.append(path)
+    return paths
@@ -0,0 +1,104 @@
+# mock_gemini.py
+# A local stand-in for the Gemini generateContent endpoint, used by the benchmarks.
+
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CANNED_INVOICE = {
+    "invoiceHeader": {"invoiceDate": "01/04/2026", "invoiceNo": "INV/00001"},
+    "supplierDetails": {"name": "Shree Ganesh Traders", "gstin": "27AABCS1429B1ZU", "state": "Maharashtra"},
+    "buyerDetails": {"name": "Jain & Lunkad", "gstin": "27AAAFJ1234K1ZK"},
+    "lineItems": [{"itemName": "Paracetamol 500mg Tab", "hsnCode": "30049099", "qty": 10, "rate": 25.5, "amount": 255.0}],
+    "summary": {"totalAmount": 285.6, "cgstAmount": 15.3, "sgstAmount": 15.3},
+}
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests_seen += 1
+        self.server.bytes_received += len(body)
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            self._send_json(random.choice([429, 503]), {"error": {"message": "Mock transient error"}})
+            return
+        prompt = json.loads(body)["contents"][0]["parts"][0]["text"]
+        answer = self._read_invoices(prompt) if self.server.echo else self._canned(prompt)
+        reply = {"candidates": [{"content": {"parts": [{"text": json.dumps(answer)}]}}]}
+        time.sleep(self.server.latency_per_kb * len(reply["candidates"][0]["content"]["parts"][0]["text"]) / 1024)
+        self._send_json(200, reply)
+
+    @staticmethod
+    def _batch_ids(prompt):
+        from extractor import INVOICE_MARKER
+        return re.findall("^" + re.escape(INVOICE_MARKER).replace(r"\{\}", "(.+)") + "$", prompt, re.M)
+
+    def _canned(self, prompt):
+        ids = self._batch_ids(prompt)
+        return [{"invoiceId": i, "invoice": CANNED_INVOICE} for i in ids] if ids else CANNED_INVOICE
+
+    def _read_invoices(self, prompt):
+        """Answers like a model that reads each invoice correctly (the local extractor's reading)."""
+        from extractor import get_gemini_prompt, get_gemini_batch_prompt, INVOICE_MARKER
+        from local_extractor import extract_invoice_fields
+        ids = self._batch_ids(prompt)
+        if not ids:
+            return extract_invoice_fields(prompt[len(get_gemini_prompt()):])[0]
+        answers = []
+        texts = re.split("^" + re.escape(INVOICE_MARKER).replace(r"\{\}", ".+") + "$", prompt[len(get_gemini_batch_prompt()):], flags=re.M)[1:]
+        for invoice_id, text in zip(ids, texts):
+            answers.append({"invoiceId": invoice_id, "invoice": extract_invoice_fields(text)[0]})
+        return answers
+
+    def _send_json(self, status, reply):
+        payload = json.dumps(reply).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class MockGeminiServer:
+    """
+    Serves canned generateContent responses on localhost after a fixed latency.
+    A fraction `error_rate` of requests fails with a 429 or 503 to exercise retries.
+    With `echo`, the response is the invoice actually sent instead of the canned one.
+    `latency_per_kb` adds generation time in proportion to the size of the response.
+    """
+    def __init__(self, latency=0.5, error_rate=0.0, echo=False, latency_per_kb=0.0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.error_rate = error_rate
+        self.httpd.echo = echo
+        self.httpd.latency_per_kb = latency_per_kb
+        self.httpd.requests_seen = 0
+        self.httpd.bytes_received = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}/v1beta/models/mock:generateContent"
+
+    @property
+    def requests_seen(self):
+        return self.httpd.requests_seen
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
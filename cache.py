@@ -0,0 +1,103 @@
+# cache.py
+# Persistent, content-addressed cache for extraction results.
+# Entries are keyed by a SHA-256 of the PDF bytes, so a renamed or re-selected file is still
+# a hit. Extracted text is cached per PDF; Gemini results are cached per PDF and prompt version,
+# so changing the prompt/schema invalidates results without throwing away the OCR work.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".invoice_extractor", "cache.sqlite3")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+def hash_pdf(pdf_path):
+    """Returns the SHA-256 hex digest of the PDF file contents."""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ExtractionCache:
+    """SQLite-backed cache with size-based LRU eviction. Safe to share between threads."""
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, prompt_version=None):
+        if prompt_version is None:
+            from extractor import PROMPT_VERSION
+            prompt_version = PROMPT_VERSION
+        self.path = path
+        self.max_bytes = max_bytes
+        self.prompt_version = prompt_version
+        self.stats = {"text_hits": 0, "text_misses": 0, "data_hits": 0, "data_misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _get(self, key, stat):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats[f"{stat}_misses"] += 1
+                return None
+            self.stats[f"{stat}_hits"] += 1
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def _put(self, key, value):
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, value, size, time.time()))
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drops least recently used entries until the cache is back under its size limit."""
+        while self._total_bytes > self.max_bytes:
+            victims = self._conn.execute("SELECT key, size FROM entries ORDER BY accessed LIMIT 64").fetchall()
+            if not victims:
+                break
+            for key, size in victims:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.stats["evictions"] += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def get_text(self, pdf_hash):
+        """Returns the cached extracted text for a PDF, or None."""
+        return self._get(f"text:{pdf_hash}", "text")
+
+    def put_text(self, pdf_hash, text):
+        self._put(f"text:{pdf_hash}", text)
+
+    def get_data(self, pdf_hash):
+        """Returns the cached structured JSON for a PDF under the current prompt version, or None."""
+        value = self._get(f"data:{self.prompt_version}:{pdf_hash}", "data")
+        return json.loads(value) if value is not None else None
+
+    def put_data(self, pdf_hash, data):
+        self._put(f"data:{self.prompt_version}:{pdf_hash}", json.dumps(data))
+
+    def log_stats(self):
+        s = self.stats
+        print(f"Cache: results {s['data_hits']} hits / {s['data_misses']} misses, "
+              f"text {s['text_hits']} hits / {s['text_misses']} misses, "
+              f"{s['evictions']} evicted, {self._total_bytes / (1024 * 1024):.1f} MB in use")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,273 @@
+# cli.py
+# Headless batch entry point for server-side and scheduled (cron) runs. Uses the same pipeline
+# as the GUI, without Tkinter. Completed files are recorded in a checkpoint manifest, so an
+# interrupted run can be restarted and skips everything that was already written.
+# With --continue-on-error, files that fail are listed in a failures manifest instead of stopping
+# the run, and --retry-failures processes just those files again.
+# With --watch, the input directories are watched and new PDFs are processed as they arrive,
+# until the process is stopped (Ctrl+C or SIGTERM); see watch.py.
+#
+#   python cli.py invoices/ -o ledger.xlsx
+#   python cli.py "scans/2026-*/*.pdf" -o ledger.parquet --cpu-workers 8 --io-workers 16
+#   python cli.py invoices/ -o ledger.xlsx --continue-on-error && python cli.py invoices/ -o ledger.xlsx --retry-failures
+#   python cli.py //scanner/share/incoming -o ledger.xlsx --watch
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+import instrumentation
+from cache import ExtractionCache, DEFAULT_CACHE_PATH
+from extractor import EXTRACTION_MODES, MAX_BATCH_INVOICES, MAX_INVOICE_CHARS, OCR_DPI, PagePolicy
+from gemini_client import DEFAULT_REQUESTS_PER_MINUTE
+from templates import TemplateStore, DEFAULT_TEMPLATE_PATH
+from dedup import DuplicateIndex, DEDUP_SUFFIX, remove_index
+from ledger_writer import open_ledger_writer, sidecar_path, OUTPUT_FORMATS
+from pipeline import (process_invoice_batch, BatchProcessingError, FailureManifest, DEFAULT_CPU_WORKERS,
+                      DEFAULT_IO_WORKERS, DEFAULT_MAX_ATTEMPTS, FAILURES_SUFFIX)
+from watch import watch_folder, DEFAULT_POLL_SECONDS, DEFAULT_SETTLE_SECONDS
+
+def find_pdfs(inputs, recursive=False):
+    """Expands files, directories and glob patterns into a sorted, de-duplicated list of PDFs."""
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*.pdf") if recursive else os.path.join(item, "*.pdf")
+            matches = glob.glob(pattern, recursive=recursive)
+            matches += glob.glob(pattern[:-3] + "PDF", recursive=recursive)
+        elif glob.has_magic(item):
+            matches = glob.glob(item, recursive=True)
+        else:
+            matches = [item]
+        found.extend(os.path.abspath(m) for m in matches if m.lower().endswith(".pdf") and os.path.isfile(m))
+    return sorted(set(found))
+
+MANIFEST_SUFFIX = ".manifest.jsonl"
+
+class CheckpointManifest:
+    """
+    Append-only JSONL record of files whose rows have been handed to the output writer.
+    A file counts as done only if its size and modification time are unchanged.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.done[entry["path"]] = (entry["size"], entry["mtime_ns"])
+        self._file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def _signature(pdf_path):
+        stat = os.stat(pdf_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def is_done(self, pdf_path):
+        return self.done.get(pdf_path) == self._signature(pdf_path)
+
+    def mark_done(self, pdf_path, row_count):
+        size, mtime_ns = self._signature(pdf_path)
+        entry = {"path": pdf_path, "size": size, "mtime_ns": mtime_ns, "rows": row_count,
+                 "completed_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.done[pdf_path] = (size, mtime_ns)
+
+    def close(self):
+        self._file.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Extract invoice data from PDFs without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("-o", "--output", required=True, help="Output file (.xlsx, .csv, .jsonl) or Parquet/Arrow directory (.parquet, .arrow)")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, help="Output format (default: from the output extension)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Search directories recursively")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY"), help="Gemini API key (default: $GEMINI_API_KEY)")
+    parser.add_argument("--mode", choices=EXTRACTION_MODES, default="gemini",
+                        help="gemini: always call Gemini; local-first: skip Gemini when the local rules are confident; "
+                             "local-only: never use the network")
+    parser.add_argument("--cpu-workers", type=int, default=DEFAULT_CPU_WORKERS, help="Processes for text extraction and OCR")
+    parser.add_argument("--io-workers", type=int, default=DEFAULT_IO_WORKERS, help="Concurrent Gemini requests")
+    parser.add_argument("--requests-per-minute", type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="Gemini requests allowed per minute (your API tier's RPM limit; 0 for no limit)")
+    parser.add_argument("--tokens-per-minute", type=int, default=0,
+                        help="Estimated prompt tokens allowed per minute (your API tier's TPM limit; 0 for no limit)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help=f"Invoices per Gemini request (short invoices only; at most {MAX_BATCH_INVOICES})")
+    parser.add_argument("--max-invoice-chars", type=int, default=MAX_INVOICE_CHARS,
+                        help="Text of one invoice sent to Gemini; longer text loses its middle, with a warning (0 for no limit)")
+    parser.add_argument("--ocr-dpi", type=int, default=OCR_DPI, help="Resolution scanned pages are rendered at for OCR")
+    parser.add_argument("--ocr-color", action="store_true", help="Render scanned pages in colour (grayscale uses a third of the memory)")
+    parser.add_argument("--max-pages", type=int, help="Read at most this many pages of each PDF")
+    parser.add_argument("--stop-at-total", action="store_true",
+                        help="Stop reading a PDF after the page with the invoice total (skips annexures of long statements)")
+    parser.add_argument("--manifest", help="Checkpoint manifest path (default: <output>.manifest.jsonl)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint manifest and the duplicate index and process every file")
+    parser.add_argument("--continue-on-error", action="store_true",
+                        help="Record failing files in the failures manifest and carry on with the rest")
+    parser.add_argument("--retry-failures", action="store_true", help="Process only the files in the failures manifest")
+    parser.add_argument("--failures", help="Failures manifest path (default: <output>.failures.jsonl)")
+    parser.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS,
+                        help="Attempts per file for transient errors (rate limits, server and network errors)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Extraction cache path")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the extraction cache")
+    parser.add_argument("--report", help="Write a per-invoice, per-stage timing report (.json, or .csv for one row per span)")
+    parser.add_argument("--profile", metavar="DIR", help="Profile every stage with cProfile and write the stats to DIR")
+    parser.add_argument("--templates", default=DEFAULT_TEMPLATE_PATH, help="Supplier template store path")
+    parser.add_argument("--no-templates", action="store_true", help="Do not read or learn supplier layout templates")
+    parser.add_argument("--dedup", help=f"Index of the invoices already written to the output, for the duplicate check "
+                                         f"(default: <output>{DEDUP_SUFFIX})")
+    parser.add_argument("--no-dedup", action="store_true", help="Write every invoice, even ones that were written before")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep watching the input directories and process new PDFs as they arrive (Ctrl+C to stop)")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_SECONDS, help="Seconds between scans in --watch mode")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="Seconds a new PDF must stay unchanged before it is read in --watch mode")
+    return parser.parse_args(argv)
+
+def page_policy(args):
+    return PagePolicy(dpi=args.ocr_dpi, grayscale=not args.ocr_color, stop_at_total=args.stop_at_total,
+                      max_pages=args.max_pages)
+
+def open_stores(args):
+    """Returns the (cache, templates, duplicates) stores the arguments ask for, each None if disabled."""
+    cache = None if args.no_cache else ExtractionCache(args.cache)
+    templates = None if args.no_templates else TemplateStore(args.templates)
+    duplicates = None
+    if not args.no_dedup:
+        dedup_path = args.dedup or sidecar_path(args.output, DEDUP_SUFFIX)
+        if args.restart:
+            remove_index(dedup_path)
+        duplicates = DuplicateIndex(dedup_path)
+    return cache, templates, duplicates
+
+def close_stores(cache, templates, duplicates):
+    if cache: cache.close()
+    if templates is not None: templates.close()
+    if duplicates is not None: duplicates.close()
+
+def run_watch(args):
+    """--watch: processes the PDFs that appear in the input directories until stopped."""
+    if not all(os.path.isdir(item) for item in args.inputs):
+        print("--watch needs directories to watch.", file=sys.stderr)
+        return 2
+    manifest_path = args.manifest or sidecar_path(args.output, MANIFEST_SUFFIX)
+    if args.restart and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    manifest = CheckpointManifest(manifest_path)
+    failures = FailureManifest(args.failures or sidecar_path(args.output, FAILURES_SUFFIX))
+    cache, templates, duplicates = open_stores(args)
+    writer = open_ledger_writer(args.output, args.format)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        processed = watch_folder(args.inputs, args.api_key, writer, manifest, failures, recursive=args.recursive,
+                                 workers=args.io_workers, poll_interval=args.poll_interval, settle=args.settle,
+                                 max_attempts=args.max_attempts, stop_event=stop, duplicates=duplicates, cache=cache,
+                                 mode=args.mode, templates=templates, page_policy=page_policy(args),
+                                 ocr_workers=max(1, args.cpu_workers // max(1, args.io_workers)),
+                                 requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+                                 max_chars=args.max_invoice_chars)
+    finally:
+        writer.close()
+        manifest.close()
+        failures.close()
+        close_stores(cache, templates, duplicates)
+    print(f"Processed {processed} files; wrote {writer.rows_written} rows to {args.output}.")
+    return 0
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.api_key and args.mode != "local-only":
+        print("A Gemini API key is required (--api-key or GEMINI_API_KEY).", file=sys.stderr)
+        return 2
+    if args.watch:
+        return run_watch(args)
+
+    pdf_paths = find_pdfs(args.inputs, args.recursive)
+    if not pdf_paths:
+        print("No PDF files found.", file=sys.stderr)
+        return 2
+
+    manifest_path = args.manifest or sidecar_path(args.output, MANIFEST_SUFFIX)
+    if args.restart and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    manifest = CheckpointManifest(manifest_path)
+    failures = FailureManifest(args.failures or sidecar_path(args.output, FAILURES_SUFFIX))
+    if args.retry_failures:
+        listed = set(failures.paths())
+        pdf_paths = [path for path in pdf_paths if path in listed]
+        print(f"Retrying {len(pdf_paths)} previously failed files.")
+    pending = [path for path in pdf_paths if not manifest.is_done(path)]
+    if len(pending) < len(pdf_paths):
+        print(f"Resuming: {len(pdf_paths) - len(pending)} of {len(pdf_paths)} files already completed.")
+    for path in pdf_paths:
+        if path not in pending: failures.resolve(path)
+    if not pending:
+        manifest.close()
+        failures.close()
+        print("Nothing to do.")
+        return 0
+
+    cache, templates, duplicates = open_stores(args)
+    writer = open_ledger_writer(args.output, args.format)
+
+    def on_result(index, pdf_path, rows):
+        writer.append_rows(rows)
+        manifest.mark_done(pdf_path, len(rows))
+        failures.resolve(pdf_path)
+
+    def on_failure(index, pdf_path, error, attempts):
+        failures.record(pdf_path, error, attempts)
+
+    exit_code = 0
+    start = time.perf_counter()
+    if args.report or args.profile:
+        instrumentation.start(args.profile)
+    try:
+        process_invoice_batch(pending, args.api_key, cpu_workers=args.cpu_workers, io_workers=args.io_workers,
+                              result_callback=on_result, cache=cache, mode=args.mode, templates=templates,
+                              batch_size=args.batch_size, continue_on_error=args.continue_on_error,
+                              failure_callback=on_failure, max_attempts=args.max_attempts, duplicates=duplicates,
+                              page_policy=page_policy(args), requests_per_minute=args.requests_per_minute,
+                              tokens_per_minute=args.tokens_per_minute, max_chars=args.max_invoice_chars)
+    except BatchProcessingError as e:
+        print(f"ERROR processing {e.pdf_path}: {e}", file=sys.stderr)
+        failures.record(e.pdf_path, e.error)
+        print("Completed files were saved; re-run the same command to resume.", file=sys.stderr)
+        exit_code = 1
+    finally:
+        writer.close()
+        manifest.close()
+        failures.close()
+        close_stores(cache, templates, duplicates)
+        recorder = instrumentation.stop()
+        if recorder:
+            recorder.log_summary()
+            if args.report:
+                recorder.write_report(args.report)
+                print(f"Run report written to {args.report}")
+            if args.profile:
+                print(f"Combined profile written to {recorder.write_profiles()}")
+
+    print(f"Wrote {writer.rows_written} rows to {args.output} in {time.perf_counter() - start:.1f}s.")
+    if failures.failures:
+        kinds = [entry["kind"] for entry in failures.failures.values()]
+        print(f"{len(kinds)} files failed ({kinds.count('transient')} transient, {kinds.count('permanent')} permanent); "
+              f"see {failures.path} and re-run with --retry-failures.", file=sys.stderr)
+        exit_code = 1
+    return exit_code
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
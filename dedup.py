@@ -0,0 +1,202 @@
+# dedup.py
+# Persistent index of the invoices already written to a ledger, so re-processing a PDF or a
+# second scan of the same bill does not add its rows twice (or cost another Gemini call).
+# An invoice is identified three ways, from cheapest to latest available:
+#   * the SHA-256 of the PDF bytes (the same file again, checked before any extraction);
+#   * a 64-bit SimHash of the extracted text (another scan of the same bill, checked before the
+#     Gemini call and confirmed by the new text's own invoice number, date and total, as read by
+#     the local extractor, agreeing with the earlier invoice's: recurring invoices from a supplier
+#     can share nearly all of their text);
+#   * the normalized (supplier GSTIN, invoice no, invoice date, total amount) key, checked from
+#     the local extractor's reading before the Gemini call and from the final rows before writing.
+# Every lookup is an indexed SQLite query, so its cost does not grow with the number of invoices
+# and the ledger itself is never read back. Each ledger has its own index, kept next to it
+# (DEDUP_SUFFIX), so writing the same PDFs to another ledger is not blocked.
+
+import datetime
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from local_extractor import extract_invoice_fields, normalize_date
+
+DEDUP_SUFFIX = ".invoices.sqlite3"
+# Texts whose SimHashes differ in at most this many of 64 bits are near-duplicates. The hash is
+# split into one more band than that, so any near-duplicate shares at least one band exactly.
+NEAR_DUPLICATE_BITS = 3
+SIMHASH_BANDS = 4
+BAND_BITS = 64 // SIMHASH_BANDS
+# The local reading is trusted for the key check only when these fields were found this confidently.
+KEY_CONFIDENCE = 0.8
+KEY_FIELDS = ("supplierDetails.gstin", "invoiceHeader.invoiceNo", "invoiceHeader.invoiceDate", "summary.totalAmount")
+
+_WORD = re.compile(r"[A-Z0-9]+")
+_BAND_COLUMNS = [f"band{i}" for i in range(SIMHASH_BANDS)]
+
+def _normalize_number(value):
+    return re.sub(r"[^A-Z0-9]", "", str(value or "").upper())
+
+def invoice_key(gstin, invoice_no, invoice_date, total_amount):
+    """
+    Returns the normalized identity of an invoice, or None when the supplier GSTIN, the invoice
+    number or the date is missing. Amounts are compared to the rupee, dates as DD/MM/YYYY.
+    """
+    gstin, number, date = _normalize_number(gstin), _normalize_number(invoice_no), _key_date(invoice_date)
+    if not gstin or gstin == "NA" or not number or number == "NA" or not date:
+        return None
+    return "|".join((gstin, number, date, _key_total(total_amount)))
+
+def _key_date(value):
+    if isinstance(value, datetime.date):
+        return value.strftime("%d/%m/%Y")
+    return normalize_date(str(value)) if value not in (None, "NA") else None
+
+def _key_total(value):
+    try:
+        return f"{round(float(value)):d}"
+    except (TypeError, ValueError):
+        return ""
+
+def key_from_rows(rows):
+    """The invoice key of the rows built by extractor.build_invoice_rows (all rows share the header)."""
+    if not rows:
+        return None
+    row = rows[0]
+    return invoice_key(row.get("GSTIN/UIN"), row.get("Invoice No"), row.get("Invoice Date"), row.get("Total Amount"))
+
+def text_fingerprint(text):
+    """64-bit SimHash of the word trigrams of the text; OCR noise changes only a few bits."""
+    words = _WORD.findall(text.upper())
+    shingles = {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big") for s in shingles]
+    half = len(hashes) / 2
+    fingerprint = 0
+    for bit in range(64):
+        if sum((h >> bit) & 1 for h in hashes) > half:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def _bands(fingerprint):
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (i * BAND_BITS)) & mask for i in range(SIMHASH_BANDS)]
+
+def _signed(fingerprint):
+    """SQLite integers are signed 64-bit."""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+def remove_index(path):
+    """Deletes an index (e.g. when its ledger is started over), with SQLite's WAL files."""
+    for name in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(name):
+            os.remove(name)
+
+class DuplicateIndex:
+    """SQLite-backed index of the invoices written to one ledger. Safe to share between threads."""
+    def __init__(self, path):
+        self.path = path
+        self.stats = {"files": 0, "near_duplicates": 0, "keys": 0, "checked": 0, "added": 0}
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = ", ".join(f"{band} INTEGER" for band in _BAND_COLUMNS)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS invoices ("
+            " id INTEGER PRIMARY KEY, invoice_key TEXT, pdf_hash TEXT, invoice_no TEXT, fingerprint INTEGER,"
+            f" {columns}, pdf_path TEXT, added REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS invoices_key ON invoices(invoice_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS invoices_pdf_hash ON invoices(pdf_hash)")
+        for band in _BAND_COLUMNS:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS invoices_{band} ON invoices({band})")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def _match(self, column, value, reason):
+        row = self._conn.execute(f"SELECT pdf_path, added FROM invoices WHERE {column} = ? LIMIT 1", (value,)).fetchone()
+        if row is None:
+            return None
+        return {"reason": reason, "pdf_path": row[0], "added": time.strftime("%Y-%m-%d %H:%M", time.localtime(row[1]))}
+
+    def match_file(self, pdf_hash):
+        """Returns the earlier invoice if this exact PDF was written before, else None."""
+        with self._lock:
+            match = self._match("pdf_hash", pdf_hash, "same file") if pdf_hash else None
+        if match: self.stats["files"] += 1
+        return match
+
+    def match_text(self, text, fingerprint=None):
+        """
+        Returns the earlier invoice if the extracted text is a near-duplicate of one (with the
+        same invoice number, and no different date or total) or if the local extractor reads an
+        invoice key that is already known.
+        """
+        fingerprint = text_fingerprint(text) if fingerprint is None else fingerprint
+        data, confidence = extract_invoice_fields(text)
+        number = _normalize_number(data["invoiceHeader"]["invoiceNo"]) if "invoiceHeader.invoiceNo" in confidence else ""
+        if number:
+            date = _key_date(data["invoiceHeader"]["invoiceDate"])
+            total = _key_total(data["summary"]["totalAmount"]) if "summary.totalAmount" in confidence else ""
+            where = " OR ".join(f"{band} = ?" for band in _BAND_COLUMNS)
+            with self._lock:
+                candidates = self._conn.execute(
+                    f"SELECT fingerprint, invoice_no, invoice_key, pdf_path, added FROM invoices "
+                    f"WHERE invoice_no = ? AND ({where})", [number] + _bands(fingerprint)).fetchall()
+            for other, _, key, pdf_path, added in candidates:
+                if bin((other & (2 ** 64 - 1)) ^ fingerprint).count("1") > NEAR_DUPLICATE_BITS:
+                    continue
+                other_date, other_total = key.split("|")[2:] if key else (None, "")
+                if (date and other_date and date != other_date) or (total and other_total and total != other_total):
+                    continue  # The same number on another date or for another amount: a different bill
+                self.stats["near_duplicates"] += 1
+                return {"reason": "near-duplicate text", "pdf_path": pdf_path,
+                        "added": time.strftime("%Y-%m-%d %H:%M", time.localtime(added))}
+        if all(confidence.get(field, 0) >= KEY_CONFIDENCE for field in KEY_FIELDS):
+            key = invoice_key(data["supplierDetails"]["gstin"], data["invoiceHeader"]["invoiceNo"],
+                              data["invoiceHeader"]["invoiceDate"], data["summary"]["totalAmount"])
+            return self._match_key(key)
+        return None
+
+    def _match_key(self, key):
+        with self._lock:
+            match = self._match("invoice_key", key, "same invoice") if key else None
+        if match: self.stats["keys"] += 1
+        return match
+
+    def match_rows(self, rows):
+        """Returns the earlier invoice with the same key as these rows, else None. Checked before writing."""
+        self.stats["checked"] += 1
+        return self._match_key(key_from_rows(rows))
+
+    def add(self, rows, pdf_path=None, pdf_hash=None, fingerprint=None):
+        """Records an invoice whose rows have been written."""
+        self.add_many([(rows, pdf_path, pdf_hash, fingerprint)])
+
+    def add_many(self, invoices):
+        """Records (rows, pdf_path, pdf_hash, fingerprint) tuples in one transaction."""
+        columns = ["invoice_key", "pdf_hash", "invoice_no", "fingerprint"] + _BAND_COLUMNS + ["pdf_path", "added"]
+        values = []
+        for rows, pdf_path, pdf_hash, fingerprint in invoices:
+            bands = _bands(fingerprint) if fingerprint is not None else [None] * SIMHASH_BANDS
+            invoice_no = _normalize_number(rows[0].get("Invoice No")) if rows else ""
+            values.append((key_from_rows(rows), pdf_hash, invoice_no if invoice_no not in ("", "NA") else None,
+                           _signed(fingerprint) if fingerprint is not None else None, *bands, pdf_path, time.time()))
+        with self._lock:
+            self._conn.executemany(f"INSERT INTO invoices ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", values)
+            self._conn.commit()
+        self.stats["added"] += len(values)
+
+    def log_stats(self):
+        s = self.stats
+        print(f"Duplicates: {s['files']} same file, {s['near_duplicates']} near-duplicate text, "
+              f"{s['keys']} same invoice key; {s['added']} invoices added to the index")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
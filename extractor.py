@@ -5,17 +5,34 @@
 import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
-import io
 import os
 import sys
+import shutil
 import json
-import requests # A robust library for making API calls
+import hashlib
+import threading
+import re
+import functools
+import textwrap
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+import instrumentation
+from cache import hash_pdf
+from dedup import text_fingerprint
+from gemini_client import GeminiClient, GeminiResponseError, DEFAULT_REQUESTS_PER_MINUTE
+from local_extractor import extract_invoice_fields, has_invoice_total, is_confident
+from invoice_model import InvoiceRows
 
 # --- CRITICAL: Tesseract Path Configuration ---
 def get_tesseract_path():
-    """Returns the path to the Tesseract executable."""
+    """Returns the path to the Tesseract executable (TESSERACT_CMD overrides it)."""
+    if os.environ.get("TESSERACT_CMD"):
+        return os.environ["TESSERACT_CMD"]
     if getattr(sys, 'frozen', False):
         return os.path.join(sys._MEIPASS, 'Tesseract-OCR', 'tesseract.exe')
+    elif os.name != 'nt':
+        return shutil.which("tesseract") or "tesseract"
     else:
         return r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
@@ -28,70 +45,221 @@ except Exception as e:
 def extract_text_from_pdf(pdf_path):
     """Extracts machine-readable text directly from a PDF."""
     try:
-        doc = fitz.open(pdf_path)
-        full_text = ""
-        for page in doc:
-            full_text += page.get_text("text")
-        doc.close()
-        return full_text
+        with fitz.open(pdf_path) as doc:
+            return "".join(page.get_text("text") for page in doc)
     except Exception as e:
         print(f"Error reading PDF {pdf_path}: {e}")
         return ""
 
-def extract_text_with_ocr(pdf_path):
-    """Renders PDF pages as images and uses OCR to extract text."""
+# --- OCR Engine ---
+# Pages are rendered one at a time, straight into the buffer Tesseract reads (no PNG round trip,
+# no extra copy), and released as soon as the page is read. Grayscale renders are a third of the
+# size of RGB ones and Tesseract binarises the image anyway. Oversized pages (A3 and larger) are
+# rendered at a lower resolution so that no single page exceeds OCR_MAX_PIXELS.
+OCR_DPI = 300
+OCR_GRAYSCALE = True
+OCR_MAX_PIXELS = 25_000_000
+MIN_OCR_DPI = 150
+DEFAULT_OCR_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# How the pages of a PDF are read. With stop_at_total, reading stops after the first page that
+# carries the invoice total (the rest of a consolidated statement is annexures and terms), and
+# max_pages caps the pages read per file.
+PagePolicy = namedtuple("PagePolicy", "dpi grayscale max_pixels stop_at_total max_pages",
+                        defaults=(OCR_DPI, OCR_GRAYSCALE, OCR_MAX_PIXELS, False, None))
+DEFAULT_PAGE_POLICY = PagePolicy()
+
+def reads_all_pages(policy):
+    """Whether the policy reads every page; text read under page limits is not cached."""
+    return not (policy.stop_at_total or policy.max_pages)
+
+def render_dpi(page, policy=DEFAULT_PAGE_POLICY):
+    """The policy's resolution, lowered for pages that would otherwise exceed its pixel budget."""
+    pixels = (page.rect.width / 72 * policy.dpi) * (page.rect.height / 72 * policy.dpi)
+    if policy.max_pixels and pixels > policy.max_pixels:
+        return max(MIN_OCR_DPI, int(policy.dpi * (policy.max_pixels / pixels) ** 0.5))
+    return policy.dpi
+
+def render_page(page, policy=DEFAULT_PAGE_POLICY):
+    """
+    Renders a page for OCR. Returns (image, pixmap): the PIL image wraps the pixmap's samples
+    without copying them, so the pixmap must be kept alive until the image has been read.
+    """
+    colorspace = fitz.csGRAY if policy.grayscale else fitz.csRGB
+    pix = page.get_pixmap(dpi=render_dpi(page, policy), colorspace=colorspace, alpha=False)
+    mode = "L" if pix.n == 1 else "RGB"
+    image = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+    # pytesseract hands Tesseract a temporary file; PPM (PGM for grayscale) is an uncompressed
+    # dump of the samples, so writing it costs far less than encoding a PNG.
+    image.format = "PPM"
+    return image, pix
+
+def ocr_page(pdf_path, page_number, policy=DEFAULT_PAGE_POLICY):
+    """Renders a single page and runs Tesseract on it. Top-level so it can run in a worker process."""
+    with fitz.open(pdf_path) as doc:
+        with instrumentation.span("render"):
+            image, pix = render_page(doc[page_number], policy)
+        try:
+            with instrumentation.span("tesseract"):
+                return pytesseract.image_to_string(image, lang='eng')
+        finally:
+            image.close()
+            del image, pix
+            fitz.TOOLS.store_shrink(100)  # Drop the decoded page images MuPDF keeps cached
+
+def ocr_pages(pdf_path, page_numbers, max_workers=None, policy=DEFAULT_PAGE_POLICY, pool=None):
+    """
+    OCRs the given pages, spreading them over a process pool (`pool`, or one started for the
+    call), and returns their texts in order.
+    """
+    if pool is None:
+        workers = min(max_workers or DEFAULT_OCR_WORKERS, len(page_numbers))
+        if workers <= 1:
+            return [ocr_page(pdf_path, page_number, policy) for page_number in page_numbers]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return ocr_pages(pdf_path, page_numbers, policy=policy, pool=pool)
+    futures = [instrumentation.submit(pool, ocr_page, pdf_path, page_number, policy) for page_number in page_numbers]
+    return [instrumentation.result(future) for future in futures]
+
+def extract_text_with_ocr(pdf_path, max_workers=None, policy=DEFAULT_PAGE_POLICY):
+    """Renders PDF pages as images and uses OCR to extract text, spreading pages over a process pool."""
     try:
-        doc = fitz.open(pdf_path)
-        full_text = ""
-        for page in doc:
-            pix = page.get_pixmap(dpi=300)
-            img_data = pix.tobytes("png")
-            image = Image.open(io.BytesIO(img_data))
-            text = pytesseract.image_to_string(image, lang='eng')
-            full_text += text + "\n"
-        doc.close()
-        return full_text
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+        page_texts = ocr_pages(pdf_path, list(range(page_count)), max_workers, policy)
+        return "".join(text + "\n" for text in page_texts)
     except Exception as e:
         print(f"Error during OCR for {pdf_path}: {e}")
         return ""
 
+# --- Per-Page Text/OCR Routing ---
+# Each page is routed on its own, so one scanned page inside a digital PDF still gets OCR'd and
+# short digital invoices are never OCR'd just for being short.
+SCANNED_PAGE_COVERAGE = 0.5    # Pages mostly covered by images are scans...
+SCANNED_PAGE_MAX_CHARS = 400   # ...unless they also carry a real text layer (e.g. a searchable scan).
+MIN_PAGE_TEXT_CHARS = 40       # Below this, any sizeable image on the page is assumed to hold the content.
+MIN_IMAGE_COVERAGE = 0.1
+
+PAGE_SEPARATOR = "\f"
+
+PageRoute = namedtuple("PageRoute", "page_number method text_chars image_coverage")
+
+def image_coverage(page):
+    """Returns the fraction of the page area covered by images (overlaps counted once per image, capped at 1)."""
+    page_area = abs(page.rect)
+    if not page_area:
+        return 0.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(fitz.Rect(info["bbox"]) & page.rect)
+    return min(1.0, covered / page_area)
+
+def route_page(page, text):
+    """Decides how a page's text should be obtained: 'text', 'ocr' or 'blank'."""
+    chars = len(text.strip())
+    coverage = image_coverage(page)
+    if coverage >= SCANNED_PAGE_COVERAGE and chars < SCANNED_PAGE_MAX_CHARS:
+        method = "ocr"
+    elif chars < MIN_PAGE_TEXT_CHARS and coverage >= MIN_IMAGE_COVERAGE:
+        method = "ocr"
+    elif chars:
+        method = "text"
+    else:
+        method = "blank"
+    return PageRoute(page.number, method, chars, round(coverage, 3))
+
+def iter_page_texts(pdf_path, ocr_workers=None, policy=DEFAULT_PAGE_POLICY):
+    """
+    Yields (PageRoute, text) for each page in order, reading the PDF a window of pages at a time
+    (one page per OCR worker), so memory use does not grow with the page count. OCR pages in a
+    window are read in parallel; the pool is started only if the document needs OCR at all.
+    """
+    workers = max(1, ocr_workers or DEFAULT_OCR_WORKERS)
+    with fitz.open(pdf_path) as doc, ExitStack() as stack:
+        last = min(doc.page_count, policy.max_pages or doc.page_count)
+        pool = None
+        for start in range(0, last, workers):
+            with instrumentation.span("text"):
+                window = []
+                for page_number in range(start, min(start + workers, last)):
+                    page = doc[page_number]
+                    text = page.get_text("text")
+                    route = route_page(page, text)
+                    window.append((route, text if route.method == "text" else ""))
+                    del page
+                fitz.TOOLS.store_shrink(100)
+            ocr_numbers = [route.page_number for route, _ in window if route.method == "ocr"]
+            ocr_texts = {}
+            if ocr_numbers:
+                if pool is None and workers > 1 and last - start > 1:
+                    pool = stack.enter_context(ProcessPoolExecutor(max_workers=min(workers, last - start)))
+                try:
+                    ocr_texts = dict(zip(ocr_numbers, ocr_pages(pdf_path, ocr_numbers, 1, policy, pool)))
+                except Exception as e:
+                    print(f"Error during OCR for {pdf_path}: {e}")
+            for route, text in window:
+                if route.method == "ocr":
+                    text = ocr_texts.get(route.page_number, "") + "\n"
+                yield route, text
+                if policy.stop_at_total and has_invoice_total(text) and route.page_number + 1 < doc.page_count:
+                    print(f"{os.path.basename(pdf_path)}: invoice total on page {route.page_number + 1}, "
+                          f"skipping the remaining {doc.page_count - route.page_number - 1} pages")
+                    return
+
+def extract_text_routed(pdf_path, ocr_workers=None, policy=DEFAULT_PAGE_POLICY):
+    """
+    Extracts each page's text directly or via OCR as routed. Returns (text, list of PageRoute);
+    pages are separated by form feeds so later stages can tell them apart.
+    """
+    page_texts, routes = [], []
+    for route, text in iter_page_texts(pdf_path, ocr_workers, policy):
+        routes.append(route)
+        page_texts.append(text)
+    instrumentation.count("pages", len(routes))
+    instrumentation.count("ocr_pages", sum(1 for route in routes if route.method == "ocr"))
+    return PAGE_SEPARATOR.join(page_texts), routes
+
 # --- Gemini API Interaction ---
-def get_gemini_prompt():
-    """Returns the detailed instruction prompt for the Gemini API for all 85 fields."""
-    json_schema = {
-        "invoiceHeader": {
-            "invoiceDate": "NA", "invoiceNo": "NA", "supplierInvoiceNo": "NA", "supplierInvoiceDate": "NA", "voucherType": "Purchase",
-            "orderNo": "NA", "orderDate": "NA", "orderDueDate": "NA", "documentType": "Invoice", "subType": "NA",
-            "receiptNoteNo": "NA", "receiptNoteDate": "NA"
-        },
-        "supplierDetails": {
-            "name": "NA", "address1": "NA", "address2": "NA", "address3": "NA", "pincode": "NA", "state": "NA",
-            "placeOfSupply": "NA", "country": "INDIA", "gstin": "NA", "gstRegistrationType": "Regular"
-        },
-        "buyerDetails": {
-            "name": "NA", "address1": "NA", "address2": "NA", "address3": "NA", "pincode": "NA", "state": "NA",
-            "place": "NA", "gstin": "NA"
-        },
-        "logisticsDetails": {
-            "lrNo": "NA", "despatchThrough": "NA", "destination": "NA", "transportMode": "NA", "distance": "NA",
-            "transporterName": "NA", "vehicleNumber": "NA", "vehicleType": "NA", "docAirWayBillNo": "NA", "docDate": "NA", "transporterID": "NA"
-        },
-        "eWayBillDetails": {
-            "eWayBillNo": "NA", "eWayBillDate": "NA", "consolidatedEWayBillNo": "NA", "consolidatedEWayDate": "NA", "statusOfEWayBill": "NA"
-        },
-        "lineItems": [{
-            "itemName": "NA", "hsnCode": "NA", "itemDescription": "NA", "taxRate": 0.0, "batchNo": "NA",
-            "mfgDate": "NA", "expDate": "NA", "qty": 0, "uom": "NA", "rate": 0.0, "discount": 0.0, "amount": 0.0
-        }],
-        "summary": {
-            "totalAmount": 0.0, "cgstLedger": "CGST", "cgstAmount": 0.0, "sgstLedger": "SGST", "sgstAmount": 0.0,
-            "igstLedger": "IGST", "igstAmount": 0.0, "cessLedger": "Cess", "cessAmount": 0.0, "roundOffLedger": "Round-Off", "roundOffAmount": 0.0,
-            "narration": "NA", "termsOfPayment": "NA", "otherReference": "NA", "termsOfDelivery": "NA",
-            "purchaseLedger": "Purchase Account", "costCenterGodown": "Main Location"
-        }
+GEMINI_SCHEMA = {
+    "invoiceHeader": {
+        "invoiceDate": "NA", "invoiceNo": "NA", "supplierInvoiceNo": "NA", "supplierInvoiceDate": "NA", "voucherType": "Purchase",
+        "orderNo": "NA", "orderDate": "NA", "orderDueDate": "NA", "documentType": "Invoice", "subType": "NA",
+        "receiptNoteNo": "NA", "receiptNoteDate": "NA"
+    },
+    "supplierDetails": {
+        "name": "NA", "address1": "NA", "address2": "NA", "address3": "NA", "pincode": "NA", "state": "NA",
+        "placeOfSupply": "NA", "country": "INDIA", "gstin": "NA", "gstRegistrationType": "Regular"
+    },
+    "buyerDetails": {
+        "name": "NA", "address1": "NA", "address2": "NA", "address3": "NA", "pincode": "NA", "state": "NA",
+        "place": "NA", "gstin": "NA"
+    },
+    "logisticsDetails": {
+        "lrNo": "NA", "despatchThrough": "NA", "destination": "NA", "transportMode": "NA", "distance": "NA",
+        "transporterName": "NA", "vehicleNumber": "NA", "vehicleType": "NA", "docAirWayBillNo": "NA", "docDate": "NA", "transporterID": "NA"
+    },
+    "eWayBillDetails": {
+        "eWayBillNo": "NA", "eWayBillDate": "NA", "consolidatedEWayBillNo": "NA", "consolidatedEWayDate": "NA", "statusOfEWayBill": "NA"
+    },
+    "lineItems": [{
+        "itemName": "NA", "hsnCode": "NA", "itemDescription": "NA", "taxRate": 0.0, "batchNo": "NA",
+        "mfgDate": "NA", "expDate": "NA", "qty": 0, "uom": "NA", "rate": 0.0, "discount": 0.0, "amount": 0.0
+    }],
+    "summary": {
+        "totalAmount": 0.0, "cgstLedger": "CGST", "cgstAmount": 0.0, "sgstLedger": "SGST", "sgstAmount": 0.0,
+        "igstLedger": "IGST", "igstAmount": 0.0, "cessLedger": "Cess", "cessAmount": 0.0, "roundOffLedger": "Round-Off", "roundOffAmount": 0.0,
+        "narration": "NA", "termsOfPayment": "NA", "otherReference": "NA", "termsOfDelivery": "NA",
+        "purchaseLedger": "Purchase Account", "costCenterGodown": "Main Location"
     }
-    
-    prompt = f"""
+}
+
+# Invoice text longer than this is trimmed before it is sent (~4 characters per token).
+MAX_INVOICE_CHARS = 30000
+
+@functools.lru_cache(maxsize=None)
+def get_gemini_prompt():
+    """Returns the detailed instruction prompt for the Gemini API for all 85 fields (built once)."""
+    prompt = textwrap.dedent(f"""
     You are an expert AI data extractor for invoices. Your task is to analyze the raw text from an Indian invoice and extract all specified information into a structured JSON format.
 
     Instructions:
@@ -102,105 +270,295 @@ def get_gemini_prompt():
     5.  The final output must be ONLY the valid JSON object, with no additional text, explanations, or formatting.
 
     JSON Schema to populate:
-    {json.dumps(json_schema, indent=2)}
+    {json.dumps(GEMINI_SCHEMA, separators=(",", ":"))}
 
     Now, here is the invoice text:
     ---
-    """
+    """).lstrip()
     return prompt
 
-def extract_data_with_gemini(api_key, invoice_text):
-    """Sends the invoice text to the Gemini API and parses the structured response."""
-    if not api_key: raise ValueError("Gemini API Key is required.")
-    full_prompt = get_gemini_prompt() + invoice_text
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-    headers = {'Content-Type': 'application/json'}
-    payload = {
-        "contents": [{"parts": [{"text": full_prompt}]}],
-        "generationConfig": { "responseMimeType": "application/json", "temperature": 0.1 }
-    }
+# --- Batched Requests ---
+# Short invoices are dominated by the fixed schema prompt and the round trip, so several of them
+# can share one request. The response must stay within the model's output limit (every invoice
+# comes back with the full schema), which bounds the number of invoices more than their text does.
+MAX_BATCH_INVOICES = 4
+MAX_BATCH_CHARS = 12000  # Invoice text per batched request; longer invoices are sent on their own
+INVOICE_MARKER = "=== INVOICE {} ==="
+
+@functools.lru_cache(maxsize=None)
+def get_gemini_batch_prompt():
+    """Returns the instruction prompt for several invoices in one request (built once)."""
+    prompt = textwrap.dedent(f"""
+    You are an expert AI data extractor for invoices. The text below contains several separate Indian invoices. Each one starts with a line "{INVOICE_MARKER.format('<id>')}". Extract every invoice on its own into the JSON schema below.
+
+    Instructions:
+    1.  Treat each invoice independently. Never copy values from one invoice into another.
+    2.  Populate all fields in the JSON schema below for every invoice.
+    3.  If information for a field is not found, you MUST use the default value ("NA" for text, 0 for numbers). Do not leave any field blank.
+    4.  'lineItems' must be a JSON array. Create one object in the array for each distinct product or service line item found in the invoice table.
+    5.  The final output must be ONLY a valid JSON array with one element per invoice, in the order given, each of the form {{"invoiceId": "<id>", "invoice": <the populated schema>}}, with no additional text, explanations, or formatting.
+
+    JSON Schema to populate for each invoice:
+    {json.dumps(GEMINI_SCHEMA, separators=(",", ":"))}
+
+    Now, here are the invoices:
+    """).lstrip()
+    return prompt
+
+# Cached Gemini results are only reused while the prompts/schema they were produced with are unchanged.
+PROMPT_VERSION = hashlib.sha256((get_gemini_prompt() + get_gemini_batch_prompt()).encode("utf-8")).hexdigest()[:16]
+
+# --- Request Shaping ---
+HEADER_FOOTER_LINES = 3  # Lines at the top and bottom of each page checked for repeated headers/footers
+_PAGE_NUMBER = re.compile(r"\bpage\s*(?:no\.?\s*)?\d+(?:\s*(?:of|/)\s*\d+)?", re.I)
+_AMOUNT = re.compile(r"\d\.\d{2}\b|\u20b9|\brs\.?\s*\d", re.I)
+
+def _line_key(line):
+    """
+    Normalises a line for repeat detection: only the page number may differ, so 'Page 2 of 5'
+    and 'Page 3 of 5' match but line items or totals that merely look alike never do.
+    """
+    return _PAGE_NUMBER.sub("page #", line.lower())
+
+def normalize_invoice_text(text, max_chars=MAX_INVOICE_CHARS):
+    """
+    Shrinks invoice text before it is sent: collapses whitespace, drops blank lines, removes
+    headers/footers repeated across pages (keeping the first copy) and trims the text
+    to max_chars, keeping the start and the end of the invoice where the totals are.
+    A header/footer line must be identical on every page (apart from a page number), and a
+    line with an amount in it is never removed.
+    """
+    pages = []
+    for page in text.split(PAGE_SEPARATOR):
+        lines = [re.sub(r"\s+", " ", line).strip() for line in page.splitlines()]
+        pages.append([line for line in lines if line])
+
+    if len(pages) > 1:
+        edge_counts = {}
+        for lines in pages:
+            for key in {_line_key(line) for line in lines[:HEADER_FOOTER_LINES] + lines[-HEADER_FOOTER_LINES:]}:
+                edge_counts[key] = edge_counts.get(key, 0) + 1
+        repeated = {key for key, count in edge_counts.items() if count == len(pages)}
+        seen, deduplicated = set(), []
+        for lines in pages:
+            kept = []
+            for i, line in enumerate(lines):
+                key = _line_key(line)
+                at_edge = i < HEADER_FOOTER_LINES or i >= len(lines) - HEADER_FOOTER_LINES
+                if at_edge and key in repeated and not _AMOUNT.search(line):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                kept.append(line)
+            deduplicated.append(kept)
+        pages = deduplicated
+
+    return _trim_invoice_text("\n".join(line for lines in pages for line in lines), max_chars)
+
+def _trim_invoice_text(normalized, max_chars):
+    if max_chars and len(normalized) > max_chars:
+        head = max_chars * 2 // 3
+        tail = max_chars - head
+        normalized = normalized[:head] + "\n[...]\n" + normalized[-tail:]
+    return normalized
+
+def _shape_invoice_text(invoice_text, max_chars, pdf_path=None):
+    """
+    normalize_invoice_text, with a warning naming the file when the text is over max_chars:
+    the part cut from the middle is usually line items, which will then be missing.
+    """
+    normalized = normalize_invoice_text(invoice_text, None)
+    shaped = _trim_invoice_text(normalized, max_chars)
+    if len(shaped) < len(normalized):
+        print(f"WARNING: {os.path.basename(pdf_path) if pdf_path else 'Invoice'} has {len(normalized)} chars of text, "
+              f"over the limit of {max_chars}; the middle {len(normalized) - max_chars} chars were not sent to Gemini "
+              f"and their line items may be missing. Raise --max-invoice-chars to send all of it.")
+    return shaped
+
+_default_clients = {}
+_default_clients_lock = threading.Lock()
+
+def get_gemini_client(api_key, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=None):
+    """
+    Returns a shared GeminiClient for the key and rate limits, so calls reuse one pooled
+    keep-alive session and share its request and token buckets.
+    """
+    key = (api_key, requests_per_minute, tokens_per_minute)
+    with _default_clients_lock:
+        if key not in _default_clients:
+            _default_clients[key] = GeminiClient(api_key, requests_per_minute=requests_per_minute,
+                                                 tokens_per_minute=tokens_per_minute)
+        return _default_clients[key]
+
+def extract_data_with_gemini(api_key, invoice_text, client=None, max_chars=MAX_INVOICE_CHARS, pdf_path=None):
+    """
+    Sends the invoice text (at most max_chars of it after normalization; 0 or None: all of it)
+    to the Gemini API and parses the structured response. `pdf_path` names the file in warnings.
+    """
+    if not api_key and client is None: raise ValueError("Gemini API Key is required.")
+    client = client or get_gemini_client(api_key)
+    shaped_text = _shape_invoice_text(invoice_text, max_chars, pdf_path)
+    print(f"Invoice text: {len(invoice_text)} -> {len(shaped_text)} chars after normalization")
+    content_text = client.generate(get_gemini_prompt() + shaped_text)
     try:
-        response = requests.post(api_url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()
-        content_text = response.json()['candidates'][0]['content']['parts'][0]['text']
-        return json.loads(content_text)
-    except requests.exceptions.RequestException as e:
-        error_info = response.json().get('error', {})
-        raise ConnectionError(f"API Error: {error_info.get('message', 'Failed to connect to Gemini API.')}")
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
-        raise ValueError(f"Could not parse a valid JSON response from Gemini. Error: {e}")
+        with instrumentation.span("json"):
+            return json.loads(content_text)
+    except json.JSONDecodeError as e:
+        raise GeminiResponseError(f"Could not parse a valid JSON response from Gemini. Error: {e}")
 
-# --- Main Orchestration Function (LOGIC REVERTED to one row per item) ---
-def process_invoice_file(pdf_path, api_key):
+def _split_batch_response(content_text, invoice_ids):
+    """Maps invoice ID -> structured data for every well-formed entry of a batched response."""
+    try:
+        with instrumentation.span("json"):
+            entries = json.loads(content_text)
+    except json.JSONDecodeError as e:
+        raise GeminiResponseError(f"Could not parse a valid JSON response from Gemini. Error: {e}")
+    if isinstance(entries, dict):  # Tolerate the array being wrapped in an object
+        entries = next((value for value in entries.values() if isinstance(value, list)), [])
+    if not isinstance(entries, list):
+        raise GeminiResponseError("Gemini did not return a JSON array for the batched invoices.")
+    results = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        invoice_id, invoice = str(entry.get("invoiceId", "")), entry.get("invoice")
+        if invoice_id in invoice_ids and invoice_id not in results and isinstance(invoice, dict) \
+                and isinstance(invoice.get("invoiceHeader"), dict) and isinstance(invoice.get("lineItems"), list):
+            results[invoice_id] = invoice
+    return results
+
+def extract_batch_with_gemini(api_key, invoice_texts, client=None, max_chars=MAX_INVOICE_CHARS, pdf_paths=None):
     """
-    Orchestrates extraction and returns a list of dictionaries, one for each line item.
+    Sends several invoices to Gemini in one request. Returns the structured data for each text,
+    in order, with None for any invoice the response did not answer validly (send those on
+    their own). Raises like extract_data_with_gemini if the request or the whole response fails.
     """
-    print(f"Processing {pdf_path}...")
-    
-    text = extract_text_from_pdf(pdf_path)
-    if len(text.strip()) < 150:
-        print("Switching to OCR...")
-        text = extract_text_with_ocr(pdf_path)
-    if not text:
+    pdf_paths = pdf_paths or [None] * len(invoice_texts)
+    if not api_key and client is None: raise ValueError("Gemini API Key is required.")
+    client = client or get_gemini_client(api_key)
+    invoice_ids = [str(number) for number in range(1, len(invoice_texts) + 1)]
+    parts = [get_gemini_batch_prompt()]
+    for invoice_id, text, pdf_path in zip(invoice_ids, invoice_texts, pdf_paths):
+        parts.append(INVOICE_MARKER.format(invoice_id) + "\n" + _shape_invoice_text(text, max_chars, pdf_path) + "\n")
+    print(f"Sending {len(invoice_texts)} invoices in one request "
+          f"({sum(len(part) for part in parts[1:])} chars of invoice text)")
+    results = _split_batch_response(client.generate("".join(parts)), set(invoice_ids))
+    missing = len(invoice_ids) - len(results)
+    if missing:
+        print(f"Batched response was missing or malformed for {missing} of {len(invoice_ids)} invoices.")
+    return [results.get(invoice_id) for invoice_id in invoice_ids]
+
+# --- Extraction Modes ---
+# gemini:      every invoice goes to Gemini (default).
+# local-first: the local rule-based extractor runs first; Gemini is only called when it is not
+#              confident about the key fields or the amounts do not reconcile.
+# local-only:  no network at all; whatever the local extractor finds is used.
+EXTRACTION_MODES = ("gemini", "local-first", "local-only")
+
+def structure_invoice_offline(invoice_text, mode="gemini", templates=None, pdf_path=None):
+    """
+    Structures the invoice without the network: with the supplier's layout template, or with the
+    local rules when the mode allows it. Returns (structured_data, source), or (None, None) when
+    the invoice has to go to Gemini.
+    """
+    if mode not in EXTRACTION_MODES:
+        raise ValueError(f"Unknown extraction mode '{mode}'. Choose one of: {', '.join(EXTRACTION_MODES)}.")
+    if templates is not None and pdf_path:
+        structured_data = templates.parse_invoice(pdf_path, invoice_text)
+        if structured_data is not None:
+            return structured_data, "template"
+    if mode != "gemini":
+        with instrumentation.span("local"):
+            structured_data, confidence = extract_invoice_fields(invoice_text)
+        if mode == "local-only" or is_confident(confidence):
+            return structured_data, "local"
+    return None, None
+
+def structure_invoice_text(api_key, invoice_text, mode="gemini", client=None, templates=None, pdf_path=None,
+                           max_chars=MAX_INVOICE_CHARS):
+    """
+    Turns invoice text into the nested invoice structure. Returns (structured_data, source).
+    With a TemplateStore and the PDF path, invoices from known suppliers are read with their
+    layout template first, and Gemini results are used to learn the layout of new suppliers.
+    Gemini is sent at most `max_chars` of the normalized text (see extract_data_with_gemini).
+    """
+    structured_data, source = structure_invoice_offline(invoice_text, mode, templates, pdf_path)
+    if structured_data is not None:
+        return structured_data, source
+    structured_data = extract_data_with_gemini(api_key, invoice_text, client=client, max_chars=max_chars, pdf_path=pdf_path)
+    if templates is not None and pdf_path:
+        templates.learn(pdf_path, structured_data)
+    return structured_data, "gemini"
+
+# --- Pipeline Stages ---
+# Each stage is a plain top-level function so it can be handed to a thread or process pool.
+def extract_invoice_text(pdf_path, ocr_workers=None, policy=DEFAULT_PAGE_POLICY):
+    """Extracts the invoice text, OCRing only the pages that have no usable machine-readable text."""
+    try:
+        text, routes = extract_text_routed(pdf_path, ocr_workers, policy)
+    except Exception as e:
+        raise ValueError(f"Could not read PDF {os.path.basename(pdf_path)}: {e}")
+    ocr_numbers = [str(route.page_number + 1) for route in routes if route.method == "ocr"]
+    if ocr_numbers:
+        print(f"{os.path.basename(pdf_path)}: OCR on page(s) {', '.join(ocr_numbers)} of {len(routes)}")
+    if not text.strip():
         raise ValueError("Could not extract any text from the PDF.")
+    return text
 
-    structured_data = extract_data_with_gemini(api_key, text)
-
-    # --- Reformat the JSON from Gemini into the flat, row-based structure for Excel ---
-    all_rows = []
-    
-    # Unpack all data sections from the JSON response, using .get() for safety
-    header = structured_data.get('invoiceHeader', {})
-    supplier = structured_data.get('supplierDetails', {})
-    buyer = structured_data.get('buyerDetails', {})
-    logistics = structured_data.get('logisticsDetails', {})
-    eway = structured_data.get('eWayBillDetails', {})
-    summary = structured_data.get('summary', {})
-    
-    # Base data is the same for all items in one invoice
-    base_data = {
-        'Invoice Date': header.get('invoiceDate'), 'Invoice No': header.get('invoiceNo'),
-        'Supplier Invoice No': header.get('supplierInvoiceNo'), 'Supplier Invoice Date': header.get('supplierInvoiceDate'),
-        'Voucher Type': header.get('voucherType'), 'Supplier Name': supplier.get('name'),
-        'Address 1': supplier.get('address1'), 'Address 2': supplier.get('address2'), 'Address 3': supplier.get('address3'),
-        'Supplier Pincode': supplier.get('pincode'), 'State': supplier.get('state'), 'Place of Supply': supplier.get('placeOfSupply'),
-        'Country': supplier.get('country'), 'GSTIN/UIN': supplier.get('gstin'),
-        'Consignor From Name': buyer.get('name'), 'Consignor From Add 1': buyer.get('address1'), 'Consignor From Add 2': buyer.get('address2'),
-        'Consignor From Add 3': buyer.get('address3'), 'Consignor From State': buyer.get('state'), 'Consignor From Place': buyer.get('place'),
-        'Consignor From Pincode': buyer.get('pincode'), 'Consignor From GSTIN': buyer.get('gstin'),
-        'GST Registration Type': supplier.get('gstRegistrationType'), 'Receipt Note No': header.get('receiptNoteNo'),
-        'Receipt Note Date': header.get('receiptNoteDate'), 'Order No': header.get('orderNo'), 'Order Date': header.get('orderDate'),
-        'Order Due Date': header.get('orderDueDate'), 'LR No': logistics.get('lrNo'), 'Despatch Through': logistics.get('despatchThrough'),
-        'Destination': logistics.get('destination'), 'Term of Payment': summary.get('termsOfPayment'),
-        'Other Reference': summary.get('otherReference'), 'Terms of Delivery': summary.get('termsOfDelivery'),
-        'Purchase Ledger': summary.get('purchaseLedger'), 'CGST Ledger': summary.get('cgstLedger'), 'CGST Amount': summary.get('cgstAmount'),
-        'SGST Ledger': summary.get('sgstLedger'), 'SGST Amount': summary.get('sgstAmount'), 'IGST Ledger': summary.get('igstLedger'),
-        'IGST Amount': summary.get('igstAmount'), 'Cess Ledger': summary.get('cessLedger'), 'Cess Amount': summary.get('cessAmount'),
-        'Round off Ledger': summary.get('roundOffLedger'), 'Round off Amount': summary.get('roundOffAmount'),
-        'Cost Center Godown': summary.get('costCenterGodown'), 'Narration': summary.get('narration'),
-        'e-Way Bill No': eway.get('eWayBillNo'), 'e-Way Bill Date': eway.get('eWayBillDate'),
-        'Consolidated e-Way Bill No': eway.get('consolidatedEWayBillNo'), 'Consolidated e-Way Date': eway.get('consolidatedEWayDate'),
-        'Sub Type': header.get('subType'), 'Document Type': header.get('documentType'),
-        'Status of e-Way Bill': eway.get('statusOfEWayBill'), 'Transport Mode': logistics.get('transportMode'),
-        'Distance': logistics.get('distance'), 'Transporter Name': logistics.get('transporterName'),
-        'Vehical Number': logistics.get('vehicleNumber'), 'Vehical Type': logistics.get('vehicleType'),
-        'Doc/AirWay Bill No': logistics.get('docAirWayBillNo'), 'Doc Date': logistics.get('docDate'),
-        'Transporter ID': logistics.get('transporterID'),
-    }
+def build_invoice_rows(structured_data):
+    """
+    Converts the JSON from Gemini into the typed rows of the invoice (one row per item). The header
+    is stored once; see invoice_model.InvoiceRows.
+    """
+    return InvoiceRows.from_structured(structured_data)
 
-    line_items = structured_data.get('lineItems', [{}])
-    if not line_items: line_items = [{}] # Ensure at least one row is created
-
-    for item in line_items:
-        # Combine the main invoice data with the line item data for each row
-        full_row = {
-            **base_data, # Start with all the header/footer info
-            'Item Name': item.get('itemName'), 'HSN Code': item.get('hsnCode'), 'Item Description': item.get('itemDescription'),
-            'Tax Rate': item.get('taxRate'), 'Batch No': item.get('batchNo'), 'Mfg Date': item.get('mfgDate'),
-            'Exp Date': item.get('expDate'), 'QTY': item.get('qty'), 'UOM': item.get('uom'), 'Rate': item.get('rate'),
-            'Discount': item.get('discount'), 'Amount': item.get('amount'),
-        }
-        all_rows.append(full_row)
-        
-    print(f"Successfully processed {pdf_path} using Gemini, found {len(all_rows)} items.")
+# --- Main Orchestration Function (LOGIC REVERTED to one row per item) ---
+def process_invoice_file(pdf_path, api_key, cache=None, mode="gemini", templates=None, duplicates=None,
+                         page_policy=DEFAULT_PAGE_POLICY, ocr_workers=None, details=None,
+                         requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=None,
+                         max_chars=MAX_INVOICE_CHARS):
+    """
+    Orchestrates extraction and returns the invoice's rows as an invoice_model.InvoiceRows,
+    one row per line item.
+    If an ExtractionCache is given, cached text and results are reused and new ones are stored.
+    `mode` selects Gemini, the local rule-based extractor, or local-first (see EXTRACTION_MODES).
+    With a TemplateStore, known supplier layouts are read without calling Gemini.
+    With a DuplicateIndex, an invoice that was already written returns no rows; the caller adds
+    the rows it writes with duplicates.add(); a `details` dict receives the 'pdf_hash' and text
+    'fingerprint' computed on the way, for that call. `page_policy` sets the OCR resolution and
+    page limits, and `ocr_workers` the processes scanned pages are OCR'd on. Gemini requests
+    are limited to `requests_per_minute` and, if given, `tokens_per_minute` (0 or None: no limit),
+    shared by every call with the same key and limits. At most `max_chars` of the normalized
+    text is sent to Gemini (0 or None: all of it); a file over the limit is named in a warning.
+    """
+    details = {} if details is None else details
+    print(f"Processing {pdf_path}...")
+    with instrumentation.invoice(pdf_path):
+        with instrumentation.span("cache"):
+            pdf_hash = hash_pdf(pdf_path) if cache or duplicates is not None else None
+            details.update(pdf_hash=pdf_hash, fingerprint=None)
+            duplicate = duplicates.match_file(pdf_hash) if duplicates is not None else None
+            structured_data = cache.get_data(pdf_hash) if cache and not duplicate else None
+        source = "cache"
+        if structured_data is None and not duplicate:
+            text = cache.get_text(pdf_hash) if cache else None
+            if text is None:
+                text = extract_invoice_text(pdf_path, ocr_workers, page_policy)
+                if cache and reads_all_pages(page_policy): cache.put_text(pdf_hash, text)
+            if duplicates is not None:
+                details["fingerprint"] = text_fingerprint(text)
+                duplicate = duplicates.match_text(text, details["fingerprint"])
+            if not duplicate:
+                client = get_gemini_client(api_key, requests_per_minute, tokens_per_minute) \
+                    if api_key and mode != "local-only" else None
+                structured_data, source = structure_invoice_text(api_key, text, mode, client, templates, pdf_path, max_chars)
+                if cache and source == "gemini": cache.put_data(pdf_hash, structured_data)
+        all_rows = build_invoice_rows(structured_data) if not duplicate else []
+        if all_rows and duplicates is not None:
+            duplicate = duplicates.match_rows(all_rows)
+            all_rows = [] if duplicate else all_rows
+    if duplicate:
+        print(f"Skipping {pdf_path}: {duplicate['reason']} as {duplicate['pdf_path']}, written {duplicate['added']}.")
+        return []
+    print(f"Successfully processed {pdf_path} using {source}, found {len(all_rows)} items.")
     return all_rows
\ No newline at end of file
@@ -0,0 +1,160 @@
+# gemini_client.py
+# Reusable, thread-safe client for the Gemini generateContent endpoint.
+# Keeps a pooled keep-alive session, rate limits requests and tokens per minute with token
+# buckets, and retries 429/5xx responses and network errors with jittered exponential backoff.
+
+import json
+import os
+import random
+import threading
+import time
+import requests
+import instrumentation
+from requests.adapters import HTTPAdapter
+
+DEFAULT_GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+DEFAULT_REQUESTS_PER_MINUTE = 60
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class GeminiAPIError(ConnectionError):
+    """Raised when the API keeps failing or returns a non-retryable error."""
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def transient(self):
+        """True for rate limits, server errors and network failures, which may succeed later."""
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS_CODES
+
+class GeminiResponseError(ValueError):
+    """Raised when the API answered but the answer is not the JSON that was asked for (worth asking again)."""
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate_per_minute`; acquire() blocks until allowed."""
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+class GeminiClient:
+    """
+    Sends prompts to Gemini over one pooled session. Safe to share between threads, so a
+    thread pool of `pool_size` workers can keep that many requests in flight at once.
+    """
+    def __init__(self, api_key, api_url=None, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=None, max_retries=5, timeout=(10, 120), pool_size=8,
+                 backoff_base=1.0, backoff_max=60.0):
+        if not api_key: raise ValueError("Gemini API Key is required.")
+        self.api_key = api_key
+        # The endpoint can be pointed at a local mock server (e.g. for benchmarks) via the environment.
+        self.api_url = api_url or os.environ.get("GEMINI_API_URL", DEFAULT_GEMINI_API_URL)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.request_limiter = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_limiter = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "bytes_sent": 0}
+        self._stats_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({'Content-Type': 'application/json', 'x-goog-api-key': api_key})
+
+    def _count(self, stat, amount=1):
+        with self._stats_lock:
+            self.stats[stat] += amount
+        instrumentation.count(stat, amount)
+
+    def _backoff(self, attempt, retry_after=None):
+        """Sleeps before the next attempt: Retry-After if the server sent one, else full-jitter backoff."""
+        if retry_after is not None:
+            delay = min(retry_after, self.backoff_max)
+        else:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        time.sleep(delay)
+
+    def generate(self, prompt, generation_config=None):
+        """Sends one prompt and returns the text of the first candidate."""
+        payload = json.dumps({
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": generation_config or {"responseMimeType": "application/json", "temperature": 0.1},
+        }, separators=(",", ":")).encode("utf-8")
+        if self.token_limiter:
+            self.token_limiter.acquire(len(prompt) // 4)  # Rough estimate: ~4 characters per token
+
+        for attempt in range(self.max_retries + 1):
+            if self.request_limiter:
+                self.request_limiter.acquire()
+            self._count("requests")
+            self._count("bytes_sent", len(payload))
+            retry_after = None
+            try:
+                with instrumentation.span("http"):
+                    response = self.session.post(self.api_url, data=payload, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = GeminiAPIError(f"API Error: Failed to connect to Gemini API ({e.__class__.__name__}).")
+            else:
+                if response.ok:
+                    try:
+                        return response.json()['candidates'][0]['content']['parts'][0]['text']
+                    except (KeyError, IndexError, ValueError) as e:
+                        raise GeminiResponseError(f"Could not parse a valid JSON response from Gemini. Error: {e}")
+                error = GeminiAPIError(f"API Error: {_error_message(response)}", response.status_code)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self._count("failures")
+                    raise error
+                retry_after = _retry_after_seconds(response)
+
+            if attempt == self.max_retries:
+                break
+            self._count("retries")
+            self._backoff(attempt, retry_after)
+
+        self._count("failures")
+        raise error
+
+    def log_stats(self):
+        s = self.stats
+        average = s["bytes_sent"] / s["requests"] if s["requests"] else 0
+        print(f"Gemini: {s['requests']} requests, {s['retries']} retries, {s['failures']} failed, "
+              f"{s['bytes_sent'] / 1024:.1f} KB sent ({average / 1024:.1f} KB per request)")
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _error_message(response):
+    try:
+        return response.json().get('error', {}).get('message') or f"HTTP {response.status_code}"
+    except ValueError:
+        return f"HTTP {response.status_code}"
+
+def _retry_after_seconds(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
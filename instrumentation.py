@@ -0,0 +1,256 @@
+# instrumentation.py
+# Per-invoice, per-stage timing for a run. Code marks its stages with `span("ocr")` and its
+# counters with `count("ocr_pages")`; both cost nothing until a RunRecorder is started. Spans
+# recorded in worker processes are carried back with the stage's result (see `measured`), and
+# spans on the main process's threads are attributed to the invoice the thread is working on.
+# A run report can be written as JSON (summary, per-invoice breakdown and every span) or CSV
+# (one row per span), and each stage can optionally be profiled with cProfile. Profile stats
+# travel back from the workers the same way and are accumulated per stage in memory; the
+# .prof files are written once, when the run finishes (see `write_profiles`).
+
+import cProfile
+import csv
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+_recorder = None  # The active RunRecorder of this process, if any
+_local = threading.local()  # .invoice: what the current thread is working on; .profiling: a profile is on
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+class RunRecorder:
+    """Collects spans and counters for one run. Safe to share between threads."""
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.started = time.time()
+        self.finished = None
+        self.spans = []     # (invoice, stage, start, seconds, pid, thread)
+        self.counters = {}  # invoice -> {name: value}
+        self._lock = threading.Lock()
+        self._profiles = {}  # (stage, thread) -> cProfile.Profile of this process, accumulated across calls
+        self._merged_profiles = {}  # stage -> raw stats received from worker processes
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def add_span(self, stage, start, seconds, invoice=None):
+        with self._lock:
+            self.spans.append((invoice, stage, start, seconds, os.getpid(), threading.current_thread().name))
+
+    def add_count(self, name, amount=1, invoice=None):
+        with self._lock:
+            counters = self.counters.setdefault(invoice, {})
+            counters[name] = counters.get(name, 0) + amount
+
+    def export(self):
+        """Returns the recorded spans, counters and profile stats as plain, picklable data."""
+        with self._lock:
+            return (list(self.spans), {invoice: dict(c) for invoice, c in self.counters.items()},
+                    self._profile_stats())
+
+    def merge(self, exported, invoice=None):
+        """Adds spans, counters and profiles recorded elsewhere (e.g. in a worker process), attributing them to `invoice`."""
+        spans, counters, profiles = exported
+        with self._lock:
+            self.spans.extend((span[0] or invoice,) + tuple(span[1:]) for span in spans)
+            for stage, stats in profiles.items():
+                _add_stats(self._merged_profiles.setdefault(stage, {}), stats)
+        for owner, values in counters.items():
+            for name, amount in values.items():
+                self.add_count(name, amount, owner or invoice)
+
+    def _profile(self, stage):
+        key = (stage, threading.get_ident())
+        with self._lock:
+            if key not in self._profiles:
+                self._profiles[key] = cProfile.Profile()
+            return self._profiles[key]
+
+    def _profile_stats(self):
+        """stage -> raw cProfile stats of this process's profiles and those merged from workers. Call under the lock."""
+        stages = {stage: dict(stats) for stage, stats in self._merged_profiles.items()}
+        for (stage, _), profile in self._profiles.items():
+            profile.create_stats()
+            _add_stats(stages.setdefault(stage, {}), profile.stats)
+        return stages
+
+    # --- Reporting ---
+    def totals(self):
+        totals = {}
+        for values in self.counters.values():
+            for name, amount in values.items():
+                totals[name] = totals.get(name, 0) + amount
+        return totals
+
+    def stage_summary(self):
+        """Per stage: number of spans, total/mean/p50/p95/max seconds."""
+        durations = {}
+        for _, stage, _, seconds, _, _ in self.spans:
+            durations.setdefault(stage, []).append(seconds)
+        summary = {}
+        for stage, values in durations.items():
+            values.sort()
+            summary[stage] = {
+                "count": len(values), "total": round(sum(values), 6), "mean": round(sum(values) / len(values), 6),
+                "p50": round(_percentile(values, 0.5), 6), "p95": round(_percentile(values, 0.95), 6),
+                "max": round(values[-1], 6),
+            }
+        return summary
+
+    def per_invoice(self):
+        invoices = {}
+        for invoice, stage, _, seconds, _, _ in self.spans:
+            stages = invoices.setdefault(invoice, {"stages": {}, "counters": {}})["stages"]
+            stages[stage] = round(stages.get(stage, 0.0) + seconds, 6)
+        for invoice, values in self.counters.items():
+            invoices.setdefault(invoice, {"stages": {}, "counters": {}})["counters"] = dict(values)
+        return {str(invoice): values for invoice, values in invoices.items()}
+
+    def log_summary(self):
+        wall = (self.finished or time.time()) - self.started
+        print(f"Run time: {wall:.2f}s")
+        print(f"{'stage':<12} {'count':>6} {'total s':>9} {'mean s':>8} {'p50 s':>8} {'p95 s':>8} {'max s':>8}")
+        for stage, s in sorted(self.stage_summary().items(), key=lambda item: -item[1]["total"]):
+            print(f"{stage:<12} {s['count']:>6} {s['total']:>9.2f} {s['mean']:>8.3f} {s['p50']:>8.3f} {s['p95']:>8.3f} {s['max']:>8.3f}")
+        totals = self.totals()
+        if totals:
+            print("Counters: " + ", ".join(f"{name} {value}" for name, value in sorted(totals.items())))
+
+    def write_report(self, path):
+        """Writes the run report; CSV (one row per span) for a .csv path, JSON otherwise."""
+        if path.lower().endswith(".csv"):
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["invoice", "stage", "start", "seconds", "pid", "thread"])
+                for invoice, stage, start, seconds, pid, thread in sorted(self.spans, key=lambda s: s[2]):
+                    writer.writerow([invoice or "", stage, f"{start - self.started:.6f}", f"{seconds:.6f}", pid, thread])
+            return
+        report = {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "wall_seconds": round((self.finished or time.time()) - self.started, 6),
+            "stages": self.stage_summary(), "counters": self.totals(), "invoices": self.per_invoice(),
+            "spans": [{"invoice": invoice, "stage": stage, "start": round(start - self.started, 6), "seconds": round(seconds, 6),
+                       "pid": pid, "thread": thread} for invoice, stage, start, seconds, pid, thread in self.spans],
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+
+    def write_profiles(self, top=25):
+        """
+        Writes one <stage>.prof per stage and combined.prof (every stage of every process) to
+        profile_dir, prints the hottest functions and returns the combined file's path.
+        """
+        with self._lock:
+            stages = self._profile_stats()
+        if not stages:
+            return None
+        combined = pstats.Stats()
+        for stage, raw in stages.items():
+            stats = pstats.Stats(_StatsSnapshot(raw))
+            stats.dump_stats(os.path.join(self.profile_dir, f"{stage}.prof"))
+            combined.add(stats)
+        path = os.path.join(self.profile_dir, "combined.prof")
+        combined.dump_stats(path)
+        combined.sort_stats("cumulative").print_stats(top)
+        return path
+
+class _StatsSnapshot:
+    """Raw cProfile stats in the form pstats.Stats loads (it calls create_stats() and reads .stats)."""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def _add_stats(target, stats):
+    """Adds raw cProfile stats ({func: (cc, nc, tt, ct, callers)}) into target, like pstats.Stats.add."""
+    for func, stat in stats.items():
+        target[func] = pstats.add_func_stats(target[func], stat) if func in target else stat
+
+def start(profile_dir=None):
+    """Starts recording in this process and returns the RunRecorder."""
+    global _recorder
+    _recorder = RunRecorder(profile_dir)
+    return _recorder
+
+def stop():
+    """Stops recording and returns the RunRecorder (None if none was started)."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder:
+        recorder.finished = time.time()
+    return recorder
+
+def active():
+    return _recorder
+
+@contextmanager
+def invoice(name):
+    """Attributes the spans and counters recorded by this thread to an invoice."""
+    previous = getattr(_local, "invoice", None)
+    _local.invoice = name
+    try:
+        yield
+    finally:
+        _local.invoice = previous
+
+@contextmanager
+def span(stage):
+    """Times a stage of the current invoice (and profiles it, if profiling is on)."""
+    recorder = _recorder
+    if recorder is None:
+        yield
+        return
+    profile = None
+    if recorder.profile_dir and not getattr(_local, "profiling", False):
+        profile = recorder._profile(stage)
+        _local.profiling = True
+        profile.enable()
+    start_time, start = time.time(), time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if profile:
+            profile.disable()
+            _local.profiling = False
+        recorder.add_span(stage, start_time, seconds, getattr(_local, "invoice", None))
+
+def count(name, amount=1):
+    """Adds to a counter of the current invoice."""
+    recorder = _recorder
+    if recorder is not None:
+        recorder.add_count(name, amount, getattr(_local, "invoice", None))
+
+def measured(func, enabled, profile_dir, *args):
+    """
+    Runs func(*args) in a worker process. With `enabled`, a recorder collects the spans,
+    counters and profile stats and they are returned with the result as (result, exported) for the parent to
+    merge; otherwise returns (result, None). Top-level so it can be handed to a process pool.
+    """
+    global _recorder
+    if not enabled:
+        return func(*args), None
+    previous, _recorder = _recorder, RunRecorder(profile_dir)
+    try:
+        return func(*args), _recorder.export()
+    finally:
+        _recorder = previous
+
+def submit(pool, func, *args):
+    """Submits func(*args) to a process pool, measuring it if this process is recording."""
+    recorder = _recorder
+    return pool.submit(measured, func, recorder is not None, recorder.profile_dir if recorder else None, *args)
+
+def result(future, invoice=None):
+    """Returns the result of a future from `submit`, merging what the worker recorded."""
+    value, exported = future.result()
+    if exported and _recorder is not None:
+        _recorder.merge(exported, invoice)
+    return value
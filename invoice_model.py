@@ -0,0 +1,265 @@
+# invoice_model.py
+# Compact, typed result of one invoice. The ~60 header fields are converted and stored once per
+# invoice and the line items are kept as one tuple per column, instead of copying the whole
+# header into a dict for every item. Amounts are floats, dates are datetime.date and missing
+# values are None rather than the string "NA". A number or date that cannot be read is kept as
+# the text the model returned (and logged), so the text ledgers still show it; the typed
+# Parquet/Arrow columns store null for it. Rows are only flattened when they are exported:
+# InvoiceRows still behaves like the old list of row dicts (len, indexing, row.get(column)), and
+# `values(columns)` / `to_arrow(invoices, columns)` produce the flat rows or an Arrow table.
+
+import datetime
+import re
+from collections.abc import Mapping, Sequence
+from local_extractor import normalize_date
+
+TEXT, NUMBER, DATE = "text", "number", "date"
+
+# (column, schema section, schema field, type) for the values shared by every row of an invoice.
+HEADER_FIELDS = (
+    ("Invoice Date", "invoiceHeader", "invoiceDate", DATE),
+    ("Invoice No", "invoiceHeader", "invoiceNo", TEXT),
+    ("Supplier Invoice No", "invoiceHeader", "supplierInvoiceNo", TEXT),
+    ("Supplier Invoice Date", "invoiceHeader", "supplierInvoiceDate", DATE),
+    ("Voucher Type", "invoiceHeader", "voucherType", TEXT),
+    ("Supplier Name", "supplierDetails", "name", TEXT),
+    ("Address 1", "supplierDetails", "address1", TEXT),
+    ("Address 2", "supplierDetails", "address2", TEXT),
+    ("Address 3", "supplierDetails", "address3", TEXT),
+    ("Supplier Pincode", "supplierDetails", "pincode", TEXT),
+    ("State", "supplierDetails", "state", TEXT),
+    ("Place of Supply", "supplierDetails", "placeOfSupply", TEXT),
+    ("Country", "supplierDetails", "country", TEXT),
+    ("GSTIN/UIN", "supplierDetails", "gstin", TEXT),
+    ("Consignor From Name", "buyerDetails", "name", TEXT),
+    ("Consignor From Add 1", "buyerDetails", "address1", TEXT),
+    ("Consignor From Add 2", "buyerDetails", "address2", TEXT),
+    ("Consignor From Add 3", "buyerDetails", "address3", TEXT),
+    ("Consignor From State", "buyerDetails", "state", TEXT),
+    ("Consignor From Place", "buyerDetails", "place", TEXT),
+    ("Consignor From Pincode", "buyerDetails", "pincode", TEXT),
+    ("Consignor From GSTIN", "buyerDetails", "gstin", TEXT),
+    ("GST Registration Type", "supplierDetails", "gstRegistrationType", TEXT),
+    ("Receipt Note No", "invoiceHeader", "receiptNoteNo", TEXT),
+    ("Receipt Note Date", "invoiceHeader", "receiptNoteDate", DATE),
+    ("Order No", "invoiceHeader", "orderNo", TEXT),
+    ("Order Date", "invoiceHeader", "orderDate", DATE),
+    ("Order Due Date", "invoiceHeader", "orderDueDate", DATE),
+    ("LR No", "logisticsDetails", "lrNo", TEXT),
+    ("Despatch Through", "logisticsDetails", "despatchThrough", TEXT),
+    ("Destination", "logisticsDetails", "destination", TEXT),
+    ("Term of Payment", "summary", "termsOfPayment", TEXT),
+    ("Other Reference", "summary", "otherReference", TEXT),
+    ("Terms of Delivery", "summary", "termsOfDelivery", TEXT),
+    ("Purchase Ledger", "summary", "purchaseLedger", TEXT),
+    ("CGST Ledger", "summary", "cgstLedger", TEXT),
+    ("CGST Amount", "summary", "cgstAmount", NUMBER),
+    ("SGST Ledger", "summary", "sgstLedger", TEXT),
+    ("SGST Amount", "summary", "sgstAmount", NUMBER),
+    ("IGST Ledger", "summary", "igstLedger", TEXT),
+    ("IGST Amount", "summary", "igstAmount", NUMBER),
+    ("Cess Ledger", "summary", "cessLedger", TEXT),
+    ("Cess Amount", "summary", "cessAmount", NUMBER),
+    ("Round off Ledger", "summary", "roundOffLedger", TEXT),
+    ("Round off Amount", "summary", "roundOffAmount", NUMBER),
+    ("Total Amount", "summary", "totalAmount", NUMBER),
+    ("Cost Center Godown", "summary", "costCenterGodown", TEXT),
+    ("Narration", "summary", "narration", TEXT),
+    ("e-Way Bill No", "eWayBillDetails", "eWayBillNo", TEXT),
+    ("e-Way Bill Date", "eWayBillDetails", "eWayBillDate", DATE),
+    ("Consolidated e-Way Bill No", "eWayBillDetails", "consolidatedEWayBillNo", TEXT),
+    ("Consolidated e-Way Date", "eWayBillDetails", "consolidatedEWayDate", DATE),
+    ("Sub Type", "invoiceHeader", "subType", TEXT),
+    ("Document Type", "invoiceHeader", "documentType", TEXT),
+    ("Status of e-Way Bill", "eWayBillDetails", "statusOfEWayBill", TEXT),
+    ("Transport Mode", "logisticsDetails", "transportMode", TEXT),
+    ("Distance", "logisticsDetails", "distance", TEXT),
+    ("Transporter Name", "logisticsDetails", "transporterName", TEXT),
+    ("Vehical Number", "logisticsDetails", "vehicleNumber", TEXT),
+    ("Vehical Type", "logisticsDetails", "vehicleType", TEXT),
+    ("Doc/AirWay Bill No", "logisticsDetails", "docAirWayBillNo", TEXT),
+    ("Doc Date", "logisticsDetails", "docDate", DATE),
+    ("Transporter ID", "logisticsDetails", "transporterID", TEXT),
+)
+# (column, line item field, type). Mfg/expiry dates are often printed as MM/YY, so they stay text.
+ITEM_FIELDS = (
+    ("Item Name", "itemName", TEXT), ("HSN Code", "hsnCode", TEXT), ("Item Description", "itemDescription", TEXT),
+    ("Tax Rate", "taxRate", NUMBER), ("Batch No", "batchNo", TEXT), ("Mfg Date", "mfgDate", TEXT),
+    ("Exp Date", "expDate", TEXT), ("QTY", "qty", NUMBER), ("UOM", "uom", TEXT), ("Rate", "rate", NUMBER),
+    ("Discount", "discount", NUMBER), ("Amount", "amount", NUMBER),
+)
+HEADER_COLUMNS = tuple(field[0] for field in HEADER_FIELDS)
+ITEM_COLUMNS = tuple(field[0] for field in ITEM_FIELDS)
+ALL_COLUMNS = HEADER_COLUMNS + ITEM_COLUMNS
+COLUMN_TYPES = {field[0]: field[-1] for field in HEADER_FIELDS + ITEM_FIELDS}
+_HEADER_INDEX = {column: i for i, column in enumerate(HEADER_COLUMNS)}
+_ITEM_INDEX = {column: i for i, column in enumerate(ITEM_COLUMNS)}
+
+def to_text(value):
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # e.g. a pincode the model returned as a number
+    text = str(value).strip()
+    return None if text in ("", "NA", "N/A") else text
+
+def to_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = to_text(value)
+    if text is None:
+        return None
+    try:
+        return float(text.lstrip("\u20b9").replace(",", "").strip())
+    except ValueError:
+        return None
+
+_ORDINAL = re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)\b", re.I)
+_TIME = re.compile(r"[\sT]+\d{1,2}:\d{2}(?::\d{2})?(?:\.\d+)?\s*(?:[AP]M)?\s*(?:Z|[+-]\d{2}:?\d{2})?$", re.I)
+_OTHER_DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y.%m.%d", "%B %d %Y", "%b %d %Y", "%d %B, %Y", "%d-%b-%y")
+
+def to_date(value):
+    """
+    Parses the dates the model returns into a date: DD/MM/YYYY and the usual variants, ISO and
+    YYYY/MM/DD, month names ("1st April 2026", "April 01, 2026"), with any time of day ignored.
+    Returns None for anything else.
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    text = to_text(value)
+    if text is None:
+        return None
+    text = _ORDINAL.sub(r"\1", _TIME.sub("", text))
+    normalized = normalize_date(text)
+    if normalized:
+        return datetime.datetime.strptime(normalized, "%d/%m/%Y").date()
+    cleaned = re.sub(r"[\s,]+", " ", text)
+    for fmt in _OTHER_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(cleaned, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+_CONVERTERS = {TEXT: to_text, NUMBER: to_number, DATE: to_date}
+_TYPES = {NUMBER: float, DATE: datetime.date}
+
+def _convert(value, kind, column):
+    """The typed value, or the model's text when it cannot be read as a number/date."""
+    converted = _CONVERTERS[kind](value)
+    if converted is None and kind != TEXT:
+        text = to_text(value)
+        if text is not None:
+            print(f"Could not read {text!r} in {column} as a {kind}; kept as text.")
+            return text
+    return converted
+
+def typed_value(value, kind):
+    """The value if it has the column's type, else None (unreadable text in a number/date column)."""
+    expected = _TYPES.get(kind)
+    return value if expected is None or isinstance(value, expected) else None
+
+class Row(Mapping):
+    """Read-only view of one flattened row (header values plus one line item)."""
+    __slots__ = ("_invoice", "_index")
+
+    def __init__(self, invoice, index):
+        self._invoice = invoice
+        self._index = index
+
+    def __getitem__(self, column):
+        if column in _HEADER_INDEX:
+            return self._invoice.header[_HEADER_INDEX[column]]
+        return self._invoice.items[_ITEM_INDEX[column]][self._index]
+
+    def __iter__(self):
+        return iter(ALL_COLUMNS)
+
+    def __len__(self):
+        return len(ALL_COLUMNS)
+
+    def __repr__(self):
+        return f"Row({dict(self)!r})"
+
+class InvoiceRows(Sequence):
+    """
+    The rows of one invoice: `header` is a tuple in HEADER_COLUMNS order and `items` a tuple of
+    columns (one tuple of values per ITEM_COLUMNS entry). There is always at least one row.
+    Number and date columns hold float/date values, None, or the unreadable text.
+    """
+    __slots__ = ("header", "items")
+
+    def __init__(self, header, items):
+        self.header = tuple(header)
+        self.items = tuple(tuple(column) for column in items)
+
+    @classmethod
+    def from_structured(cls, structured_data):
+        """Converts the nested JSON of the schema (from Gemini, a template or the local rules)."""
+        sections = {section: structured_data.get(section) or {} for _, section, _, _ in HEADER_FIELDS}
+        header = [_convert(sections[section].get(field), kind, column) for column, section, field, kind in HEADER_FIELDS]
+        line_items = [item for item in structured_data.get("lineItems") or [] if isinstance(item, dict)] or [{}]
+        items = [[_convert(item.get(field), kind, column) for item in line_items] for column, field, kind in ITEM_FIELDS]
+        return cls(header, items)
+
+    def __len__(self):
+        return len(self.items[0])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("row index out of range")
+        return Row(self, index)
+
+    def __eq__(self, other):
+        if isinstance(other, InvoiceRows):
+            return self.header == other.header and self.items == other.items
+        return NotImplemented
+
+    def __repr__(self):
+        return f"InvoiceRows({self.get('Invoice No')!r}, {len(self)} items)"
+
+    def get(self, column, default=None):
+        """A header value (the same on every row)."""
+        return self.header[_HEADER_INDEX[column]] if column in _HEADER_INDEX else default
+
+    def column(self, column):
+        """All values of one column, one per row."""
+        if column in _HEADER_INDEX:
+            return [self.header[_HEADER_INDEX[column]]] * len(self)
+        if column in _ITEM_INDEX:
+            return list(self.items[_ITEM_INDEX[column]])
+        return [None] * len(self)
+
+    def values(self, columns=ALL_COLUMNS):
+        """The flattened rows as tuples of values in `columns` order."""
+        return zip(*(self.column(column) for column in columns))
+
+def row_values(rows, columns):
+    """Flattened values of InvoiceRows, or of a plain list of row dicts, in `columns` order."""
+    if isinstance(rows, InvoiceRows):
+        return rows.values(columns)
+    return ([row.get(column) for column in columns] for row in rows)
+
+def arrow_schema(columns=ALL_COLUMNS):
+    import pyarrow as pa
+    types = {TEXT: pa.string(), NUMBER: pa.float64(), DATE: pa.date32()}
+    return pa.schema([(column, types[COLUMN_TYPES.get(column, TEXT)]) for column in columns])
+
+def to_arrow(invoices, columns=ALL_COLUMNS):
+    """Flattens a list of InvoiceRows into one typed pyarrow Table. Requires pyarrow."""
+    import pyarrow as pa
+    schema = arrow_schema(columns)
+    arrays = []
+    for column, field in zip(columns, schema):
+        kind = COLUMN_TYPES.get(column, TEXT)
+        values = [typed_value(value, kind) for invoice in invoices for value in invoice.column(column)]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,391 @@
+# ledger_writer.py
+# Streaming output stage for the Excel ledger (and the CSV/JSONL/Parquet/Arrow exports of the CLI).
+# Results arrive as typed invoice_model.InvoiceRows and are flattened here, column by column:
+# the Excel/CSV/JSONL ledgers keep their DD/MM/YYYY dates and "NA" for missing values, while
+# Parquet and Arrow get real float/date columns with nulls.
+# Rows are appended to a JSONL sidecar file as soon as each invoice completes, so nothing is
+# lost if the app dies mid-batch, and are flushed into the workbook in chunks. Appending to an
+# existing workbook streams the sheet XML through a new zip file and inserts the rows before
+# </sheetData>; the workbook is never loaded into memory or parsed cell by cell.
+
+import csv
+import datetime
+import json
+import math
+import os
+import re
+import shutil
+import time
+import uuid
+import zipfile
+from xml.sax.saxutils import escape
+import openpyxl
+from invoice_model import COLUMN_TYPES, DATE, NUMBER, row_values, to_date, to_number
+
+LEDGER_COLUMNS = [
+    'Invoice Date', 'Invoice No', 'Supplier Name', 'GSTIN/UIN', 'Consignor From Name', 'Consignor From GSTIN',
+    'Item Name', 'HSN Code', 'QTY', 'Rate', 'Batch No', 'Exp Date', 'Amount', 'Narration'
+]
+SHEET_NAME = 'Sheet1'
+OUTPUT_FORMATS = ("xlsx", "csv", "jsonl", "parquet", "arrow")
+DEFAULT_CHUNK_ROWS = 500
+COPY_CHUNK_BYTES = 1024 * 1024
+
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+_ROW_NUMBER = re.compile(rb"<(?:\w+:)?row\b[^>]*?\br=\"(\d+)\"")
+_SHEET_DATA_OPEN = re.compile(rb"<(\w+:)?sheetData\s*(/?)>")
+_DIMENSION = re.compile(rb"(<(?:\w+:)?dimension\s+ref=\")([^\"]*)(\")")
+
+def sidecar_path(output_path, suffix):
+    """A file kept next to the output (manifests, indexes): `ledger.xlsx` -> `ledger.xlsx<suffix>`."""
+    return output_path.rstrip("/\\") + suffix
+
+def open_ledger_writer(output_path, output_format=None, columns=LEDGER_COLUMNS):
+    """Returns a writer for the format, inferred from the file extension when not given."""
+    output_format = output_format or os.path.splitext(output_path)[1].lstrip(".").lower() or "xlsx"
+    writers = {"xlsx": StreamingLedgerWriter, "csv": CsvLedgerWriter, "jsonl": JsonlLedgerWriter,
+               "parquet": ParquetLedgerWriter, "arrow": ArrowLedgerWriter}
+    if output_format not in writers:
+        raise ValueError(f"Unsupported output format '{output_format}'. Choose one of: {', '.join(OUTPUT_FORMATS)}.")
+    return writers[output_format](output_path, columns=columns)
+
+class StagedLedgerWriter:
+    """
+    Base class for outputs that cannot be appended to cheaply. Call append_rows() as each
+    invoice completes and close() at the end of the batch. Rows staged by a run that died
+    before flushing are picked up and written by the next writer opened on the same output.
+    Subclasses implement _write_staged(rows, count).
+    """
+    def __init__(self, output_path, columns=LEDGER_COLUMNS, chunk_rows=DEFAULT_CHUNK_ROWS):
+        self.output_path = output_path
+        self.columns = list(columns)
+        self.chunk_rows = chunk_rows
+        self.staging_path = output_path + ".pending.jsonl"
+        self.rows_written = 0
+        self._pending = 0
+        if os.path.exists(self.staging_path):
+            with open(self.staging_path, encoding="utf-8") as f:
+                self._pending = sum(1 for line in f if line.strip())
+            if self._pending:
+                print(f"Recovered {self._pending} unsaved rows from an earlier run.")
+        self._staging = open(self.staging_path, "a", encoding="utf-8")
+
+    def append_rows(self, rows):
+        """Stages the rows of one invoice durably, flushing to the workbook once a chunk is full."""
+        for values in row_values(rows, self.columns):
+            self._staging.write(json.dumps([self._cell(value) for value in values]) + "\n")
+        self._staging.flush()
+        os.fsync(self._staging.fileno())
+        self._pending += len(rows)
+        if self._pending >= self.chunk_rows:
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Could not write to {os.path.basename(self.output_path)} yet, rows remain staged: {e}")
+
+    def flush(self):
+        """Writes all staged rows into the workbook and clears the sidecar file."""
+        if not self._pending:
+            return
+        self._staging.close()
+        try:
+            self._write_staged(self._staged_rows(), self._pending)
+            self.rows_written += self._pending
+            self._pending = 0
+        finally:
+            # On failure (e.g. the workbook is open in Excel) the rows stay staged for the next flush.
+            self._staging = open(self.staging_path, "a" if self._pending else "w", encoding="utf-8")
+
+    def _staged_rows(self):
+        with open(self.staging_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def close(self):
+        """Flushes remaining rows. The sidecar is only removed once everything is in the workbook."""
+        try:
+            self.flush()
+        finally:
+            self._staging.close()
+        if not self._pending and os.path.exists(self.staging_path):
+            os.remove(self.staging_path)
+
+    def _cell(self, value):
+        return _cell_value(value)
+
+    def _write_staged(self, rows, count):
+        raise NotImplementedError
+
+class StreamingLedgerWriter(StagedLedgerWriter):
+    """Appends rows to an Excel workbook, creating it on the first flush if needed."""
+    def __init__(self, output_path, columns=LEDGER_COLUMNS, chunk_rows=DEFAULT_CHUNK_ROWS, sheet_name=SHEET_NAME):
+        self.sheet_name = sheet_name
+        super().__init__(output_path, columns, chunk_rows)
+
+    def _write_staged(self, rows, count):
+        if os.path.exists(self.output_path):
+            print(f"Appending {count} rows to {os.path.basename(self.output_path)}...")
+            append_rows_to_xlsx(self.output_path, rows, self.columns, self.sheet_name, count)
+        else:
+            print(f"Creating new file: {os.path.basename(self.output_path)}...")
+            _create_xlsx(self.output_path, rows, self.columns, self.sheet_name)
+
+class _ArrowDatasetWriter(StagedLedgerWriter):
+    """
+    Base class for typed columnar datasets: output_path is a directory and every flush adds one
+    part file, so later runs append without rewriting earlier data. Requires pyarrow.
+    """
+    format_name, extension = None, None
+
+    def __init__(self, output_path, columns=LEDGER_COLUMNS, chunk_rows=DEFAULT_CHUNK_ROWS):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError(f"{self.format_name} output requires pyarrow. Install it with: pip install pyarrow")
+        super().__init__(output_path, columns, chunk_rows)
+
+    def _cell(self, value):
+        return _typed_cell(value)
+
+    def _write_staged(self, rows, count):
+        import pyarrow as pa
+        from invoice_model import arrow_schema
+        schema = arrow_schema(self.columns)
+        columns = [list(column) for column in zip(*rows)] or [[] for _ in self.columns]
+        for i, col in enumerate(self.columns):
+            # to_date/to_number also read rows staged by older versions ("NA", DD/MM/YYYY);
+            # text that could not be read as a number or date becomes null.
+            if COLUMN_TYPES.get(col) == DATE:
+                columns[i] = [to_date(v) for v in columns[i]]
+            elif COLUMN_TYPES.get(col) == NUMBER:
+                columns[i] = [to_number(v) for v in columns[i]]
+        table = pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema)
+        os.makedirs(self.output_path, exist_ok=True)
+        part = os.path.join(self.output_path, f"part-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}{self.extension}")
+        print(f"Writing {count} rows to {part}...")
+        self._write_table(table, part)
+
+    def _write_table(self, table, path):
+        raise NotImplementedError
+
+class ParquetLedgerWriter(_ArrowDatasetWriter):
+    """Writes a Parquet dataset (a directory of part files)."""
+    format_name, extension = "Parquet", ".parquet"
+
+    def _write_table(self, table, path):
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+
+class ArrowLedgerWriter(_ArrowDatasetWriter):
+    """Writes an Arrow IPC (Feather v2) dataset, for zero-copy loading with pyarrow, pandas or polars."""
+    format_name, extension = "Arrow", ".arrow"
+
+    def _write_table(self, table, path):
+        import pyarrow.feather as feather
+        feather.write_feather(table, path)
+
+class _AppendOnlyLedgerWriter:
+    """Base class for line-oriented formats, which are appended to and synced directly."""
+    def __init__(self, output_path, columns=LEDGER_COLUMNS):
+        self.output_path = output_path
+        self.columns = list(columns)
+        self.rows_written = 0
+        self._is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, "a", encoding="utf-8", newline="")
+
+    def append_rows(self, rows):
+        for values in row_values(rows, self.columns):
+            self._write_row([_cell_value(value) for value in values])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.rows_written += len(rows)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class CsvLedgerWriter(_AppendOnlyLedgerWriter):
+    def __init__(self, output_path, columns=LEDGER_COLUMNS):
+        super().__init__(output_path, columns)
+        self._csv = csv.writer(self._file)
+        if self._is_new:
+            self._csv.writerow(self.columns)
+
+    def _write_row(self, values):
+        self._csv.writerow(values)
+
+class JsonlLedgerWriter(_AppendOnlyLedgerWriter):
+    def _write_row(self, values):
+        self._file.write(json.dumps(dict(zip(self.columns, values))) + "\n")
+
+def _cell_value(value):
+    """How a typed value appears in the Excel/CSV/JSONL ledgers."""
+    if value is None:
+        return "NA"
+    if isinstance(value, datetime.date):
+        return value.strftime("%d/%m/%Y")
+    if isinstance(value, float) and value.is_integer():
+        return int(value)  # Quantities stay 32, not 32.0
+    return value
+
+def _typed_cell(value):
+    """A typed value staged as JSON for the Arrow-based writers (dates as ISO strings)."""
+    return value.isoformat() if isinstance(value, datetime.date) else value
+
+def _create_xlsx(output_path, rows, columns, sheet_name):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append(columns)
+    for values in rows:
+        sheet.append([_ILLEGAL_XML_CHARS.sub("", v) if isinstance(v, str) else v for v in values])
+    workbook.save(output_path)
+
+def append_rows_to_xlsx(output_path, rows, columns, sheet_name=SHEET_NAME, row_count=None):
+    """
+    Appends rows (lists of values in column order) to a sheet of an existing .xlsx file.
+    `rows` may be a generator if `row_count` is given, so the rows are never all in memory.
+    """
+    if row_count is None:
+        rows = list(rows)
+        row_count = len(rows)
+    sheet_part = _find_sheet_part(output_path, sheet_name)
+    if sheet_part is None:
+        # Rare: the workbook has no such sheet. Adding a sheet needs the full openpyxl round trip.
+        workbook = openpyxl.load_workbook(output_path)
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append(columns)
+        for values in rows:
+            sheet.append(values)
+        workbook.save(output_path)
+        return
+
+    temp_path = output_path + ".tmp"
+    with zipfile.ZipFile(output_path) as src, zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as dst:
+        last_row = _scan_last_row(src, sheet_part)
+        for item in src.infolist():
+            with src.open(item) as fin, dst.open(item, "w") as fout:
+                if item.filename == sheet_part:
+                    _copy_sheet_with_rows(fin, fout, rows, last_row, last_row + row_count, len(columns))
+                else:
+                    shutil.copyfileobj(fin, fout, COPY_CHUNK_BYTES)
+    os.replace(temp_path, output_path)
+
+def _find_sheet_part(xlsx_path, sheet_name):
+    """Resolves a sheet name to its XML part via workbook.xml and its relationships."""
+    with zipfile.ZipFile(xlsx_path) as z:
+        workbook_xml = z.read("xl/workbook.xml")
+        rels_xml = z.read("xl/_rels/workbook.xml.rels")
+    rel_id = None
+    for match in re.finditer(rb"<(?:\w+:)?sheet\b([^>]*)/?>", workbook_xml):
+        attrs = dict(re.findall(rb"([\w:]+)=\"([^\"]*)\"", match.group(1)))
+        if attrs.get(b"name", b"").decode("utf-8") == escape(sheet_name, {'"': "&quot;"}):
+            rel_id = next((v for k, v in attrs.items() if k.endswith(b":id")), None)
+            break
+    if rel_id is None:
+        return None
+    for match in re.finditer(rb"<(?:\w+:)?Relationship\b([^>]*)/?>", rels_xml):
+        attrs = dict(re.findall(rb"([\w:]+)=\"([^\"]*)\"", match.group(1)))
+        if attrs.get(b"Id") == rel_id:
+            target = attrs[b"Target"].decode("utf-8")
+            return target.lstrip("/") if target.startswith("/") else "xl/" + target
+    return None
+
+def _scan_last_row(zip_file, sheet_part):
+    """Streams the sheet XML once and returns the highest row number in use."""
+    last_row, carry = 0, b""
+    with zip_file.open(sheet_part) as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_BYTES), b""):
+            data = carry + chunk
+            for match in _ROW_NUMBER.finditer(data):
+                last_row = max(last_row, int(match.group(1)))
+            carry = data[-256:]
+    return last_row
+
+def _copy_sheet_with_rows(fin, fout, rows, last_row, new_last_row, column_count):
+    """Copies the sheet XML, updating <dimension> and inserting new rows before </sheetData>."""
+    # The part before <sheetData> (sheet properties, dimension, column widths) is small.
+    head = b""
+    while True:
+        chunk = fin.read(COPY_CHUNK_BYTES)
+        head += chunk
+        opening = _SHEET_DATA_OPEN.search(head)
+        if opening or not chunk:
+            break
+    if not opening:
+        raise ValueError("Worksheet XML has no <sheetData> element.")
+    prefix, self_closing = opening.group(1) or b"", opening.group(2) == b"/"
+
+    def write_rows():
+        for offset, values in enumerate(rows):
+            fout.write(_row_xml(last_row + 1 + offset, values, prefix.decode()))
+
+    head = _DIMENSION.sub(lambda m: m.group(1) + _dimension_ref(m.group(2), new_last_row, column_count) + m.group(3), head, count=1)
+
+    if self_closing:
+        fout.write(head[:opening.start()])
+        fout.write(b"<" + prefix + b"sheetData>")
+        write_rows()
+        fout.write(b"</" + prefix + b"sheetData>")
+        fout.write(head[opening.end():])
+        shutil.copyfileobj(fin, fout, COPY_CHUNK_BYTES)
+        return
+
+    closing_tag = b"</" + prefix + b"sheetData>"
+    buffer = head
+    while True:
+        position = buffer.find(closing_tag)
+        if position >= 0:
+            fout.write(buffer[:position])
+            write_rows()
+            fout.write(buffer[position:])
+            shutil.copyfileobj(fin, fout, COPY_CHUNK_BYTES)
+            return
+        keep = len(closing_tag) - 1
+        fout.write(buffer[:-keep])
+        buffer = buffer[-keep:]
+        chunk = fin.read(COPY_CHUNK_BYTES)
+        if not chunk:
+            raise ValueError("Worksheet XML has no closing </sheetData> tag.")
+        buffer += chunk
+
+def _dimension_ref(ref, last_row, column_count):
+    match = re.match(rb"([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$", ref)
+    if not match:
+        return ref
+    start_col, start_row = match.group(1), match.group(2)
+    end_col = match.group(3) or start_col
+    end_col_index = max(_column_index(end_col.decode()), column_count - 1)
+    return start_col + start_row + b":" + _column_letter(end_col_index).encode() + str(last_row).encode()
+
+def _column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _column_index(letters):
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+def _row_xml(row_number, values, p=""):
+    """Serialises one row; strings are written inline so sharedStrings.xml never has to change."""
+    cells = []
+    for col_index, value in enumerate(values):
+        ref = f"{_column_letter(col_index)}{row_number}"
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            cells.append(f'<{p}c r="{ref}" t="b"><{p}v>{int(value)}</{p}v></{p}c>')
+        elif isinstance(value, (int, float)) and math.isfinite(value):
+            cells.append(f'<{p}c r="{ref}"><{p}v>{value!r}</{p}v></{p}c>')
+        else:
+            text = escape(_ILLEGAL_XML_CHARS.sub("", str(value)))
+            cells.append(f'<{p}c r="{ref}" t="inlineStr"><{p}is><{p}t xml:space="preserve">{text}</{p}t></{p}is></{p}c>')
+    return f'<{p}row r="{row_number}">{"".join(cells)}</{p}row>'.encode("utf-8")
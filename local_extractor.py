@@ -0,0 +1,196 @@
+# local_extractor.py
+# Deterministic, offline extraction of the common GST invoice fields with regular expressions.
+# Produces the same nested structure as the Gemini response (invoiceHeader, supplierDetails,
+# buyerDetails, summary, lineItems), plus a confidence score per field. When the key fields are
+# found with high confidence and the amounts reconcile, the Gemini call can be skipped.
+
+import copy
+import re
+from datetime import datetime
+
+GSTIN_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+HIGH_CONFIDENCE = 0.9
+# Fields that must be found with high confidence before the API call is skipped.
+REQUIRED_FIELDS = ("supplierDetails.gstin", "invoiceHeader.invoiceNo", "invoiceHeader.invoiceDate", "summary.totalAmount")
+
+GST_STATE_CODES = {
+    "01": "Jammu and Kashmir", "02": "Himachal Pradesh", "03": "Punjab", "04": "Chandigarh", "05": "Uttarakhand",
+    "06": "Haryana", "07": "Delhi", "08": "Rajasthan", "09": "Uttar Pradesh", "10": "Bihar", "11": "Sikkim",
+    "12": "Arunachal Pradesh", "13": "Nagaland", "14": "Manipur", "15": "Mizoram", "16": "Tripura",
+    "17": "Meghalaya", "18": "Assam", "19": "West Bengal", "20": "Jharkhand", "21": "Odisha",
+    "22": "Chhattisgarh", "23": "Madhya Pradesh", "24": "Gujarat", "26": "Dadra and Nagar Haveli and Daman and Diu",
+    "27": "Maharashtra", "29": "Karnataka", "30": "Goa", "31": "Lakshadweep", "32": "Kerala", "33": "Tamil Nadu",
+    "34": "Puducherry", "35": "Andaman and Nicobar Islands", "36": "Telangana", "37": "Andhra Pradesh", "38": "Ladakh",
+}
+
+_GSTIN = re.compile(r"\b(\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z])\b")
+_BUYER_LABELS = re.compile(r"buyer|bill(?:ed)?\s*to|ship(?:ped)?\s*to|consignee|recipient|customer|sold\s*to", re.I)
+_INVOICE_NO = re.compile(r"\b(?:invoice|inv|bill)\s*(?:no|number|#)\.?\s*[:\-]?\s*([A-Z0-9][A-Z0-9/\-]{0,30})", re.I)
+_DATE = r"(\d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4}|\d{1,2}[\s\-](?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*[\s\-,]*\d{2,4})"
+_INVOICE_DATE = re.compile(r"\b(?:invoice|inv|bill)\.?\s*date\s*[:\-]?\s*" + _DATE, re.I)
+_ANY_DATE = re.compile(r"\bdated?\s*[:\-]?\s*" + _DATE, re.I)
+_AMOUNT = r"(-?[\d,]+\.\d{1,2})"
+_TAX_LINES = {
+    "cgstAmount": re.compile(r"\bCGST\b[^\n]*?" + _AMOUNT + r"\s*$", re.I | re.M),
+    "sgstAmount": re.compile(r"\b(?:SGST|UTGST)\b[^\n]*?" + _AMOUNT + r"\s*$", re.I | re.M),
+    "igstAmount": re.compile(r"\bIGST\b[^\n]*?" + _AMOUNT + r"\s*$", re.I | re.M),
+    "cessAmount": re.compile(r"\bCess\b[^\n]*?" + _AMOUNT + r"\s*$", re.I | re.M),
+    "roundOffAmount": re.compile(r"\bRound(?:ing)?[\s\-]*off\b[^\n]*?" + _AMOUNT + r"\s*$", re.I | re.M),
+}
+_TOTAL = re.compile(r"\b(?:grand\s*total|invoice\s*total|total\s*amount|amount\s*payable|net\s*amount)\b[^\n\d]*" + _AMOUNT, re.I)
+_TAXABLE = re.compile(r"\b(?:taxable\s*(?:value|amount)|sub\s*total)\b[^\n\d]*" + _AMOUNT, re.I)
+_LINE_ITEM = re.compile(
+    r"^\s*(?:\d{1,3}[.)]?\s+)?(?P<name>[A-Za-z][^\n]*?)\s+(?P<hsn>\d{4}|\d{6}|\d{8})\s+"
+    r"(?P<qty>\d+(?:\.\d+)?)\s*(?P<uom>[A-Za-z]{2,5})?\s+(?P<rate>[\d,]+\.\d{1,2})\s+(?P<amount>[\d,]+\.\d{1,2})\s*$",
+    re.M,
+)
+_BUYER_NAME = re.compile(r"\b(?:buyer|bill(?:ed)?\s*to|consignee)\s*[:\-]\s*([A-Za-z][^\n]*?)(?:\s{2,}|\s+GSTIN\b|$)", re.I | re.M)
+_DOCUMENT_TITLES = re.compile(r"^(?:tax\s+|retail\s+|gst\s+)?invoice\b|^(?:original|duplicate|triplicate)\b|^cash\s+memo", re.I)
+
+def gstin_is_valid(gstin):
+    """Validates the GSTIN check character (mod-36 checksum over the first 14 characters)."""
+    total = 0
+    for i, ch in enumerate(gstin[:14]):
+        product = GSTIN_CHARS.index(ch) * (1 if i % 2 == 0 else 2)
+        total += product // 36 + product % 36
+    return GSTIN_CHARS[(36 - total % 36) % 36] == gstin[14]
+
+def find_gstins(text):
+    """Returns the checksum-valid GSTINs in the text, in order of first appearance."""
+    found = []
+    for gstin in _GSTIN.findall(text.upper()):
+        if gstin not in found and gstin_is_valid(gstin):
+            found.append(gstin)
+    return found
+
+def _to_float(value):
+    return float(value.replace(",", ""))
+
+def normalize_date(raw):
+    """Returns the date as DD/MM/YYYY, or None if it is not a real calendar date."""
+    cleaned = re.sub(r"[\s,]+", " ", raw.strip())
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y", "%d.%m.%y",
+                "%d %b %Y", "%d-%b-%Y", "%d %B %Y", "%d-%B-%Y", "%d %b %y", "%d-%b-%y"):
+        try:
+            return datetime.strptime(cleaned, fmt).strftime("%d/%m/%Y")
+        except ValueError:
+            continue
+    return None
+
+def _empty_result():
+    from extractor import GEMINI_SCHEMA
+    result = copy.deepcopy(GEMINI_SCHEMA)
+    result["lineItems"] = []
+    return result
+
+def extract_invoice_fields(text):
+    """
+    Extracts what it can from the invoice text. Returns (structured_data, confidence) where
+    confidence maps 'section.field' to a score between 0 and 1 for every field that was found.
+    """
+    data, confidence = _empty_result(), {}
+    header, supplier, buyer, summary = data["invoiceHeader"], data["supplierDetails"], data["buyerDetails"], data["summary"]
+    lines = text.splitlines()
+
+    # GSTINs: a GSTIN on (or just below) a buyer/consignee label belongs to the buyer, the first other one to the supplier.
+    for i, line in enumerate(lines):
+        for gstin in _GSTIN.findall(line.upper()):
+            context = line + " " + (lines[i - 1] if i else "")
+            score = 1.0 if gstin_is_valid(gstin) else 0.5
+            if _BUYER_LABELS.search(context) and buyer["gstin"] == "NA":
+                buyer["gstin"] = gstin
+                confidence["buyerDetails.gstin"] = score
+            elif supplier["gstin"] == "NA":
+                supplier["gstin"] = gstin
+                confidence["supplierDetails.gstin"] = score
+                state = GST_STATE_CODES.get(gstin[:2])
+                if state:
+                    supplier["state"] = state
+                    confidence["supplierDetails.state"] = score
+
+    for line in lines:
+        candidate = line.strip()
+        if candidate and re.search(r"[A-Za-z]{3}", candidate) and not _DOCUMENT_TITLES.search(candidate):
+            supplier["name"] = candidate
+            confidence["supplierDetails.name"] = 0.5  # First heading line; a guess, never decisive
+            break
+
+    match = _BUYER_NAME.search(text)
+    if match:
+        buyer["name"] = match.group(1).strip()
+        confidence["buyerDetails.name"] = 0.7
+
+    match = _INVOICE_NO.search(text)
+    if match:
+        header["invoiceNo"] = match.group(1)
+        confidence["invoiceHeader.invoiceNo"] = 0.9
+
+    match = _INVOICE_DATE.search(text) or _ANY_DATE.search(text)
+    if match and normalize_date(match.group(1)):
+        header["invoiceDate"] = normalize_date(match.group(1))
+        confidence["invoiceHeader.invoiceDate"] = 0.95 if match.re is _INVOICE_DATE else 0.7
+
+    for field, pattern in _TAX_LINES.items():
+        amounts = pattern.findall(text)
+        if amounts:
+            summary[field] = _to_float(amounts[-1])
+            confidence[f"summary.{field}"] = 0.8
+
+    for match in _LINE_ITEM.finditer(text):
+        qty, rate, amount = float(match.group("qty")), _to_float(match.group("rate")), _to_float(match.group("amount"))
+        qty = int(qty) if qty.is_integer() else qty
+        item = copy.deepcopy(_empty_line_item())
+        item.update({"itemName": match.group("name").strip(), "hsnCode": match.group("hsn"), "qty": qty,
+                     "uom": match.group("uom") or "NA", "rate": rate, "amount": amount})
+        data["lineItems"].append(item)
+    items_consistent = bool(data["lineItems"]) and all(
+        abs(item["qty"] * item["rate"] - item["amount"]) <= max(1.0, item["amount"] * 0.01) for item in data["lineItems"]
+    )
+    if data["lineItems"]:
+        confidence["lineItems"] = 0.95 if items_consistent else 0.5
+
+    totals = _TOTAL.findall(text)
+    if totals:
+        summary["totalAmount"] = _to_float(totals[-1])
+        confidence["summary.totalAmount"] = 0.8
+        # The total is trusted once it reconciles with the line items (or taxable value) plus taxes.
+        taxable = sum(item["amount"] for item in data["lineItems"])
+        taxable_match = _TAXABLE.findall(text)
+        if not taxable and taxable_match:
+            taxable = _to_float(taxable_match[-1])
+        taxes = sum(summary[f] for f in ("cgstAmount", "sgstAmount", "igstAmount", "cessAmount", "roundOffAmount"))
+        if taxable and abs(taxable + taxes - summary["totalAmount"]) <= 1.0:
+            confidence["summary.totalAmount"] = 1.0
+            for field in ("cgstAmount", "sgstAmount", "igstAmount", "cessAmount", "roundOffAmount"):
+                if f"summary.{field}" in confidence:
+                    confidence[f"summary.{field}"] = 1.0
+            if items_consistent:
+                confidence["lineItems"] = 1.0
+
+    if not data["lineItems"]:
+        data["lineItems"] = [copy.deepcopy(_empty_line_item())]
+    return data, confidence
+
+def _empty_line_item():
+    from extractor import GEMINI_SCHEMA
+    return GEMINI_SCHEMA["lineItems"][0]
+
+def amounts_reconcile(structured_data, tolerance=1.0):
+    """True when the line item amounts plus the tax lines add up to the invoice total."""
+    summary = structured_data.get("summary", {})
+    try:
+        taxable = sum(float(item.get("amount") or 0) for item in structured_data.get("lineItems", []))
+        taxes = sum(float(summary.get(f) or 0) for f in ("cgstAmount", "sgstAmount", "igstAmount", "cessAmount", "roundOffAmount"))
+        total = float(summary.get("totalAmount") or 0)
+    except (TypeError, ValueError):
+        return False
+    return taxable > 0 and abs(taxable + taxes - total) <= tolerance
+
+def has_invoice_total(text):
+    """True when the text has a grand total / amount payable line, i.e. the invoice ends on or before it."""
+    return bool(_TOTAL.search(text))
+
+def is_confident(confidence, threshold=HIGH_CONFIDENCE):
+    """True when every required field and the line items were found with at least `threshold` confidence."""
+    required = REQUIRED_FIELDS + ("lineItems",)
+    return all(confidence.get(field, 0) >= threshold for field in required)
@@ -1,21 +1,71 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import os
-import pandas as pd
-from extractor import process_invoice_file
+from pipeline import process_invoice_batch, FailureManifest, FAILURES_SUFFIX
+from cache import ExtractionCache
+from templates import TemplateStore
+from dedup import DuplicateIndex, DEDUP_SUFFIX
+from ledger_writer import StreamingLedgerWriter, sidecar_path
+from gemini_client import DEFAULT_REQUESTS_PER_MINUTE
 import sys
+import queue
 import threading
+import multiprocessing
 from tkinter import font as tkFont
 
+UI_FRAME_MS = 33        # The UI applies queued events ~30 times a second
+LOG_MAX_LINES = 1000    # The log view keeps only the most recent lines
+GRADIENT_STEP = 4       # Pixels per gradient band
+GRADIENT_DELAY_MS = 100 # Resize events are coalesced before the gradient is redrawn
+
+class UIEventChannel:
+    """
+    Thread-safe queue of UI events. Worker threads post log text, progress and calls; the Tk
+    main loop drains it once per frame, so Tk is only ever touched from the main thread.
+    """
+    def __init__(self, max_log_lines=LOG_MAX_LINES):
+        self.max_log_lines = max_log_lines
+        self._events = queue.SimpleQueue()
+
+    def log(self, text):
+        self._events.put(("log", text))
+
+    def progress(self, current, total, message):
+        self._events.put(("progress", (current, total, message)))
+
+    def call(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) on the UI thread (widget updates, message boxes)."""
+        self._events.put(("call", (func, args, kwargs)))
+
+    def drain(self):
+        """
+        Returns everything posted since the last drain, coalesced: (log text, latest progress or
+        None, calls in order). The log text is capped to the last max_log_lines lines.
+        """
+        chunks, latest, calls = [], None, []
+        while True:
+            try:
+                kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "log":
+                chunks.append(payload)
+            elif kind == "progress":
+                latest = payload
+            else:
+                calls.append(payload)
+        text = "".join(chunks)
+        if text.count("\n") > self.max_log_lines:
+            text = "\n".join(text.split("\n")[-self.max_log_lines - 1:])
+        return text, latest, calls
+
 class TextRedirector(object):
-    def __init__(self, widget):
-        self.widget = widget
+    """Stands in for sys.stdout: every print is posted to the UI event channel, from any thread."""
+    def __init__(self, events):
+        self.events = events
 
     def write(self, str):
-        self.widget.configure(state='normal')
-        self.widget.insert('end', str)
-        self.widget.see('end')
-        self.widget.configure(state='disabled')
+        self.events.log(str)
 
     def flush(self):
         pass
@@ -47,13 +97,20 @@ class InvoiceApp:
 
         self.pdf_file_paths = []
         self.excel_file_path = ""
+        self.skip_duplicates = tk.BooleanVar(value=True)
+        # Gemini rate limits of the API key's tier; 0 tokens per minute means no token limit.
+        self.requests_per_minute = tk.StringVar(value=str(DEFAULT_REQUESTS_PER_MINUTE))
+        self.tokens_per_minute = tk.StringVar(value="0")
+        self.events = UIEventChannel()
+        self.gradient_size = None
+        self.gradient_job = None
         self.create_widgets()
+        self.root.after(UI_FRAME_MS, self.poll_events)
 
     def create_widgets(self):
         self.bg_canvas = tk.Canvas(self.root, highlightthickness=0)
         self.bg_canvas.pack(fill=tk.BOTH, expand=True)
-        self.draw_gradient(self.bg_canvas, self.colors["bg_gradient_start"], self.colors["bg_gradient_end"])
-        self.bg_canvas.bind("<Configure>", lambda e: self.draw_gradient(e.widget, self.colors["bg_gradient_start"], self.colors["bg_gradient_end"]))
+        self.bg_canvas.bind("<Configure>", self.schedule_gradient)
 
         self.main_card = tk.Frame(self.bg_canvas, bg=self.colors["glass_bg"], padx=40, pady=30, relief='flat')
         self.main_card.place(relx=0.5, rely=0.45, anchor='center')
@@ -67,9 +124,13 @@ class InvoiceApp:
         api_key_label = tk.Label(api_key_frame, text="Gemini API Key:", font=self.button_font, bg=self.colors["glass_bg"], fg=self.colors['text'])
         api_key_label.pack(side=tk.LEFT, padx=(0, 10))
 
-        self.api_key_entry = tk.Entry(api_key_frame, font=self.status_font, bg=self.colors['log_bg'], fg=self.colors['text'], relief='flat', width=70, show="*")
+        self.api_key_entry = tk.Entry(api_key_frame, font=self.status_font, bg=self.colors['log_bg'], fg=self.colors['text'], relief='flat', width=40, show="*")
         self.api_key_entry.pack(side=tk.LEFT, fill='x', expand=True)
 
+        for text, variable in (("Requests/min:", self.requests_per_minute), ("Tokens/min:", self.tokens_per_minute)):
+            tk.Label(api_key_frame, text=text, font=self.status_font, bg=self.colors["glass_bg"], fg=self.colors['text']).pack(side=tk.LEFT, padx=(15, 5))
+            tk.Spinbox(api_key_frame, from_=0, to=10000000, increment=10, textvariable=variable, font=self.status_font, bg=self.colors['log_bg'], fg=self.colors['text'], buttonbackground=self.colors['log_bg'], relief='flat', width=8).pack(side=tk.LEFT)
+
         card1 = self.create_step_card(self.main_card, "Step 1:\nUpload PDF Files", self.colors["card_1_bg"])
         card1.grid(row=2, column=0, sticky="ns", padx=15, pady=10)
         self.create_pdf_widgets(card1)
@@ -90,15 +151,29 @@ class InvoiceApp:
         self.progress_frame.place(relx=0.5, rely=0.9, anchor='center', width=900)
         self.create_progress_widgets(self.progress_frame)
 
+    def schedule_gradient(self, event=None):
+        """Coalesces <Configure> events: the gradient is redrawn once, after resizing settles."""
+        if self.gradient_job is not None:
+            self.root.after_cancel(self.gradient_job)
+        self.gradient_job = self.root.after(GRADIENT_DELAY_MS, self.redraw_gradient)
+
+    def redraw_gradient(self):
+        self.gradient_job = None
+        size = (self.bg_canvas.winfo_width(), self.bg_canvas.winfo_height())
+        if size != self.gradient_size and min(size) > 1:
+            self.gradient_size = size
+            self.draw_gradient(self.bg_canvas, self.colors["bg_gradient_start"], self.colors["bg_gradient_end"])
+
     def draw_gradient(self, canvas, color1, color2):
         canvas.delete("gradient")
-        width, height = self.root.winfo_width(), self.root.winfo_height()
+        width, height = canvas.winfo_width(), canvas.winfo_height()
         (r1, g1, b1), (r2, g2, b2) = self.root.winfo_rgb(color1), self.root.winfo_rgb(color2)
         r_ratio, g_ratio, b_ratio = float(r2 - r1) / (width + height), float(g2 - g1) / (width + height), float(b2 - b1) / (width + height)
-        for i in range(width + height):
+        # Diagonal bands GRADIENT_STEP pixels apart (drawn wide enough to overlap) instead of one line per pixel.
+        for i in range(0, width + height + GRADIENT_STEP, GRADIENT_STEP):
             nr, ng, nb = int(r1 + (r_ratio * i)), int(g1 + (g_ratio * i)), int(b1 + (b_ratio * i))
             color = f"#{nr:04x}{ng:04x}{nb:04x}"
-            canvas.create_line(0, i, i, 0, tags=("gradient",), fill=color)
+            canvas.create_line(0, i, i, 0, tags=("gradient",), fill=color, width=GRADIENT_STEP)
         self.bg_canvas.lower("gradient")
         
     def create_step_card(self, parent, title, color):
@@ -123,6 +198,8 @@ class InvoiceApp:
         self.excel_path_label.pack(pady=10, padx=15, fill='x')
         self.excel_button = tk.Button(parent, text="Browse...", font=self.button_font, fg=self.colors['button_fg'], bg=self.colors['card_2_bg'], activeforeground=self.colors['text'], activebackground=self.colors['card_2_bg'], relief='flat', command=self.select_excel, borderwidth=0)
         self.excel_button.pack(pady=10, fill='x', padx=15)
+        self.skip_duplicates_check = tk.Checkbutton(parent, text="Skip invoices already\nin this workbook", variable=self.skip_duplicates, font=self.status_font, bg=self.colors['card_2_bg'], fg=self.colors['text'], selectcolor=self.colors['glass_bg'], activebackground=self.colors['card_2_bg'], activeforeground=self.colors['text'], relief='flat', borderwidth=0)
+        self.skip_duplicates_check.pack(pady=(0, 5), padx=15)
 
     def create_action_widgets(self, parent):
         self.extract_button = tk.Button(parent, text="Start Extraction", font=self.button_font, fg=self.colors['button_fg'], bg=self.colors['card_3_bg'], activeforeground=self.colors['text'], activebackground=self.colors['card_3_bg'], relief='flat', command=self.start_processing_thread, borderwidth=0, height=8)
@@ -131,7 +208,7 @@ class InvoiceApp:
     def create_log_widgets(self, parent):
         self.log_text = tk.Text(parent, height=6, bg=self.colors['glass_bg'], fg=self.colors['text_muted'], relief='flat', state='disabled', font=("Courier New", 9), borderwidth=0)
         self.log_text.pack(fill='both', expand=True, padx=15, pady=10)
-        sys.stdout = TextRedirector(self.log_text)
+        sys.stdout = TextRedirector(self.events)
 
     def create_progress_widgets(self, parent):
         self.progress_label = tk.Label(parent, text="Ready to process files", font=self.status_font, bg=self.colors["progress_bg"], fg=self.colors['text'])
@@ -154,12 +231,38 @@ class InvoiceApp:
         self.progress_percent.pack(pady=(5, 0))
 
     def update_progress(self, current, total, message="Processing..."):
+        """Safe to call from any thread; shown on the next UI frame."""
+        self.events.progress(current, total, message)
+
+    def show_progress(self, current, total, message):
         if total > 0:
             progress_value = (current / total) * 100
             self.progress_bar['value'] = progress_value
             self.progress_percent.config(text=f"{int(progress_value)}%")
             self.progress_label.config(text=message)
-        self.root.update_idletasks()
+
+    def append_log(self, text):
+        """Appends to the log view, dropping the oldest lines beyond LOG_MAX_LINES."""
+        self.log_text.configure(state='normal')
+        self.log_text.insert('end', text)
+        excess = int(self.log_text.index('end-1c').split('.')[0]) - LOG_MAX_LINES
+        if excess > 0:
+            self.log_text.delete('1.0', f'{excess + 1}.0')
+        self.log_text.see('end')
+        self.log_text.configure(state='disabled')
+
+    def poll_events(self):
+        """Applies everything worker threads posted since the last frame, then schedules the next frame."""
+        try:
+            text, progress, calls = self.events.drain()
+            if text:
+                self.append_log(text)
+            if progress:
+                self.show_progress(*progress)
+            for func, args, kwargs in calls:
+                func(*args, **kwargs)
+        finally:
+            self.root.after(UI_FRAME_MS, self.poll_events)
 
     def reset_progress(self):
         self.progress_bar['value'] = 0
@@ -180,11 +283,6 @@ class InvoiceApp:
             self.excel_path_label.config(text=f"Append to:\n{os.path.basename(path)}")
 
     def start_processing_thread(self):
-        thread = threading.Thread(target=self.process_files)
-        thread.daemon = True
-        thread.start()
-
-    def process_files(self):
         api_key = self.api_key_entry.get()
         if not api_key:
             messagebox.showwarning("API Key Required", "Please enter your Google Gemini API key to proceed.")
@@ -193,73 +291,117 @@ class InvoiceApp:
         if not self.pdf_file_paths:
             messagebox.showwarning("No Files Selected", "Please select one or more PDF files.")
             return
-            
-        self.extract_button.config(state=tk.DISABLED)
-        all_extracted_rows, has_errors = [], False
-        total_files = len(self.pdf_file_paths)
-        
-        for i, path in enumerate(self.pdf_file_paths):
-            try:
-                self.update_progress(i, total_files, f"Processing file {i+1} of {total_files}: {os.path.basename(path)}")
-                print(f"[{i+1}/{total_files}] Processing: {os.path.basename(path)}...")
-                rows = process_invoice_file(path, api_key)
-                all_extracted_rows.extend(rows)
-                self.update_progress(i+1, total_files, f"Completed {i+1} of {total_files} files")
-            except Exception as e:
-                has_errors = True
-                print(f"ERROR: {e}")
-                messagebox.showerror(f"Error processing {os.path.basename(path)}", str(e))
-                break
-                
-        self.extract_button.config(state=tk.NORMAL)
-        
-        if has_errors:
-            print("Processing stopped due to an error.")
-            self.progress_label.config(text="Processing stopped due to error")
-        elif all_extracted_rows:
-            self.update_progress(total_files, total_files, "Saving to Excel...")
-            print("AI processing complete. Saving to Excel...")
-            self.save_to_excel(pd.DataFrame(all_extracted_rows))
-            self.progress_label.config(text="Processing completed successfully!")
-        else:
-            print("Could not extract any data from the files.")
-            self.progress_label.config(text="No data extracted from files")
-
-    def save_to_excel(self, new_df):
-        column_order = [
-            'Invoice Date', 'Invoice No', 'Supplier Name', 'GSTIN/UIN', 'Consignor From Name', 'Consignor From GSTIN',
-            'Item Name', 'HSN Code', 'QTY', 'Rate', 'Batch No', 'Exp Date', 'Amount', 'Narration'
-        ]
-        for col in column_order:
-            if col not in new_df.columns:
-                new_df[col] = "NA"
-
-        final_df = new_df.reindex(columns=column_order).fillna("NA")
+
+        # Rows are written as each invoice completes, so the destination is needed up front.
         output_path = self.excel_file_path
         if not output_path:
             output_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel Workbook", "*.xlsx")], title="Save Extracted Data As...")
             if not output_path:
                 print("Save operation cancelled by user.")
                 return
+
         try:
-            if os.path.exists(output_path):
-                print(f"Appending data to {os.path.basename(output_path)}...")
-                with pd.ExcelWriter(output_path, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
-                    if 'Sheet1' in writer.book.sheetnames:
-                        startrow = writer.book['Sheet1'].max_row
-                        final_df.to_excel(writer, sheet_name='Sheet1', index=False, header=False, startrow=startrow)
-                    else:
-                        final_df.to_excel(writer, sheet_name='Sheet1', index=False)
-            else:
-                print(f"Creating new file: {os.path.basename(output_path)}...")
-                final_df.to_excel(output_path, index=False, sheet_name='Sheet1')
-            print("Export successful!")
-            messagebox.showinfo("Success", f"Data exported to:\n{os.path.abspath(output_path)}")
+            requests_per_minute = int(self.requests_per_minute.get())
+            tokens_per_minute = int(self.tokens_per_minute.get())
+            if requests_per_minute < 0 or tokens_per_minute < 0: raise ValueError
+        except ValueError:
+            messagebox.showwarning("Invalid Rate Limit", "Requests and tokens per minute must be whole numbers (0 for no limit).")
+            return
+
+        thread = threading.Thread(target=self.process_files, args=(api_key, output_path, self.skip_duplicates.get(),
+                                                                   requests_per_minute, tokens_per_minute))
+        thread.daemon = True
+        thread.start()
+
+    def process_files(self, api_key, output_path, skip_duplicates=True,
+                      requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=None):
+        """Runs on a worker thread: every widget update and message box goes through self.events."""
+        self.events.call(self.extract_button.config, state=tk.DISABLED)
+        has_errors = False
+        total_files = len(self.pdf_file_paths)
+        self.update_progress(0, total_files, f"Processing {total_files} files...")
+        print(f"Processing {total_files} files...")
+
+        try:
+            cache = ExtractionCache()
+        except Exception as e:
+            print(f"Extraction cache unavailable, continuing without it: {e}")
+            cache = None
+        try:
+            templates = TemplateStore()
+        except Exception as e:
+            print(f"Supplier templates unavailable, continuing without them: {e}")
+            templates = None
+        duplicates = None
+        if skip_duplicates:
+            # Each workbook has its own index next to it, so other workbooks can take the same invoices.
+            try:
+                duplicates = DuplicateIndex(sidecar_path(output_path, DEDUP_SUFFIX))
+            except Exception as e:
+                print(f"Duplicate check unavailable, continuing without it: {e}")
+        writer = StreamingLedgerWriter(output_path)
+        # Failing files are listed next to the workbook while the rest of the batch carries on.
+        failures = FailureManifest(sidecar_path(output_path, FAILURES_SUFFIX))
+        failed = []
+
+        def on_failure(index, pdf_path, error, attempts):
+            failures.record(pdf_path, error, attempts)
+            failed.append(os.path.basename(pdf_path))
+
+        def on_result(index, pdf_path, rows):
+            writer.append_rows(rows)
+            failures.resolve(pdf_path)
+
+        try:
+            process_invoice_batch(list(self.pdf_file_paths), api_key, progress_callback=self.update_progress,
+                                  cache=cache, templates=templates, result_callback=on_result,
+                                  continue_on_error=True, failure_callback=on_failure, duplicates=duplicates,
+                                  requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+        except Exception as e:
+            # Failing files are recorded above and never stop the batch; this is the batch itself failing.
+            has_errors = True
+            print(f"ERROR: {e}")
+            self.events.call(messagebox.showerror, "Processing Error", str(e))
+        finally:
+            if cache: cache.close()
+            if templates is not None: templates.close()
+            if duplicates is not None: duplicates.close()
+            failures.close()
+
+        self.update_progress(total_files, total_files, "Saving to Excel...")
+        saved = self.save_to_excel(writer)
+        self.events.call(self.extract_button.config, state=tk.NORMAL)
+        
+        if has_errors:
+            print("Processing stopped due to an error. Rows from completed files were saved.")
+            self.events.call(self.progress_label.config, text="Processing stopped due to error")
+        elif not writer.rows_written:
+            print("Could not extract any data from the files.")
+            self.events.call(self.progress_label.config, text="No data extracted from files")
+        elif saved:
+            self.events.call(self.progress_label.config, text="Processing completed successfully!")
+        if failed:
+            listed = "\n".join(failed[:10]) + (f"\n... and {len(failed) - 10} more" if len(failed) > 10 else "")
+            self.events.call(self.progress_label.config, text=f"Completed with {len(failed)} failed files")
+            self.events.call(messagebox.showwarning, "Some Files Failed",
+                             f"{len(failed)} of {total_files} files could not be processed:\n{listed}\n\n"
+                             f"Details are in:\n{os.path.abspath(failures.path)}")
+
+    def save_to_excel(self, writer):
+        """Flushes the rows still staged by the writer into the workbook."""
+        try:
+            writer.close()
+            if writer.rows_written:
+                print("Export successful!")
+                self.events.call(messagebox.showinfo, "Success", f"Data exported to:\n{os.path.abspath(writer.output_path)}")
+            return True
         except Exception as e:
             print(f"Excel Export Error: {e}")
-            messagebox.showerror("Export Error", f"An error occurred while saving to Excel:\n{e}\n\nCheck if the file is open.")
+            self.events.call(messagebox.showerror, "Export Error", f"An error occurred while saving to Excel:\n{e}\n\nCheck if the file is open. The extracted rows are kept and will be saved on the next run.")
+            return False
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # The PDF/OCR worker pool must also work from a frozen build
     try:
         from extractor import pytesseract
         pytesseract.get_tesseract_version()
@@ -0,0 +1,435 @@
+# pipeline.py
+# Concurrent batch pipeline built on the stages in extractor.py.
+# PDF text extraction and OCR run on a process pool (CPU bound), Gemini calls run on a
+# separate thread pool (network bound), and results are handed back in input order.
+# With an ExtractionCache, each file first goes through a cheap lookup stage on the I/O pool
+# and skips extraction and/or the Gemini call when a cached entry exists.
+# With a TemplateStore, invoices from known suppliers are read with their layout template instead.
+# With batch_size > 1, invoices that need Gemini are collected and sent several per request.
+# Transient failures are retried with backoff; with continue_on_error, files that still fail are
+# reported (and can be written to a FailureManifest) while the rest of the batch carries on.
+# With a DuplicateIndex, invoices already written to the ledger are skipped: by file hash before
+# extraction, by text before structuring, and by invoice key before their rows are written.
+
+import heapq
+import json
+import os
+import random
+import time
+import requests
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from extractor import (extract_invoice_text, DEFAULT_PAGE_POLICY, reads_all_pages, structure_invoice_text,
+                       structure_invoice_offline, build_invoice_rows, extract_data_with_gemini,
+                       extract_batch_with_gemini, MAX_BATCH_CHARS, MAX_BATCH_INVOICES, MAX_INVOICE_CHARS)
+from cache import hash_pdf
+from dedup import text_fingerprint
+import instrumentation
+from gemini_client import GeminiClient, GeminiAPIError, GeminiResponseError, DEFAULT_REQUESTS_PER_MINUTE
+
+DEFAULT_CPU_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+DEFAULT_IO_WORKERS = 4
+# A file that fails with a transient error is retried on top of the client's own request retries,
+# after a longer backoff, so a rate limit or outage that outlasts those retries costs no results.
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_BACKOFF_BASE = 5.0
+RETRY_BACKOFF_MAX = 120.0
+FAILURES_SUFFIX = ".failures.jsonl"  # Next to the output, see ledger_writer.sidecar_path
+
+class BatchProcessingError(Exception):
+    """Raised when a file in the batch fails; carries the path of the offending PDF."""
+    def __init__(self, pdf_path, error):
+        super().__init__(str(error))
+        self.pdf_path = pdf_path
+        self.error = error
+
+def _lookup(cache, duplicates, pdf_path):
+    """
+    I/O stage: hashes the PDF and returns (pdf_hash, cached text, cached structured data, duplicate),
+    where duplicate describes the earlier invoice when this exact file was written before.
+    """
+    with instrumentation.span("cache"):
+        pdf_hash = hash_pdf(pdf_path)
+        duplicate = duplicates.match_file(pdf_hash) if duplicates is not None else None
+        if duplicate or not cache:
+            return pdf_hash, None, None, duplicate
+        data = cache.get_data(pdf_hash)
+        text = cache.get_text(pdf_hash) if data is None else None
+    return pdf_hash, text, data, None
+
+def _as_invoice(label, func, *args):
+    """Runs an I/O stage with the spans it records attributed to the invoice (or batch) `label`."""
+    with instrumentation.invoice(label):
+        return func(*args)
+
+def _structure_invoice(api_key, client, mode, pdf_path, text, cache=None, pdf_hash=None, templates=None,
+                       max_chars=MAX_INVOICE_CHARS):
+    """I/O stage: structures the text (template, Gemini and/or local rules) and flattens it into rows."""
+    structured_data, source = structure_invoice_text(api_key, text, mode, client, templates, pdf_path, max_chars)
+    if cache and source == "gemini": cache.put_data(pdf_hash, structured_data)
+    return build_invoice_rows(structured_data), source
+
+def _structure_offline(mode, pdf_path, text, templates=None):
+    """I/O stage (batched mode): template or local rules only. Returns (rows, source) or None if Gemini is needed."""
+    structured_data, source = structure_invoice_offline(text, mode, templates, pdf_path)
+    return (build_invoice_rows(structured_data), source) if structured_data is not None else None
+
+def _structure_batch(api_key, client, batch, cache=None, templates=None, max_chars=MAX_INVOICE_CHARS):
+    """
+    I/O stage: sends a batch of (index, pdf_path, text, pdf_hash) to Gemini in one request.
+    Invoices the batched response does not answer, or all of them if the request fails, are
+    sent on their own, as is a batch of one (with the single-invoice prompt). Returns [(index, rows, source)]; an invoice that still fails is returned
+    as (index, None, error), so one failure does not lose the rest of the batch.
+    """
+    results = [None] * len(batch)
+    if len(batch) > 1:
+        try:
+            with instrumentation.invoice(f"batch of {len(batch)} from {batch[0][1]}"):
+                results = extract_batch_with_gemini(api_key, [text for _, _, text, _ in batch], client=client,
+                                                    max_chars=max_chars, pdf_paths=[path for _, path, _, _ in batch])
+        except (ConnectionError, ValueError) as e:
+            print(f"Batched request for {len(batch)} invoices failed ({e}); sending them one at a time.")
+    outcomes = []
+    for (index, pdf_path, text, pdf_hash), structured_data in zip(batch, results):
+        with instrumentation.invoice(pdf_path):
+            if structured_data is None:
+                try:
+                    structured_data = extract_data_with_gemini(api_key, text, client=client, max_chars=max_chars,
+                                                               pdf_path=pdf_path)
+                except Exception as e:
+                    outcomes.append((index, None, e))
+                    continue
+            if cache: cache.put_data(pdf_hash, structured_data)
+            if templates is not None: templates.learn(pdf_path, structured_data)
+        outcomes.append((index, build_invoice_rows(structured_data), "gemini"))
+    return outcomes
+
+def classify_failure(error):
+    """
+    Returns "transient" for failures that may succeed if tried again later (rate limits, server
+    errors, network failures, a malformed answer from the model) and "permanent" for the rest
+    (unreadable or empty PDFs, a rejected API key or request).
+    """
+    if isinstance(error, BatchProcessingError):
+        error = error.error
+    if isinstance(error, GeminiAPIError):
+        return "transient" if error.transient else "permanent"
+    if isinstance(error, (GeminiResponseError, ConnectionError, TimeoutError, requests.exceptions.RequestException)):
+        return "transient"
+    return "permanent"
+
+def _retry_delay(attempt):
+    """Jittered exponential backoff before the given retry of a file."""
+    return random.uniform(0.5, 1.0) * min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * (2 ** (attempt - 1)))
+
+class FailureManifest:
+    """
+    JSONL record of files that failed, with their error class, so a later run can retry just
+    those. Entries are appended as failures happen; `resolve` drops a file once it succeeds
+    and `close` rewrites the file with what is still failing.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.failures = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.failures[entry["path"]] = entry
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, pdf_path, error, attempts=1):
+        entry = {"path": pdf_path, "kind": classify_failure(error), "error_type": type(error).__name__,
+                 "error": str(error), "attempts": attempts, "failed_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.failures[pdf_path] = entry
+
+    def resolve(self, pdf_path):
+        self.failures.pop(pdf_path, None)
+
+    def paths(self):
+        return list(self.failures)
+
+    def close(self):
+        self._file.close()
+        if self.failures:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                for entry in self.failures.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(self.path + ".tmp", self.path)
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+def process_invoice_batch(pdf_paths, api_key, cpu_workers=None, io_workers=None,
+                          progress_callback=None, result_callback=None, cache=None, client=None, mode="gemini",
+                          templates=None, batch_size=1, continue_on_error=False, failure_callback=None,
+                          max_attempts=DEFAULT_MAX_ATTEMPTS, duplicates=None, page_policy=DEFAULT_PAGE_POLICY,
+                          requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=None,
+                          max_chars=MAX_INVOICE_CHARS):
+    """
+    Processes a batch of PDFs concurrently and returns a list of row lists, one per file,
+    in the same order as pdf_paths.
+
+    progress_callback(completed, total, message) is called as each file finishes.
+    result_callback(index, pdf_path, rows) is called for each file in input order, as soon
+    as that file and all files before it have finished. The rows are then released rather
+    than kept for the returned list, so memory does not grow with the batch; with a
+    result_callback the function returns None.
+    The number of files in flight is bounded by cpu_workers + io_workers (io_workers * batch_size
+    when batching), so a large batch never queues all of its extracted text in memory at once.
+    With a cache, files whose results are already cached need no OCR and no network call.
+    All Gemini calls share one GeminiClient, limited to `requests_per_minute` and, if given,
+    `tokens_per_minute` (0 or None: no limit); or pass a `client` to control limits and retries.
+    `mode` is one of extractor.EXTRACTION_MODES; "local-only" makes no network calls at all.
+    With a TemplateStore, suppliers whose layout is known are read without a Gemini call.
+    With batch_size > 1, up to that many invoices (at most extractor.MAX_BATCH_INVOICES, within
+    MAX_BATCH_CHARS of text) share one Gemini request; a partial batch is sent as soon as no other
+    file could join it. Invoices too long to share a request, and a batch left with one invoice,
+    are sent with the single-invoice prompt.
+    `page_policy` (extractor.PagePolicy) sets the OCR resolution and how many pages are read.
+    Gemini is sent at most `max_chars` of each invoice's normalized text (0 or None: all of it);
+    a file over the limit is named in a warning, as the middle of its text is cut.
+    While an instrumentation recorder is active, every stage is timed per invoice, including
+    the stages that run in worker processes.
+
+    A file that fails with a transient error (see classify_failure) is tried again after a
+    backoff, up to max_attempts in total. When it still fails, the batch stops with a
+    BatchProcessingError, or with continue_on_error, failure_callback(index, pdf_path, error,
+    attempts) is called, its entry in the returned list is None and the rest of the batch carries on.
+
+    With a DuplicateIndex, an invoice that was already written is skipped (as early as it can be
+    recognised) and gets an empty row list; written invoices are added to the index.
+    """
+    cpu_workers = cpu_workers or DEFAULT_CPU_WORKERS
+    io_workers = io_workers or DEFAULT_IO_WORKERS
+    total = len(pdf_paths)
+    results = [None] * total
+    finished = [False] * total
+    if batch_size > MAX_BATCH_INVOICES:
+        print(f"Batch size {batch_size} is above the limit of {MAX_BATCH_INVOICES}; using {MAX_BATCH_INVOICES}.")
+        batch_size = MAX_BATCH_INVOICES
+    batching = batch_size > 1 and mode != "local-only"
+    max_in_flight = cpu_workers + io_workers * (batch_size if batching else 1)
+    # Files already spread across the CPU pool; only small batches split their OCR pages further.
+    ocr_workers = max(1, cpu_workers // max(total, 1))
+    next_to_submit, next_to_emit, completed = 0, 0, 0
+    stage_of = {}  # future -> (stage, index)
+    pdf_hashes = {}  # index -> PDF hash, until the file is written (cache and duplicate index only)
+    fingerprints = {}  # index -> SimHash of the text, until the file is written (duplicate index only)
+    texts = {}  # index -> extracted text, while the file is being structured (for retries and batching)
+    waiting = []  # (index, pdf_path, text, pdf_hash) collected for the next batched request
+    waiting_chars = 0
+    batch_members = {}  # batch future -> indices of the invoices it carries
+    attempts = [1] * total
+    retries = []  # heap of (due time, index): files waiting out their backoff
+    failures, skipped = 0, 0
+    sources = {"cache": 0, "template": 0, "local": 0, "gemini": 0}
+    owns_client = client is None and mode != "local-only"
+    if owns_client:
+        client = GeminiClient(api_key, requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                              pool_size=io_workers)
+
+    with ProcessPoolExecutor(max_workers=cpu_workers) as cpu_pool, \
+         ThreadPoolExecutor(max_workers=io_workers) as io_pool, \
+         (client if owns_client else nullcontext()):
+
+        def start(index):
+            if cache or duplicates is not None:
+                future = io_pool.submit(_as_invoice, pdf_paths[index], _lookup, cache, duplicates, pdf_paths[index])
+                stage_of[future] = ("lookup", index)
+            else:
+                future = instrumentation.submit(cpu_pool, extract_invoice_text, pdf_paths[index], ocr_workers, page_policy)
+                stage_of[future] = ("extract", index)
+
+        def fill_window():
+            nonlocal next_to_submit
+            while next_to_submit < total and next_to_submit - completed < max_in_flight:
+                start(next_to_submit)
+                next_to_submit += 1
+
+        def structure(index, text):
+            if duplicates is not None and index not in fingerprints:
+                fingerprints[index] = text_fingerprint(text)
+                match = duplicates.match_text(text, fingerprints[index])
+                if match:
+                    skip(index, match)
+                    return
+            texts[index] = text
+            if batching:
+                future = io_pool.submit(_as_invoice, pdf_paths[index], _structure_offline, mode, pdf_paths[index], text, templates)
+                stage_of[future] = ("offline", index)
+            else:
+                future = io_pool.submit(_as_invoice, pdf_paths[index], _structure_invoice, api_key, client, mode,
+                                        pdf_paths[index], text, cache, pdf_hashes.get(index), templates, max_chars)
+                stage_of[future] = ("structure", index)
+
+        def send(batch):
+            future = io_pool.submit(_structure_batch, api_key, client, batch, cache, templates, max_chars)
+            stage_of[future] = ("batch", batch[0][0])
+            batch_members[future] = [index for index, *_ in batch]
+
+        def send_batch():
+            nonlocal waiting_chars
+            send(list(waiting))
+            waiting.clear()
+            waiting_chars = 0
+
+        def wait_for_batch(index, text):
+            nonlocal waiting_chars
+            size = min(len(text), max_chars or len(text))
+            if size > MAX_BATCH_CHARS // 2:
+                # Would leave no room for an invoice of its size: sent on its own straight away.
+                send([(index, pdf_paths[index], text, pdf_hashes.get(index))])
+                return
+            if waiting and waiting_chars + size > MAX_BATCH_CHARS:
+                send_batch()
+            waiting.append((index, pdf_paths[index], text, pdf_hashes.get(index)))
+            waiting_chars += size
+            if len(waiting) >= batch_size:
+                send_batch()
+
+        def retry(index):
+            """Resumes a file after its backoff: from its text if it has been extracted, else from the start."""
+            if index in texts:
+                structure(index, texts[index])
+            else:
+                start(index)
+
+        def done(index, rows=None, source=None):
+            nonlocal next_to_emit, completed
+            results[index] = rows
+            finished[index] = True
+            if source:
+                sources[source] += 1
+            texts.pop(index, None)
+            completed += 1
+            if rows:
+                print(f"[{completed}/{total}] Completed: {os.path.basename(pdf_paths[index])} ({len(rows)} items)")
+            if progress_callback:
+                progress_callback(completed, total, f"Completed {completed} of {total} files")
+            while next_to_emit < total and finished[next_to_emit]:
+                emit(next_to_emit)
+                next_to_emit += 1
+
+        def skip(index, match):
+            nonlocal skipped
+            skipped += 1
+            print(f"Skipping duplicate {os.path.basename(pdf_paths[index])}: {match['reason']} as "
+                  f"{os.path.basename(match['pdf_path'] or '?')}, written {match['added']}")
+            results[index] = []
+            if not finished[index]:
+                done(index, [])
+
+        def emit(index):
+            """Hands a finished file to result_callback, unless its rows turn out to be a duplicate."""
+            path, rows = pdf_paths[index], results[index]
+            pdf_hash, fingerprint = pdf_hashes.pop(index, None), fingerprints.pop(index, None)
+            if rows is None:
+                return
+            if duplicates is not None and rows:
+                match = duplicates.match_file(pdf_hash) or duplicates.match_rows(rows)
+                if match:
+                    skip(index, match)
+                    rows = []
+            if result_callback:
+                results[index] = None  # Handed over: the caller keeps what it needs
+                with instrumentation.invoice(path), instrumentation.span("write"):
+                    result_callback(index, path, rows)
+            if duplicates is not None and rows:
+                duplicates.add(rows, path, pdf_hash, fingerprint)
+
+        def fail(index, error):
+            nonlocal failures
+            path = pdf_paths[index]
+            if isinstance(error, BatchProcessingError):
+                error = error.error
+            kind = classify_failure(error)
+            if kind == "transient" and attempts[index] < max_attempts:
+                delay = _retry_delay(attempts[index])
+                attempts[index] += 1
+                print(f"Transient error on {os.path.basename(path)} ({error}); "
+                      f"retrying in {delay:.1f}s (attempt {attempts[index]} of {max_attempts})")
+                heapq.heappush(retries, (time.monotonic() + delay, index))
+                return
+            if not continue_on_error:
+                for pending in stage_of:
+                    pending.cancel()
+                raise BatchProcessingError(path, error) from error
+            failures += 1
+            print(f"FAILED ({kind}, {type(error).__name__}): {os.path.basename(path)}: {error}")
+            if failure_callback:
+                failure_callback(index, path, error, attempts[index])
+            done(index)
+
+        fill_window()
+        while stage_of or waiting or retries:
+            while retries and retries[0][0] <= time.monotonic():
+                retry(heapq.heappop(retries)[1])
+            # Send a partial batch once nothing still in flight could add another invoice to it.
+            if waiting and all(stage in ("structure", "batch") for stage, _ in stage_of.values()):
+                send_batch()
+            timeout = max(0.0, retries[0][0] - time.monotonic()) if retries else None
+            if not stage_of:
+                time.sleep(timeout)
+                continue
+            done_futures, _ = wait(list(stage_of), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                stage, index = stage_of.pop(future)
+                path = pdf_paths[index]
+                try:
+                    outcome = instrumentation.result(future, path) if stage == "extract" else future.result()
+                except Exception as e:
+                    # The batch stage reports per-invoice failures itself; this is only reached if it breaks.
+                    for failed in batch_members.pop(future, [index]):
+                        fail(failed, e)
+                    continue
+
+                if stage == "lookup":
+                    pdf_hash, text, data, duplicate = outcome
+                    pdf_hashes[index] = pdf_hash
+                    if duplicate:
+                        skip(index, duplicate)
+                    elif data is not None:
+                        done(index, build_invoice_rows(data), "cache")
+                    elif text is not None:
+                        structure(index, text)
+                    else:
+                        extract_future = instrumentation.submit(cpu_pool, extract_invoice_text, path, ocr_workers, page_policy)
+                        stage_of[extract_future] = ("extract", index)
+                elif stage == "extract":
+                    if cache and reads_all_pages(page_policy): cache.put_text(pdf_hashes[index], outcome)
+                    structure(index, outcome)
+                elif stage == "offline":
+                    if outcome is not None:
+                        done(index, *outcome)
+                    else:
+                        wait_for_batch(index, texts[index])
+                elif stage == "batch":
+                    batch_members.pop(future, None)
+                    for batch_index, rows, source in outcome:
+                        if rows is None:
+                            fail(batch_index, source)
+                        else:
+                            done(batch_index, rows, source)
+                else:
+                    done(index, *outcome)
+            fill_window()
+
+    print(f"Sources: {sources['gemini']} Gemini, {sources['template']} supplier templates, "
+          f"{sources['local']} local rules, {sources['cache']} cache")
+    if failures:
+        print(f"{failures} of {total} files failed.")
+    if skipped:
+        print(f"{skipped} duplicate invoices skipped.")
+    if client:
+        client.log_stats()
+    if cache:
+        cache.log_stats()
+    if templates is not None:
+        templates.log_stats()
+    if duplicates is not None:
+        duplicates.log_stats()
+    return None if result_callback else results
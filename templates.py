@@ -0,0 +1,428 @@
+# templates.py
+# Supplier layout templates. Most invoices come from a few dozen regular suppliers whose layout
+# never changes, so once an invoice from a supplier has been extracted and its amounts reconcile,
+# the position of every field is recorded: the label printed before the value ("Invoice No:"),
+# where the value sat on the page, and the x-range of each line item column. Later invoices from
+# the same supplier are read straight from the PDF's text blocks with that template, and only
+# unknown layouts go to Gemini.
+# Templates are found by supplier GSTIN or, failing that, by a fingerprint of the static header
+# text. Both are in-memory dict indexes, so lookup cost does not grow with the number of templates.
+
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+import fitz  # PyMuPDF
+import instrumentation
+from local_extractor import REQUIRED_FIELDS, amounts_reconcile, find_gstins, normalize_date
+
+DEFAULT_TEMPLATE_PATH = os.path.join(os.path.expanduser("~"), ".invoice_extractor", "templates.sqlite3")
+HEADER_SECTIONS = ("invoiceHeader", "supplierDetails", "buyerDetails", "logisticsDetails", "eWayBillDetails", "summary")
+# Classification and ledger fields describe how the supplier is booked, not what is printed on
+# the invoice, so they are stored as constants of the template instead of being located.
+CONSTANT_FIELDS = {
+    "invoiceHeader": ("voucherType", "documentType", "subType"),
+    "summary": ("purchaseLedger", "cgstLedger", "sgstLedger", "igstLedger", "cessLedger", "roundOffLedger", "costCenterGodown"),
+}
+# Supplier details the model filled in without the value being printed on the page (the country,
+# the registration type) are the same on every invoice from that supplier and are kept too.
+SUPPLIER_SECTION = "supplierDetails"
+# Line item columns a table row must have before it is read as an item.
+KEY_COLUMNS = ("hsnCode", "qty", "rate", "amount")
+FINGERPRINT_MAX_HEIGHT = 0.4  # Only the top 40% of the first page is fingerprinted
+MAX_ANCHOR_WORDS = 3
+
+Word = namedtuple("Word", "x0 y0 x1 y1 text")
+PageWords = namedtuple("PageWords", "lines height")
+
+# PyMuPDF documents must not be used from several threads at once; templates are applied on the
+# pipeline's I/O threads, so all reads in this module go through one lock.
+_fitz_lock = threading.Lock()
+_NUMBER = re.compile(r"^-?(?:\d{1,3}(?:,\d{2,3})+|\d+)(?:\.\d+)?$")
+
+def _number(text):
+    """Parses '1,23,456.50' style amounts; returns None for anything that is not a number."""
+    cleaned = text.strip().lstrip("\u20b9").rstrip(".,;:")
+    if cleaned.lower().startswith("rs"):
+        cleaned = cleaned[2:].lstrip(".")
+    return float(cleaned.replace(",", "")) if _NUMBER.match(cleaned) else None
+
+def _clean(text):
+    return text.casefold().strip(".,:;()")
+
+def _is_empty(value):
+    return value is None or value in ("", "NA") or (isinstance(value, (int, float)) and not isinstance(value, bool) and value == 0)
+
+def _kind(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "number"
+    if normalize_date(str(value)):
+        return "date"
+    return "text"
+
+def _gap_limit(word):
+    """Horizontal gap that separates two values on a line (wider than a single space)."""
+    return 0.8 * (word.y1 - word.y0)
+
+def page_lines(page):
+    """Groups the words of a fitz page into visual lines, top to bottom, each sorted left to right."""
+    words = sorted(page.get_text("words"), key=lambda w: ((w[1] + w[3]) / 2, w[0]))
+    lines, current, current_y = [], [], None
+    for w in words:
+        word = Word(*w[:5])
+        y = (word.y0 + word.y1) / 2
+        if current and abs(y - current_y) > (word.y1 - word.y0) / 2:
+            lines.append(sorted(current))
+            current = []
+        if not current:
+            current_y = y
+        current.append(word)
+    if current:
+        lines.append(sorted(current))
+    return lines
+
+def read_pages(pdf_path):
+    """Returns a PageWords (lines, page height) per page; scanned pages have no lines."""
+    with _fitz_lock, fitz.open(pdf_path) as doc:
+        return [PageWords(page_lines(page), page.rect.height) for page in doc]
+
+def layout_fingerprint(pages):
+    """
+    Hashes the static header text of the first page: the words without digits above the first
+    table row (a line with three or more numbers), so invoice numbers, dates and line items
+    do not change the fingerprint of a supplier's layout.
+    """
+    if not pages or not pages[0].lines:
+        return None
+    tokens = set()
+    for line in pages[0].lines:
+        if line[0].y0 > pages[0].height * FINGERPRINT_MAX_HEIGHT or sum(_number(w.text) is not None for w in line) >= 3:
+            break
+        tokens.update(w.text.casefold() for w in line if re.search(r"[^\W\d]", w.text) and not re.search(r"\d", w.text))
+    return hashlib.sha1(" ".join(sorted(tokens)).encode("utf-8")).hexdigest()[:16] if tokens else None
+
+# --- Learning ---
+def _matches(line, value, kind):
+    """Yields (start, end) word ranges of the line that hold the value."""
+    if kind == "number":
+        for i, word in enumerate(line):
+            number = _number(word.text)
+            if number is not None and abs(number - value) < 0.005:
+                yield i, i + 1
+    elif kind == "date":
+        target = normalize_date(str(value))
+        for i in range(len(line)):
+            for length in (1, 2, 3):
+                if i + length <= len(line) and normalize_date(" ".join(w.text for w in line[i:i + length]).strip(".,")) == target:
+                    yield i, i + length
+                    break
+    else:
+        tokens = [t for t in (_clean(t) for t in str(value).split()) if t]
+        texts = [_clean(w.text) for w in line]
+        for i in range(len(line) - len(tokens) + 1):
+            if tokens and texts[i:i + len(tokens)] == tokens:
+                yield i, i + len(tokens)
+
+def _anchor(line, start):
+    """The label words printed just before a value on its line ("Invoice", "No:"), if any."""
+    anchor = []
+    for i in range(start - 1, -1, -1):
+        word = line[i]
+        if len(anchor) == MAX_ANCHOR_WORDS or re.search(r"\d", word.text):
+            break
+        if anchor and line[i + 1].x0 - word.x1 > _gap_limit(word):
+            break
+        anchor.insert(0, word.text.casefold())
+    return anchor
+
+def _locate_field(pages, field, value, used):
+    """
+    Finds the value on the page and returns its field spec. Ambiguous numbers (CGST and SGST are
+    often equal) prefer an occurrence whose label mentions the field, then one no other field has
+    claimed, in reading order.
+    """
+    kind = _kind(value)
+    hint = re.match(r"[a-z]+", field).group()
+    candidates = []
+    for page_no, page in enumerate(pages):
+        for line_no, line in enumerate(page.lines):
+            for start, end in _matches(line, value, kind):
+                anchor = _anchor(line, start)
+                key = (page_no, line_no, start)
+                candidates.append((hint not in " ".join(anchor), key in used, key, anchor, line[start:end]))
+    if not candidates:
+        return None
+    _, _, key, anchor, words = min(candidates, key=lambda c: c[:3])
+    used.add(key)
+    page_no = key[0]
+    if page_no == len(pages) - 1 and page_no > 0:
+        page_no = -1  # Totals sit on the last page, however many pages the invoice has
+    box = [min(w.x0 for w in words), min(w.y0 for w in words), max(w.x1 for w in words), max(w.y1 for w in words)]
+    return {"kind": kind, "page": page_no, "anchor": anchor, "box": box, "words": len(words)}
+
+def _learn_columns(pages, line_items):
+    """Learns the x-range of each line item column from the table rows that hold known items."""
+    columns = {}
+    for item in line_items:
+        # Right-most columns first, each taking the right-most free match, so a quantity of 1
+        # is not mistaken for the serial number.
+        fields = [(f, v) for f, v in reversed(list(item.items())) if not _is_empty(v)]
+        if not fields or _is_empty(item.get("amount")):
+            continue
+        for page in pages:
+            row = next((line for line in page.lines if any(_matches(line, item["amount"], "number"))), None)
+            if row is None:
+                continue
+            taken = set()
+            for field, value in fields:
+                kind = "text" if field == "hsnCode" else _kind(value)
+                free = [(s, e) for s, e in _matches(row, value, kind) if not taken & set(range(s, e))]
+                if not free:
+                    continue
+                start, end = free[-1]
+                taken.update(range(start, end))
+                x0, x1 = row[start].x0, row[end - 1].x1
+                column = columns.setdefault(field, {"kind": kind, "x0": x0, "x1": x1})
+                column["x0"], column["x1"] = min(column["x0"], x0), max(column["x1"], x1)
+            break
+    return columns
+
+def build_template(pdf_path, structured_data):
+    """Learns a template from a confirmed extraction, or returns None if the layout cannot be pinned down."""
+    if not amounts_reconcile(structured_data):
+        return None
+    pages = read_pages(pdf_path)
+    if not any(page.lines for page in pages):
+        return None
+    fields, constants, used = {}, {}, set()
+    for section in HEADER_SECTIONS:
+        for field, value in structured_data.get(section, {}).items():
+            if _is_empty(value) or isinstance(value, (dict, list)):
+                continue
+            if field in CONSTANT_FIELDS.get(section, ()):
+                constants[f"{section}.{field}"] = value
+                continue
+            spec = _locate_field(pages, field, value, used)
+            if spec:
+                fields[f"{section}.{field}"] = spec
+            elif section == SUPPLIER_SECTION:
+                constants[f"{section}.{field}"] = value
+    columns = _learn_columns(pages, structured_data.get("lineItems", []))
+    if any(field not in fields for field in REQUIRED_FIELDS) or any(c not in columns for c in KEY_COLUMNS):
+        return None
+    return {
+        "gstin": structured_data["supplierDetails"]["gstin"], "fingerprint": layout_fingerprint(pages),
+        "supplier": structured_data["supplierDetails"].get("name", "NA"),
+        "fields": fields, "constants": constants, "columns": columns, "learned_at": time.time(),
+    }
+
+# --- Parsing ---
+def _convert(words, kind):
+    raw = " ".join(w.text for w in words)
+    if kind == "number":
+        return _number(raw)
+    if kind == "date":
+        return normalize_date(raw.strip(".,")) or raw
+    return raw.strip()
+
+def _read_field(pages, spec):
+    """Reads one header field: the words after its label, or the words in its learned box."""
+    if not -len(pages) <= spec["page"] < len(pages):
+        return None  # Learned from a longer invoice: the field is missing from this one
+    lines = pages[spec["page"]].lines
+    if not lines:
+        return None
+    x0, y0, x1, y1 = spec["box"]
+    anchor = spec["anchor"]
+    if not anchor:
+        words = [w for line in lines for w in line
+                 if abs((w.y0 + w.y1) / 2 - (y0 + y1) / 2) <= (y1 - y0) / 2 and w.x1 > x0 - 2 and w.x0 < x1 + 2]
+        return _convert(words, spec["kind"]) if words else None
+    best = None
+    for line in lines:
+        texts = [w.text.casefold() for w in line]
+        for i in range(len(line) - len(anchor)):
+            if texts[i:i + len(anchor)] == anchor:
+                value_start = i + len(anchor)
+                distance = abs(line[value_start].y0 - y0) + abs(line[value_start].x0 - x0)
+                if best is None or distance < best[0]:
+                    best = (distance, line, value_start)
+    if best is None:
+        return None
+    _, line, start = best
+    if spec["kind"] == "text":
+        end = start + 1
+        while end < len(line) and line[end].x0 - line[end - 1].x1 <= _gap_limit(line[end - 1]):
+            end += 1
+    else:
+        end = start + spec["words"]
+    return _convert(line[start:end], spec["kind"])
+
+def _read_line_items(pages, columns, empty_item):
+    """Reads every table row that has a value in each key column."""
+    items = []
+    for page in pages:
+        for line in page.lines:
+            cells = {}
+            for word in line:
+                tolerance = (word.y1 - word.y0) / 2
+                overlaps = [(min(word.x1, c["x1"] + tolerance) - max(word.x0, c["x0"] - tolerance), field)
+                            for field, c in columns.items()]
+                overlap, field = max(overlaps)
+                if overlap > 0:
+                    cells.setdefault(field, []).append(word)
+            if any(field not in cells for field in KEY_COLUMNS):
+                continue
+            item = copy.deepcopy(empty_item)
+            for field, words in cells.items():
+                item[field] = _convert(words, columns[field]["kind"])
+            if any(item[field] is None for field in ("qty", "rate", "amount")) or not re.fullmatch(r"\d{4,8}", item["hsnCode"]):
+                continue
+            if float(item["qty"]).is_integer():
+                item["qty"] = int(item["qty"])
+            items.append(item)
+    return items
+
+def apply_template(template, pages):
+    """Reads an invoice with a template. Returns the structured data, or None if a required field is missing."""
+    from extractor import GEMINI_SCHEMA
+    data = copy.deepcopy(GEMINI_SCHEMA)
+    empty_item = data["lineItems"][0]
+    for key, value in template["constants"].items():
+        section, field = key.split(".", 1)
+        data[section][field] = value
+    for key, spec in template["fields"].items():
+        section, field = key.split(".", 1)
+        value = _read_field(pages, spec)
+        if value is None:
+            if key in REQUIRED_FIELDS:
+                return None
+            continue
+        data[section][field] = value
+    data["lineItems"] = _read_line_items(pages, template["columns"], empty_item)
+    if not data["lineItems"]:
+        return None
+    return data
+
+class TemplateStore:
+    """
+    SQLite-backed store of supplier templates, indexed in memory by supplier GSTIN and by layout
+    fingerprint. Only the index is read at start-up; a template is decoded the first time it is
+    used. Safe to share between threads.
+    """
+    def __init__(self, path=DEFAULT_TEMPLATE_PATH):
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0, "rejected": 0, "learned": 0}
+        self._lock = threading.Lock()
+        self._by_gstin = {}        # supplier GSTIN -> template key
+        self._by_fingerprint = {}  # layout fingerprint -> template key
+        self._decoded = {}         # template key -> template, once used
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS templates ("
+            " key TEXT PRIMARY KEY, gstin TEXT, fingerprint TEXT, template TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+        for key, gstin, fingerprint in self._conn.execute("SELECT key, gstin, fingerprint FROM templates"):
+            self._index(key, gstin, fingerprint)
+
+    def __len__(self):
+        return len(set(self._by_gstin.values()) | set(self._by_fingerprint.values()))
+
+    def _index(self, key, gstin, fingerprint):
+        if gstin:
+            self._by_gstin[gstin] = key
+        if fingerprint:
+            self._by_fingerprint[fingerprint] = key
+
+    def add_many(self, templates):
+        """Stores and indexes templates in one transaction; a new template replaces the supplier's old one."""
+        with self._lock:
+            for template in templates:
+                gstin = template["gstin"] if template["gstin"] not in ("", "NA", None) else None
+                key = gstin or template["fingerprint"]
+                self._conn.execute("INSERT OR REPLACE INTO templates VALUES (?, ?, ?, ?, ?)",
+                                   (key, gstin, template["fingerprint"], json.dumps(template), time.time()))
+                self._index(key, gstin, template["fingerprint"])
+                self._decoded[key] = template
+            self._conn.commit()
+
+    def add(self, template):
+        self.add_many([template])
+
+    def _template(self, key):
+        with self._lock:
+            if key not in self._decoded:
+                row = self._conn.execute("SELECT template FROM templates WHERE key = ?", (key,)).fetchone()
+                self._decoded[key] = json.loads(row[0])
+            return self._decoded[key]
+
+    def find(self, gstins=(), fingerprint=None):
+        """Returns the template for the first known GSTIN, else for the layout fingerprint, else None."""
+        for gstin in gstins:
+            if gstin in self._by_gstin:
+                return self._template(self._by_gstin[gstin])
+        if fingerprint in self._by_fingerprint:
+            return self._template(self._by_fingerprint[fingerprint])
+        return None
+
+    def parse_invoice(self, pdf_path, invoice_text):
+        """
+        Reads the invoice with its supplier's template. Returns the structured data, or None when
+        the supplier is unknown or the template no longer fits (the amounts must still reconcile).
+        A template that fails on the invoice is rejected too, so the invoice goes to Gemini and
+        the template is re-learned from its answer.
+        """
+        with instrumentation.span("template"):
+            try:
+                return self._parse_invoice(pdf_path, invoice_text)
+            except Exception as e:
+                print(f"Template could not read {os.path.basename(pdf_path)}: {e}")
+                with self._lock: self.stats["rejected"] += 1
+                return None
+
+    def _parse_invoice(self, pdf_path, invoice_text):
+        pages = None
+        template = self.find(find_gstins(invoice_text))
+        if template is None and self._by_fingerprint:
+            pages = read_pages(pdf_path)
+            template = self.find(fingerprint=layout_fingerprint(pages))
+        if template is None:
+            with self._lock: self.stats["misses"] += 1
+            return None
+        data = apply_template(template, pages or read_pages(pdf_path))
+        if data is None or not amounts_reconcile(data):
+            with self._lock: self.stats["rejected"] += 1
+            return None
+        with self._lock: self.stats["hits"] += 1
+        return data
+
+    def learn(self, pdf_path, structured_data):
+        """Learns (or re-learns) the supplier's template from a confirmed extraction. Returns True if stored."""
+        try:
+            with instrumentation.span("learn"):
+                template = build_template(pdf_path, structured_data)
+        except Exception as e:
+            print(f"Could not learn a template from {os.path.basename(pdf_path)}: {e}")
+            return False
+        if template is None:
+            return False
+        self.add(template)
+        with self._lock: self.stats["learned"] += 1
+        return True
+
+    def log_stats(self):
+        s = self.stats
+        print(f"Templates: {s['hits']} read by template, {s['rejected']} rejected, {s['misses']} unknown layouts, "
+              f"{s['learned']} learned, {len(self)} suppliers known")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
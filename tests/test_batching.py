@@ -0,0 +1,51 @@
+import os
+import sys
+import threading
+
+import pipeline
+from extractor import structure_invoice_offline, MAX_BATCH_INVOICES
+from gemini_client import GeminiClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from corpus import make_corpus, write_digital_invoice
+
+def fake_gemini(monkeypatch):
+    """Answers Gemini calls with the local rules' reading; returns the list of batched and single calls."""
+    calls, lock = [], threading.Lock()
+
+    def batch(api_key, texts, client=None, **options):
+        with lock: calls.append(("batch", len(texts)))
+        return [structure_invoice_offline(text, "local-only")[0] for text in texts]
+
+    def single(api_key, text, client=None, **options):
+        with lock: calls.append(("single", 1))
+        return structure_invoice_offline(text, "local-only")[0]
+
+    monkeypatch.setattr(pipeline, "extract_batch_with_gemini", batch)
+    monkeypatch.setattr(pipeline, "extract_data_with_gemini", single)
+    return calls
+
+def test_batch_size_is_capped(tmp_path, monkeypatch):
+    calls = fake_gemini(monkeypatch)
+    paths = make_corpus(str(tmp_path), 6)
+    results = pipeline.process_invoice_batch(paths, "key", cpu_workers=2, io_workers=1, batch_size=10, client=GeminiClient("key"))
+    assert all(rows for rows in results)
+    assert max(size for _, size in calls) == MAX_BATCH_INVOICES
+    assert sum(size for _, size in calls) == 6
+
+def test_long_invoices_use_the_single_prompt(tmp_path, monkeypatch):
+    calls = fake_gemini(monkeypatch)
+    long_invoice = str(tmp_path / "statement.pdf")
+    write_digital_invoice(long_invoice, 1, n_items=60, pages=3)
+    results = pipeline.process_invoice_batch([long_invoice], "key", cpu_workers=1, io_workers=1, batch_size=4,
+                                             client=GeminiClient("key"))
+    assert results[0]
+    assert calls == [("single", 1)]
+
+def test_rows_are_released_once_handed_over(tmp_path):
+    paths = make_corpus(str(tmp_path), 3)
+    handed = []
+    returned = pipeline.process_invoice_batch(paths, None, cpu_workers=1, io_workers=1, mode="local-only",
+                                              result_callback=lambda index, path, rows: handed.append((index, len(rows))))
+    assert returned is None
+    assert [index for index, _ in handed] == [0, 1, 2] and all(count for _, count in handed)
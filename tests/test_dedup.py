@@ -0,0 +1,82 @@
+import datetime
+from dedup import DuplicateIndex, invoice_key, key_from_rows, remove_index, text_fingerprint
+from invoice_model import InvoiceRows
+
+TEXT = """TAX INVOICE
+Shree Ganesh Traders
+GSTIN: 27AABCS1429B1ZU State: Maharashtra
+Invoice No: INV/00042 Invoice Date: 05/04/2026
+1 Paracetamol 500mg Tab 30049099 10 25.50 255.00
+2 Amoxicillin 250mg Cap 30041030 4 80.00 320.00
+Taxable Value: 575.00
+CGST: 34.50
+SGST: 34.50
+Grand Total: 644.00"""
+
+def rows(number="INV/00042", total=644.0, gstin="27AABCS1429B1ZU", date="05/04/2026"):
+    return InvoiceRows.from_structured({"invoiceHeader": {"invoiceNo": number, "invoiceDate": date},
+                                        "supplierDetails": {"gstin": gstin}, "summary": {"totalAmount": total},
+                                        "lineItems": [{"itemName": "Paracetamol 500mg Tab"}]})
+
+def test_invoice_key_normalizes_fields():
+    assert invoice_key("27aabcs1429b1zu", "inv/00042", "5.4.2026", "643.6") == "27AABCS1429B1ZU|INV00042|05/04/2026|644"
+    assert invoice_key("27AABCS1429B1ZU", "INV-00042", datetime.date(2026, 4, 5), 644) == invoice_key(
+        "27AABCS1429B1ZU", "INV/00042", "05/04/2026", "644.00")
+    assert invoice_key("NA", "INV/00042", "05/04/2026", 1) is None
+    assert key_from_rows(rows()) == "27AABCS1429B1ZU|INV00042|05/04/2026|644"
+
+def test_fingerprint_ignores_layout_and_case():
+    relaid = "\n\n".join("   ".join(line.lower().split()) for line in TEXT.splitlines())
+    assert text_fingerprint(relaid) == text_fingerprint(TEXT)
+    assert text_fingerprint(TEXT.replace("Paracetamol 500mg Tab", "LED Panel Light 18W")) != text_fingerprint(TEXT)
+
+def test_matches_by_file_text_and_key(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "ledger.xlsx.invoices.sqlite3"))
+    assert index.match_file("abc") is None and index.match_rows(rows()) is None
+    index.add(rows(), "/in/a.pdf", "abc", text_fingerprint(TEXT))
+    assert index.match_file("abc")["reason"] == "same file"
+    assert index.match_text(TEXT)["reason"] == "near-duplicate text"
+    assert index.match_rows(rows())["pdf_path"] == "/in/a.pdf"
+    assert index.match_rows(rows(number="INV/00043")) is None
+    assert index.match_rows(rows(total=999.0)) is None
+    assert len(index) == 1
+    index.close()
+
+def test_a_similar_invoice_with_another_number_is_not_a_duplicate(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "index.sqlite3"))
+    index.add(rows(), "/in/a.pdf", "abc", text_fingerprint(TEXT))
+    assert index.match_text(TEXT.replace("INV/00042", "INV/00043").replace("644.00", "650.00")) is None
+    index.close()
+
+def test_indexes_are_per_ledger_and_can_be_removed(tmp_path):
+    first, second = str(tmp_path / "a.csv.invoices.sqlite3"), str(tmp_path / "b.csv.invoices.sqlite3")
+    index = DuplicateIndex(first)
+    index.add(rows(), "/in/a.pdf", "abc")
+    index.close()
+    index = DuplicateIndex(second)
+    assert index.match_file("abc") is None
+    index.close()
+    remove_index(first)
+    index = DuplicateIndex(first)
+    assert len(index) == 0
+    index.close()
+
+TERMS = "\n".join(f"{n}. The tenant shall observe clause {n} of the lease agreement dated 01/01/2024 at all times."
+                  for n in range(1, 121))
+
+def rent_invoice(number, date, total="35400.00"):
+    return (f"TAX INVOICE\nShree Ganesh Traders\nGSTIN: 27AABCS1429B1ZU State: Maharashtra\n"
+            f"Invoice No: {number} Invoice Date: {date}\n1 Rent for the month 997212 1 30000.00 30000.00\n"
+            f"Taxable Value: 30000.00\nCGST: 2700.00\nSGST: 2700.00\nGrand Total: {total}\n{TERMS}")
+
+def test_recurring_invoices_with_the_same_terms_are_not_duplicates(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "index.sqlite3"))
+    march, april = rent_invoice("103", "01/03/2026"), rent_invoice("104", "01/04/2026")
+    assert bin(text_fingerprint(march) ^ text_fingerprint(april)).count("1") <= 3  # Near-identical text
+    index.add(rows(number="103", total=35400.0, date="01/03/2026"), "/in/march.pdf", "m", text_fingerprint(march))
+    assert index.match_text(march.replace("Rent for", "Rent  for"))["reason"] == "near-duplicate text"
+    assert index.match_text(april) is None
+    # The same number on another date (numbering restarted) or for another amount is another bill too.
+    assert index.match_text(rent_invoice("103", "01/03/2027")) is None
+    assert index.match_text(rent_invoice("103", "01/03/2026", total="36000.00")) is None
+    index.close()
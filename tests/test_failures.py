@@ -0,0 +1,40 @@
+import json
+import os
+
+from gemini_client import GeminiAPIError
+from ledger_writer import sidecar_path
+from pipeline import FailureManifest, FAILURES_SUFFIX
+
+def _entries(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def test_record_is_written_immediately_with_its_class(tmp_path):
+    path = str(tmp_path / "ledger.xlsx.failures.jsonl")
+    manifest = FailureManifest(path)
+    manifest.record("a.pdf", GeminiAPIError("rate limited", 429), attempts=3)
+    manifest.record("b.pdf", ValueError("not a PDF"))
+    entries = _entries(path)  # Before close, so a crash keeps them
+    assert [(e["path"], e["kind"], e["error_type"], e["attempts"]) for e in entries] == \
+        [("a.pdf", "transient", "GeminiAPIError", 3), ("b.pdf", "permanent", "ValueError", 1)]
+    manifest.close()
+
+def test_close_keeps_only_what_still_fails(tmp_path):
+    path = str(tmp_path / "ledger.xlsx.failures.jsonl")
+    manifest = FailureManifest(path)
+    manifest.record("a.pdf", ValueError("bad"))
+    manifest.record("b.pdf", ValueError("bad"))
+    manifest.record("a.pdf", ValueError("still bad"), attempts=2)
+    manifest.resolve("b.pdf")
+    manifest.close()
+    assert [(e["path"], e["error"]) for e in _entries(path)] == [("a.pdf", "still bad")]
+
+    reopened = FailureManifest(path)
+    assert reopened.paths() == ["a.pdf"]
+    reopened.resolve("a.pdf")
+    reopened.close()
+    assert not os.path.exists(path)
+
+def test_failures_sit_next_to_the_output():
+    assert sidecar_path("out/ledger.xlsx", FAILURES_SUFFIX) == "out/ledger.xlsx.failures.jsonl"
+    assert sidecar_path("out/ledger.parquet/", FAILURES_SUFFIX) == "out/ledger.parquet.failures.jsonl"
@@ -0,0 +1,28 @@
+import os
+import pstats
+
+import instrumentation
+from instrumentation import RunRecorder, measured, span
+
+def _work(n):
+    with span("parse"):
+        return sum(range(n))
+
+def _calls(stats, name):
+    return sum(nc for (_, _, func), (_, nc, _, _, _) in stats.stats.items() if func == name)
+
+def test_worker_profiles_are_merged_and_written_once(tmp_path, monkeypatch):
+    recorder = RunRecorder(str(tmp_path))
+    monkeypatch.setattr(instrumentation, "_recorder", recorder)
+    for n in (10, 20):
+        value, exported = measured(_work, True, str(tmp_path), n)
+        recorder.merge(exported, f"invoice-{n}.pdf")
+    assert os.listdir(tmp_path) == []  # Nothing is written while the run is going
+
+    combined = recorder.write_profiles(top=0)
+    assert sorted(os.listdir(tmp_path)) == ["combined.prof", "parse.prof"]
+    assert _calls(pstats.Stats(combined), "<built-in method builtins.sum>") == 2
+    assert len(recorder.spans) == 2
+
+def test_write_profiles_without_profiling(tmp_path):
+    assert RunRecorder(str(tmp_path)).write_profiles() is None
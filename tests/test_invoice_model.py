@@ -0,0 +1,56 @@
+import datetime
+import pytest
+from invoice_model import InvoiceRows, to_date, to_number, to_text
+
+def invoice(date="01/04/2026", qty=10, total="1,234.50"):
+    return {"invoiceHeader": {"invoiceNo": "INV/1", "invoiceDate": date},
+            "supplierDetails": {"gstin": "27AABCS1429B1ZU", "pincode": 411001.0},
+            "summary": {"totalAmount": total},
+            "lineItems": [{"itemName": "Widget", "qty": qty, "rate": "12.5"}, {"itemName": "Gadget", "qty": "NA"}]}
+
+@pytest.mark.parametrize("raw", ["01/04/2026", "01-04-2026", "1.4.26", "2026-04-01", "2026/04/01", "1st April 2026",
+                                 "April 01, 2026", "01 Apr 2026", "01/04/2026 10:30", "2026-04-01T10:30:00"])
+def test_to_date_formats(raw):
+    assert to_date(raw) == datetime.date(2026, 4, 1)
+
+@pytest.mark.parametrize("raw", ["NA", "", None, "31/02/2026", "sometime in April"])
+def test_to_date_unreadable(raw):
+    assert to_date(raw) is None
+
+def test_to_number():
+    assert to_number("₹ 1,234.50") == 1234.5
+    assert to_number(7) == 7.0
+    assert to_number("10 Nos") is None
+    assert to_number(True) is None and to_number("NA") is None
+
+def test_to_text():
+    assert to_text(411001.0) == "411001"
+    assert to_text(" N/A ") is None and to_text({"a": 1}) is None
+
+def test_rows_share_the_header_and_convert_types():
+    rows = InvoiceRows.from_structured(invoice())
+    assert len(rows) == 2
+    assert rows[0]["Invoice Date"] == rows[1]["Invoice Date"] == datetime.date(2026, 4, 1)
+    assert rows.get("Total Amount") == 1234.5 and rows.get("Supplier Pincode") == "411001"
+    assert rows.column("QTY") == [10.0, None]
+    assert rows[1]["Item Name"] == "Gadget" and rows[-1]["Rate"] is None
+    assert rows == InvoiceRows.from_structured(invoice())
+
+def test_unreadable_values_are_kept_as_text_and_reported(capsys):
+    rows = InvoiceRows.from_structured(invoice(date="early April", qty="10 Nos"))
+    assert rows.get("Invoice Date") == "early April"
+    assert rows[0]["QTY"] == "10 Nos"
+    assert "Could not read '10 Nos' in QTY as a number" in capsys.readouterr().out
+
+def test_invoice_without_line_items_has_one_row():
+    rows = InvoiceRows.from_structured({"invoiceHeader": {"invoiceNo": "X"}, "lineItems": []})
+    assert len(rows) == 1 and rows[0]["Item Name"] is None
+
+def test_to_arrow_nulls_unreadable_values():
+    pa = pytest.importorskip("pyarrow")
+    from invoice_model import to_arrow
+    table = to_arrow([InvoiceRows.from_structured(invoice(date="early April", qty="10 Nos"))], ["Invoice Date", "QTY", "Item Name"])
+    assert table.schema.field("QTY").type == pa.float64()
+    assert table.column("Invoice Date").to_pylist() == [None, None]
+    assert table.column("QTY").to_pylist() == [None, None]
+    assert table.column("Item Name").to_pylist() == ["Widget", "Gadget"]
@@ -0,0 +1,96 @@
+import csv
+import json
+import os
+import openpyxl
+import pytest
+from invoice_model import InvoiceRows
+from ledger_writer import open_ledger_writer, StreamingLedgerWriter
+
+COLUMNS = ["Invoice Date", "Invoice No", "Item Name", "QTY", "Amount"]
+
+def rows(number, date="01/04/2026", qty=2, items=("Widget", "Gadget")):
+    return InvoiceRows.from_structured({
+        "invoiceHeader": {"invoiceNo": number, "invoiceDate": date},
+        "lineItems": [{"itemName": name, "qty": qty, "amount": 10.5} for name in items]})
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+def read_xlsx(path):
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return [list(row) for row in workbook.active.iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+
+def test_xlsx_appends_to_an_existing_workbook(tmp_path):
+    path = str(tmp_path / "ledger.xlsx")
+    writer = StreamingLedgerWriter(path, columns=COLUMNS, chunk_rows=2)
+    writer.append_rows(rows("INV/1"))  # A full chunk: creates the workbook
+    writer.append_rows(rows("INV/2", items=["Widget"]))
+    writer.close()
+    writer = StreamingLedgerWriter(path, columns=COLUMNS)
+    writer.append_rows(rows("INV/3", items=["Gadget"]))
+    writer.close()
+    assert [row[1:3] for row in read_xlsx(path)] == [["Invoice No", "Item Name"], ["INV/1", "Widget"], ["INV/1", "Gadget"],
+                                                     ["INV/2", "Widget"], ["INV/3", "Gadget"]]
+    assert writer.rows_written == 1 and not os.path.exists(path + ".pending.jsonl")
+
+def test_staged_rows_survive_a_crash(tmp_path):
+    path = str(tmp_path / "ledger.xlsx")
+    crashed = StreamingLedgerWriter(path, columns=COLUMNS)
+    crashed.append_rows(rows("INV/1"))
+    crashed._staging.close()  # Dies before close(): nothing reached the workbook
+    assert not os.path.exists(path)
+
+    writer = StreamingLedgerWriter(path, columns=COLUMNS)
+    writer.append_rows(rows("INV/2", items=["Widget"]))
+    writer.close()
+    assert [row[1] for row in read_xlsx(path)[1:]] == ["INV/1", "INV/1", "INV/2"]
+    assert writer.rows_written == 3
+
+def test_rows_stay_staged_while_the_workbook_cannot_be_written(tmp_path, monkeypatch):
+    path = str(tmp_path / "ledger.xlsx")
+    writer = StreamingLedgerWriter(path, columns=COLUMNS)
+    writer.append_rows(rows("INV/1"))
+    def locked(*args):
+        raise PermissionError("open in Excel")
+    monkeypatch.setattr(writer, "_write_staged", locked)
+    with pytest.raises(PermissionError):
+        writer.close()
+    assert os.path.exists(path + ".pending.jsonl")
+    monkeypatch.undo()
+
+    retry = StreamingLedgerWriter(path, columns=COLUMNS)
+    retry.close()
+    assert len(read_xlsx(path)) == 3
+
+def test_text_exports_keep_unreadable_values(tmp_path):
+    path = str(tmp_path / "ledger.csv")
+    writer = open_ledger_writer(path, columns=COLUMNS)
+    writer.append_rows(rows("INV/1", date="early April", qty="10 Nos", items=["Widget"]))
+    writer.append_rows(rows("INV/2", items=["Gadget"]))
+    writer.close()
+    assert read_csv(path) == [COLUMNS, ["early April", "INV/1", "Widget", "10 Nos", "10.5"],
+                              ["01/04/2026", "INV/2", "Gadget", "2", "10.5"]]
+
+def test_jsonl_writes_ledger_cells(tmp_path):
+    path = str(tmp_path / "ledger.jsonl")
+    with_na = InvoiceRows.from_structured({"invoiceHeader": {"invoiceNo": "INV/3"}})
+    writer = open_ledger_writer(path, columns=COLUMNS)
+    writer.append_rows(with_na)
+    writer.close()
+    with open(path, encoding="utf-8") as f:
+        assert json.loads(f.readline()) == {"Invoice Date": "NA", "Invoice No": "INV/3", "Item Name": "NA", "QTY": "NA", "Amount": "NA"}
+
+def test_parquet_stores_null_for_unreadable_values(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "ledger.parquet")
+    writer = open_ledger_writer(path, columns=COLUMNS)
+    writer.append_rows(rows("INV/1", date="early April", qty="10 Nos", items=["Widget"]))
+    writer.append_rows(rows("INV/2", items=["Gadget"]))
+    writer.close()
+    table = pq.read_table(path)
+    assert table.column("QTY").to_pylist() == [None, 2.0]
+    assert [str(d) if d else None for d in table.column("Invoice Date").to_pylist()] == [None, "2026-04-01"]
@@ -0,0 +1,65 @@
+import pipeline
+from extractor import PAGE_SEPARATOR, extract_data_with_gemini, normalize_invoice_text
+
+HEADER = ["ACME Traders", "GSTIN: 27AABCS1429B1ZU", "TAX INVOICE"]
+
+def page(number, items, total):
+    lines = HEADER + [f"{i} Widget {i} 1 100.00" for i in items] + [f"Total {total:.2f}", "Thank you for your business",
+                                                                      f"Page {number} of 3"]
+    return "\n".join(lines)
+
+def test_multi_page_invoice_keeps_items_and_totals():
+    text = PAGE_SEPARATOR.join([page(1, range(11, 15), 1000), page(2, range(21, 25), 2000), page(3, range(31, 35), 3000)])
+    normalized = normalize_invoice_text(text, max_chars=None).splitlines()
+    for item in (11, 14, 21, 23, 24, 31, 33, 34):
+        assert f"{item} Widget {item} 1 100.00" in normalized
+    for total in ("Total 1000.00", "Total 2000.00", "Total 3000.00"):
+        assert total in normalized
+
+def test_repeated_headers_and_footers_are_kept_once():
+    text = PAGE_SEPARATOR.join([page(1, [1], 100), page(2, [2], 200), page(3, [3], 300)])
+    normalized = normalize_invoice_text(text, max_chars=None).splitlines()
+    for line in HEADER + ["Thank you for your business"]:
+        assert normalized.count(line) == 1
+    assert [line for line in normalized if line.startswith("Page ")] == ["Page 1 of 3"]
+
+def test_lines_that_only_look_alike_are_kept():
+    pages = ["Invoice No: 101\nItem A\nQty 5", "Invoice No: 102\nItem B\nQty 7"]
+    normalized = normalize_invoice_text(PAGE_SEPARATOR.join(pages), max_chars=None).splitlines()
+    assert normalized == ["Invoice No: 101", "Item A", "Qty 5", "Invoice No: 102", "Item B", "Qty 7"]
+
+def test_whitespace_and_blank_lines_are_collapsed():
+    assert normalize_invoice_text("  GSTIN:   27AAB \n\n\n Total   10.00  ") == "GSTIN: 27AAB\nTotal 10.00"
+
+def test_long_text_keeps_start_and_end():
+    text = "HEAD\n" + "\n".join(f"line {i}" for i in range(2000)) + "\nGrand Total 999.00"
+    normalized = normalize_invoice_text(text, max_chars=300)
+    assert normalized.startswith("HEAD") and normalized.endswith("Grand Total 999.00")
+    assert "[...]" in normalized and len(normalized) <= 300 + len("\n[...]\n")
+
+class EchoClient:
+    def __init__(self):
+        self.prompts = []
+    def generate(self, prompt):
+        self.prompts.append(prompt)
+        return '{"invoiceHeader": {}, "lineItems": []}'
+    def log_stats(self):
+        pass
+
+def test_cut_text_is_reported_with_the_file_name(capsys):
+    text = "\n".join(f"{i} Widget {i} 1 100.00" for i in range(1, 201))
+    client = EchoClient()
+    extract_data_with_gemini(None, text, client=client, max_chars=1000, pdf_path="/scans/statement.pdf")
+    assert "200 Widget 200" in client.prompts[0] and "100 Widget 100" not in client.prompts[0]
+    assert "WARNING: statement.pdf has" in capsys.readouterr().out
+    extract_data_with_gemini(None, text, client=client, max_chars=0, pdf_path="/scans/statement.pdf")
+    assert "100 Widget 100" in client.prompts[1]
+    assert "WARNING" not in capsys.readouterr().out
+
+def test_the_limit_reaches_gemini_from_the_batch(tmp_path, monkeypatch):
+    seen = []
+    monkeypatch.setattr(pipeline, "structure_invoice_text", lambda *args: seen.append(args[-1]) or ({}, "gemini"))
+    monkeypatch.setattr(pipeline, "extract_invoice_text", "text".format)  # Stays picklable for the process pool
+    pipeline.process_invoice_batch([str(tmp_path / "a.pdf")], None, cpu_workers=1, io_workers=1,
+                                   client=EchoClient(), max_chars=50000)
+    assert seen == [50000]
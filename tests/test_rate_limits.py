@@ -0,0 +1,28 @@
+import pipeline
+from extractor import get_gemini_client
+
+def test_shared_client_carries_the_limits():
+    client = get_gemini_client("key", requests_per_minute=15, tokens_per_minute=32000)
+    assert client.request_limiter.rate == 15 / 60.0
+    assert client.token_limiter.capacity == 32000
+    assert get_gemini_client("key", 15, 32000) is client
+    unlimited = get_gemini_client("key", 0, None)
+    assert unlimited is not client
+    assert unlimited.request_limiter is None and unlimited.token_limiter is None
+
+def test_batch_passes_the_limits_to_its_client(monkeypatch):
+    created = []
+
+    class Client:
+        def __init__(self, api_key, **kwargs):
+            created.append(kwargs)
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            pass
+        def log_stats(self):
+            pass
+
+    monkeypatch.setattr(pipeline, "GeminiClient", Client)
+    pipeline.process_invoice_batch([], "key", requests_per_minute=5, tokens_per_minute=1000)
+    assert created[0]["requests_per_minute"] == 5 and created[0]["tokens_per_minute"] == 1000
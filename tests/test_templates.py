@@ -0,0 +1,49 @@
+import os
+import sys
+
+import fitz  # PyMuPDF
+import templates
+from extractor import extract_text_from_pdf, structure_invoice_offline
+from templates import TemplateStore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from corpus import invoice_lines, _draw_lines
+
+def write_pdf(path, *pages):
+    doc = fitz.open()
+    for lines in pages:
+        _draw_lines(doc.new_page(), lines)
+    doc.save(path)
+    doc.close()
+
+def read(path):
+    return extract_text_from_pdf(path)
+
+def test_fields_on_pages_a_shorter_invoice_lacks_are_missing(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.sqlite3"))
+    statement = str(tmp_path / "statement.pdf")
+    write_pdf(statement, invoice_lines(1, 3, seed=1), ["Despatch details", "LR No: 4471"], ["Terms and conditions"])
+    data = structure_invoice_offline(read(statement), "local-only")[0]
+    data["logisticsDetails"]["lrNo"] = "4471"
+    assert store.learn(statement, data)
+    assert store.find([data["supplierDetails"]["gstin"]])["fields"]["logisticsDetails.lrNo"]["page"] == 1
+
+    single = str(tmp_path / "single.pdf")
+    write_pdf(single, invoice_lines(2, 3, seed=1))
+    parsed = store.parse_invoice(single, read(single))
+    assert parsed is not None and parsed["logisticsDetails"]["lrNo"] == "NA"
+    assert store.stats["hits"] == 1
+    store.close()
+
+def test_a_failing_template_is_rejected(tmp_path, monkeypatch):
+    store = TemplateStore(str(tmp_path / "templates.sqlite3"))
+    path = str(tmp_path / "invoice.pdf")
+    write_pdf(path, invoice_lines(1, 3, seed=1))
+    assert store.learn(path, structure_invoice_offline(read(path), "local-only")[0])
+
+    def broken(template, pages):
+        raise IndexError("list index out of range")
+    monkeypatch.setattr(templates, "apply_template", broken)
+    assert store.parse_invoice(path, read(path)) is None
+    assert store.stats["rejected"] == 1
+    store.close()
@@ -0,0 +1,77 @@
+import csv
+import os
+import shutil
+import sys
+import threading
+from cli import CheckpointManifest
+from dedup import DuplicateIndex
+from invoice_model import InvoiceRows
+from ledger_writer import open_ledger_writer
+import watch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from corpus import write_digital_invoice
+
+def test_files_are_ready_once_they_stop_changing(tmp_path):
+    watcher = watch.FolderWatcher([str(tmp_path)], settle=5)
+    pdf = tmp_path / "scan.pdf"
+    pdf.write_bytes(b"%PDF-1.4 partial")
+    (tmp_path / ".hidden.pdf").write_bytes(b"%PDF")
+    (tmp_path / "notes.txt").write_bytes(b"text")
+    assert watcher.poll(now=100) == []
+    assert watcher.poll(now=104) == []
+    pdf.write_bytes(b"%PDF-1.4 partial, now complete")  # Still being written: the wait starts again
+    assert watcher.poll(now=106) == []
+    assert watcher.poll(now=110) == []
+    assert [path for path, _ in watcher.poll(now=111)] == [str(pdf)]
+
+def run_watcher(tmp_path, inbox, expected, workers=2, **options):
+    """Runs watch_folder until `expected` files were handled; returns (processed, ledger rows)."""
+    output = str(tmp_path / "ledger.csv")
+    writer = open_ledger_writer(output)
+    manifest = CheckpointManifest(output + ".manifest.jsonl")
+    duplicates = DuplicateIndex(output + ".invoices.sqlite3")
+    stop = threading.Event()
+    original_write = writer.append_rows
+    handled = []
+
+    def append_rows(rows):
+        original_write(rows)
+        handled.append(rows)
+        if len(handled) >= expected:
+            stop.set()
+
+    writer.append_rows = append_rows
+    threading.Timer(30, stop.set).start()  # Never hang the test run
+    processed = watch.watch_folder([str(inbox)], None, writer, manifest, workers=workers, poll_interval=0.05, settle=0,
+                                   stop_event=stop, duplicates=duplicates, mode="local-only", **options)
+    writer.close()
+    manifest.close()
+    duplicates.close()
+    with open(output, newline="", encoding="utf-8") as f:
+        return processed, list(csv.DictReader(f))
+
+def test_two_copies_arriving_together_are_written_once(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    write_digital_invoice(str(inbox / "a.pdf"), 7, n_items=5)
+    shutil.copy(inbox / "a.pdf", inbox / "copy of a.pdf")
+    processed, rows = run_watcher(tmp_path, inbox, expected=2)
+    assert processed == 2
+    assert len(rows) == 5
+
+def test_a_file_moved_away_after_processing_does_not_stop_the_watcher(tmp_path, monkeypatch):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    for name in ("a.pdf", "b.pdf"):
+        (inbox / name).write_bytes(b"%PDF-1.4")
+
+    def process_and_move(path, api_key, details=None, **options):
+        details.update(pdf_hash=os.path.basename(path), fingerprint=None)
+        os.remove(path)
+        return InvoiceRows.from_structured({"invoiceHeader": {"invoiceNo": os.path.basename(path)}})
+
+    monkeypatch.setattr(watch, "process_invoice_file", process_and_move)
+    processed, rows = run_watcher(tmp_path, inbox, expected=2, workers=1)
+    assert processed == 2
+    assert sorted(row["Invoice No"] for row in rows) == ["a.pdf", "b.pdf"]
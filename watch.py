@@ -0,0 +1,162 @@
+# watch.py
+# Long-running ingestion of a folder that scanners drop PDFs into throughout the day. The folder
+# is polled (no extra dependency, and it works on network shares where change notifications are
+# unreliable) and a PDF is only picked up once its size and modification time have stopped
+# changing for `settle` seconds, so a scan that is still being copied is never read half-written.
+# Ready files go through extractor.process_invoice_file on a small thread pool as they arrive;
+# each invoice's rows are appended to the ledger as soon as it completes, and the ledger is
+# flushed whenever the queue runs dry. Completed files are recorded in the checkpoint manifest,
+# so a restarted watcher skips everything it processed before.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from extractor import process_invoice_file
+from pipeline import classify_failure, _retry_delay, DEFAULT_IO_WORKERS, DEFAULT_MAX_ATTEMPTS
+
+DEFAULT_POLL_SECONDS = 5.0
+DEFAULT_SETTLE_SECONDS = 10.0
+
+class FolderWatcher:
+    """Finds the PDFs in `directories` whose size and modification time have settled."""
+    def __init__(self, directories, recursive=False, settle=DEFAULT_SETTLE_SECONDS):
+        self.directories = [os.path.abspath(d) for d in directories]
+        self.recursive = recursive
+        self.settle = settle
+        self._seen = {}  # path -> ((size, mtime_ns), when that signature was first seen)
+
+    def _scan(self):
+        for directory in self.directories:
+            for root, dirs, files in os.walk(directory):
+                if not self.recursive:
+                    dirs.clear()
+                for name in files:
+                    # Hidden files and Office lock files are scanner or sync software at work.
+                    if name.lower().endswith(".pdf") and not name.startswith((".", "~$")):
+                        yield os.path.join(root, name)
+
+    def poll(self, now=None):
+        """Returns [(path, (size, mtime_ns))] of the PDFs that are ready, oldest first."""
+        now = time.monotonic() if now is None else now
+        ready, current = [], {}
+        for path in self._scan():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # Moved or deleted since the scan
+            signature = (stat.st_size, stat.st_mtime_ns)
+            previous = self._seen.get(path)
+            since = previous[1] if previous and previous[0] == signature else now
+            current[path] = (signature, since)
+            if stat.st_size and now - since >= self.settle:
+                ready.append((stat.st_mtime_ns, path, signature))
+        self._seen = current
+        return [(path, signature) for _, path, signature in sorted(ready)]
+
+def watch_folder(directories, api_key, writer, manifest, failures=None, recursive=False, workers=DEFAULT_IO_WORKERS,
+                 poll_interval=DEFAULT_POLL_SECONDS, settle=DEFAULT_SETTLE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 stop_event=None, duplicates=None, **options):
+    """
+    Processes the PDFs that appear in `directories` until `stop_event` is set (or Ctrl+C).
+    `writer` is a ledger_writer writer and `manifest` the CLI's CheckpointManifest; `failures`
+    (a pipeline.FailureManifest) records files that failed permanently or ran out of attempts.
+    Such a file is not tried again until it changes. Transient failures are retried after a
+    backoff. `options` (cache, mode, templates, page_policy, ocr_workers, requests_per_minute,
+    tokens_per_minute, max_chars) are passed on to process_invoice_file. Files being processed when the watcher stops are finished first.
+    Returns the number of files processed.
+    """
+    stop_event = stop_event or threading.Event()
+    watcher = FolderWatcher(directories, recursive, settle)
+    in_flight = {}   # future -> (path, signature, details from process_invoice_file)
+    attempts = {}    # path -> failed attempts so far
+    retry_at = {}    # path -> monotonic time of its next attempt
+    given_up = {}    # path -> signature it failed with
+    processed, unflushed = 0, False
+
+    def write(path, rows, details):
+        """
+        Writes a processed file's rows. Runs on this thread only, so the duplicate check is
+        repeated here: two copies of a PDF that were processed side by side are written once.
+        """
+        nonlocal processed, unflushed
+        pdf_hash, fingerprint = details.get("pdf_hash"), details.get("fingerprint")
+        if rows and duplicates is not None:
+            match = duplicates.match_file(pdf_hash) or duplicates.match_rows(rows)
+            if match:
+                print(f"Skipping {path}: {match['reason']} as {match['pdf_path']}, written {match['added']}.")
+                rows = []
+        writer.append_rows(rows)
+        if rows and duplicates is not None:
+            duplicates.add(rows, path, pdf_hash, fingerprint)
+        try:
+            manifest.mark_done(path, len(rows))
+        except OSError as e:  # Moved away as soon as it was read
+            print(f"Could not record {path} as processed: {e}")
+        if failures is not None: failures.resolve(path)
+        processed += 1
+        unflushed = True
+
+    def finish(path, signature, details, future):
+        """Writes a finished file or schedules its retry; an error here never stops the watcher."""
+        try:
+            rows = future.result()
+            attempts.pop(path, None)
+            retry_at.pop(path, None)
+            write(path, rows, details)
+        except Exception as e:
+            attempt = attempts.get(path, 0) + 1
+            if classify_failure(e) == "transient" and attempt < max_attempts:
+                attempts[path] = attempt
+                delay = _retry_delay(attempt)
+                retry_at[path] = time.monotonic() + delay
+                print(f"{os.path.basename(path)}: {e} (attempt {attempt} of {max_attempts}, retrying in {delay:.0f}s)")
+                return
+            print(f"ERROR processing {path}: {e}")
+            attempts.pop(path, None)
+            retry_at.pop(path, None)
+            given_up[path] = signature
+            try:
+                if failures is not None: failures.record(path, e, attempt)
+            except OSError as record_error:
+                print(f"Could not record the failure of {path}: {record_error}")
+
+    def is_done(path):
+        try:
+            return manifest.is_done(path)
+        except OSError:
+            return False
+
+    print(f"Watching {', '.join(watcher.directories)} for new PDFs (Ctrl+C to stop).")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while not stop_event.is_set():
+                busy = {path for path, _, _ in in_flight.values()}
+                now = time.monotonic()
+                for path, signature in watcher.poll():
+                    if len(in_flight) >= workers:
+                        break  # The rest are picked up on a later poll, so stopping never waits on a queue
+                    if path in busy or retry_at.get(path, 0) > now or given_up.get(path) == signature or is_done(path):
+                        continue
+                    given_up.pop(path, None)
+                    details = {}
+                    future = pool.submit(process_invoice_file, path, api_key, duplicates=duplicates, details=details, **options)
+                    in_flight[future] = (path, signature, details)
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finish(*in_flight.pop(future), future)
+                else:
+                    stop_event.wait(poll_interval)
+                if unflushed and not in_flight:
+                    try:
+                        writer.flush()
+                        unflushed = False
+                    except OSError as e:
+                        print(f"Could not write to {os.path.basename(writer.output_path)} yet, rows remain staged: {e}")
+        except KeyboardInterrupt:
+            print("Stopping; finishing the files in progress...")
+        for future in list(in_flight):
+            wait([future])
+            finish(*in_flight.pop(future), future)
+    return processed